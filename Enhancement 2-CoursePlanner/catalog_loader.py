@@ -0,0 +1,218 @@
+# ============================================================================
+# Author      : Milton Francisco
+# Version     : 1.2
+# Description : Streaming course catalog loader for the Advising Assistance Program
+# ============================================================================
+import csv
+import gc
+import io
+import mmap
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+# Bytes read per chunk, rounded down to the last full line
+CHUNK_SIZE = 1 << 20
+
+# Files smaller than this are not worth memory-mapping
+MMAP_THRESHOLD = 1 << 16
+
+UTF8_BOM = b'\xef\xbb\xbf'
+
+# -------------------------------
+# Validation Errors
+# -------------------------------
+class CatalogError:
+    __slots__ = ('file_name', 'line_number', 'message')
+
+    def __init__(self, file_name, line_number, message):
+        self.file_name = file_name
+        self.line_number = line_number
+        self.message = message
+
+    def __str__(self):
+        return f"{self.file_name}, line {self.line_number}: {self.message}"
+
+# -------------------------------
+# Reading
+# -------------------------------
+# Yields the file as blocks of complete lines, decoded. use_mmap maps the file
+# instead of reading it, None lets the file size decide.
+def read_chunks(file_name, chunk_size=CHUNK_SIZE, use_mmap=None):
+    with open(file_name, 'rb') as catalog_file:
+        size = os.fstat(catalog_file.fileno()).st_size
+        if use_mmap is None:
+            use_mmap = size >= MMAP_THRESHOLD
+        if size == 0:
+            return
+
+        if use_mmap:
+            with mmap.mmap(catalog_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                start = len(UTF8_BOM) if mapped[:len(UTF8_BOM)] == UTF8_BOM else 0
+                while start < size:
+                    end = mapped.rfind(b'\n', start, min(start + chunk_size, size)) + 1
+                    if end <= start:
+                        # A line longer than the chunk, or the last line without a newline
+                        end = mapped.find(b'\n', start + chunk_size) + 1 or size
+                    yield mapped[start:end].decode('utf-8')
+                    start = end
+        else:
+            remainder = catalog_file.read(len(UTF8_BOM))
+            if remainder == UTF8_BOM:
+                remainder = b''
+            while True:
+                block = catalog_file.read(chunk_size)
+                if not block:
+                    if remainder:
+                        yield remainder.decode('utf-8')
+                    return
+                block = remainder + block
+                end = block.rfind(b'\n') + 1
+                if end == 0:
+                    remainder = block
+                    continue
+                remainder = block[end:]
+                yield block[:end].decode('utf-8')
+
+# Parses one catalog file in a single pass, yielding for each chunk the rows as
+# (course number, title, prerequisites, line number) tuples and every problem
+# found, each with the line its record starts on, instead of stopping at the
+# first one. Quoted fields may span lines, and only \r and \n end a line.
+def parse_chunks(file_name, chunk_size=CHUNK_SIZE, use_mmap=None):
+    lines_before = 0
+    pending = []
+    quotes = 0
+    for chunk in read_chunks(file_name, chunk_size, use_mmap):
+        # An odd number of quotes so far means the chunk ends inside a quoted
+        # field, which is then parsed together with the next chunk. A stray
+        # quote in an unquoted field only makes the chunks larger.
+        pending.append(chunk)
+        quotes += chunk.count('"')
+        if quotes % 2:
+            continue
+        rows, errors, lines = _parse_rows(file_name, ''.join(pending), lines_before)
+        yield rows, errors
+        lines_before += lines
+        pending = []
+        quotes = 0
+    if pending:
+        rows, errors, _lines = _parse_rows(file_name, ''.join(pending), lines_before)
+        yield rows, errors
+
+# Rows and errors of a chunk of whole records, and the number of lines it held
+def _parse_rows(file_name, chunk, lines_before):
+    rows = []
+    errors = []
+    reader = csv.reader(io.StringIO(chunk, newline=''))
+    line_number = lines_before + 1
+    for row in reader:
+        if not row:
+            pass  # Blank line
+        elif len(row) < 2:
+            errors.append(CatalogError(file_name, line_number,
+                                       "Each line must have at least 2 parameters (course number and title)."))
+        else:
+            course_number = row[0].strip().upper()
+            if not course_number:
+                errors.append(CatalogError(file_name, line_number, "Missing course number."))
+            else:
+                prereqs = [prereq.upper() for prereq in map(str.strip, row[2:]) if prereq]
+                rows.append((course_number, row[1].strip(), prereqs, line_number))
+        line_number = lines_before + reader.line_num + 1
+    return rows, errors, reader.line_num
+
+# Whole-file form of parse_chunks for the worker processes
+def parse_file(file_name, chunk_size=CHUNK_SIZE, use_mmap=None):
+    rows = []
+    errors = []
+    with collection_paused():
+        for chunk_rows, chunk_errors in parse_chunks(file_name, chunk_size, use_mmap):
+            rows.extend(chunk_rows)
+            errors.extend(chunk_errors)
+    return rows, errors
+
+# Loading creates millions of small objects that all stay alive, so garbage
+# collection passes in the meantime would find nothing to free
+@contextmanager
+def collection_paused():
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+# -------------------------------
+# Loading
+# -------------------------------
+# Default course record when no factory is given
+def course_record(title, prereqs):
+    return (title, prereqs)
+
+# Loads one or more catalog files into {course number: factory(title, prereqs)}.
+# Several files are parsed side by side in a pool of up to processes workers,
+# one per core by default. Course numbers and prerequisite references are
+# interned, so each ID is stored once however often it is referenced.
+# Returns the courses and a list of CatalogErrors.
+def load_catalog(file_names, factory=course_record, processes=None, chunk_size=CHUNK_SIZE, use_mmap=None):
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    for file_name in file_names:
+        if not os.path.isfile(file_name):
+            raise FileNotFoundError(f"Could not open input file {file_name}.")
+
+    workers = min(processes or os.cpu_count() or 1, len(file_names))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = [[result] for result in pool.map(parse_file, file_names, [chunk_size] * len(file_names),
+                                                      [use_mmap] * len(file_names))]
+    else:
+        # In a single process each chunk is merged as soon as it is parsed,
+        # so only one chunk of raw rows is held at a time
+        parsed = [parse_chunks(file_name, chunk_size, use_mmap) for file_name in file_names]
+
+    with collection_paused():
+        courses, errors = _merge(file_names, parsed, factory)
+
+    errors.sort(key=lambda error: (file_names.index(error.file_name), error.line_number))
+    return courses, errors
+
+# Locations are kept as file index * LINES_PER_FILE + line number, one int
+# per reference instead of a tuple
+LINES_PER_FILE = 1 << 40
+
+def _merge(file_names, parsed, factory):
+    courses = {}
+    # First use of each prerequisite not defined yet at that point. Catalogs
+    # mostly list prerequisites first, so this stays small.
+    references = {}
+    errors = []
+    intern = sys.intern
+    for file_index, (file_name, chunks) in enumerate(zip(file_names, parsed)):
+        base = file_index * LINES_PER_FILE
+        for rows, file_errors in chunks:
+            errors.extend(file_errors)
+            for course_number, title, prereqs, line_number in rows:
+                course_number = intern(course_number)
+                if course_number in courses:
+                    errors.append(CatalogError(file_name, line_number,
+                                               f"Course {course_number} is defined more than once."))
+                    continue
+
+                if prereqs:
+                    prereqs = [intern(prereq) for prereq in prereqs]
+                    for prereq in prereqs:
+                        if prereq not in courses and prereq not in references:
+                            references[prereq] = base + line_number
+                courses[course_number] = factory(title, prereqs)
+
+    # References are checked once every file is in, since a prerequisite may be
+    # defined after the courses that need it
+    for prereq, location in references.items():
+        if prereq not in courses:
+            file_index, line_number = divmod(location, LINES_PER_FILE)
+            errors.append(CatalogError(file_names[file_index], line_number,
+                                       f"Prerequisite {prereq} does not have a corresponding course."))
+    return courses, errors
@@ -0,0 +1,305 @@
+# ============================================================================
+# Author      : Milton Francisco
+# Version     : 1.2
+# Description : Compiled on-disk course index for the Advising Assistance Program
+# ============================================================================
+from array import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+# Layout, every section starting on an 8 byte boundary:
+#   header          magic, format version, course count, stamp length
+#   stamp           JSON describing the source files the index was built from
+#   key offsets     count + 1 uint64, end of each course number in the key blob
+#   record offsets  count + 1 uint64, end of each record in the record blob
+#   key blob        UTF-8 course numbers in sorted order
+#   record blob     per course: title length, prerequisite count (uint32 each),
+#                   UTF-8 title, then the prerequisites as uint32 key positions
+# Numbers use the machine's byte order. The index is a local cache, and one
+# copied from a different kind of machine is simply rebuilt.
+MAGIC = b'CPIX'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('=4sIII')
+RECORD = struct.Struct('=II')
+
+INDEX_SUFFIX = '.idx'
+
+class IndexEntry:
+    __slots__ = ('key', 'value')
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+# Default course record when no factory is given
+def course_record(title, prereqs):
+    return (title, prereqs)
+
+# -------------------------------
+# Source Stamp
+# -------------------------------
+def file_hash(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_stamp(file_names):
+    files = []
+    for file_name in file_names:
+        try:
+            status = os.stat(file_name)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Could not open input file {file_name}.")
+        files.append({'name': os.path.abspath(file_name), 'size': status.st_size,
+                      'mtime_ns': status.st_mtime_ns, 'sha256': file_hash(file_name)})
+    return {'byteorder': sys.byteorder, 'files': files}
+
+# The stamp updated to the sources' modification times when they still match
+# it, None when they do not. Files whose size and modification time are
+# unchanged are not read; a new modification time with the same size falls
+# back to comparing the hash, so touching a file does not force a rebuild.
+# The times are taken before hashing, so a change made meanwhile is found
+# again next time.
+def current_stamp(stamp, file_names):
+    if stamp.get('byteorder') != sys.byteorder or len(stamp.get('files', [])) != len(file_names):
+        return None
+    files = []
+    for recorded, file_name in zip(stamp['files'], file_names):
+        try:
+            status = os.stat(file_name)
+        except OSError:
+            return None
+        if recorded['name'] != os.path.abspath(file_name) or recorded['size'] != status.st_size:
+            return None
+        if recorded['mtime_ns'] != status.st_mtime_ns:
+            if recorded['sha256'] != file_hash(file_name):
+                return None
+            recorded = {**recorded, 'mtime_ns': status.st_mtime_ns}
+        files.append(recorded)
+    return {**stamp, 'files': files}
+
+# -------------------------------
+# Building
+# -------------------------------
+# Writes courses ({course number: Course}) to index_path, replacing any older
+# index in one step so a reader never sees a partly written file
+def build_index(courses, index_path, stamp):
+    keys = sorted(courses)
+    position = {key: i for i, key in enumerate(keys)}
+
+    key_blob = bytearray()
+    key_offsets = array('Q', [0])
+    records = bytearray()
+    record_offsets = array('Q', [0])
+    for key in keys:
+        key_blob += key.encode('utf-8')
+        key_offsets.append(len(key_blob))
+
+        course = courses[key]
+        title = course.course_title.encode('utf-8')
+        prereqs = array('I', [position[prereq] for prereq in course.prereqs])
+        records += RECORD.pack(len(title), len(prereqs))
+        records += title
+        records += prereqs.tobytes()
+        record_offsets.append(len(records))
+
+    _write_index(index_path, len(keys), stamp,
+                 [key_offsets.tobytes(), record_offsets.tobytes(), bytes(key_blob), bytes(records)])
+
+# Writes an index with a new stamp and the sections of an existing one, e.g.
+# after a touched source file was found unchanged, so it is not hashed again
+def restamp_index(index, index_path, stamp):
+    _write_index(index_path, index.count, stamp, [index.mapped[index.sections_start:]])
+
+def _write_index(index_path, count, stamp, sections):
+    stamp_bytes = json.dumps(stamp).encode('utf-8')
+    temporary = f"{index_path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as index_file:
+        for section in [HEADER.pack(MAGIC, FORMAT_VERSION, count, len(stamp_bytes)), stamp_bytes] + sections:
+            index_file.write(section)
+            index_file.write(b'\0' * (-len(section) % 8))
+    os.replace(temporary, index_path)
+
+# -------------------------------
+# Reading
+# -------------------------------
+# Memory-mapped course index. Nothing is decoded up front: search is a binary
+# search over the sorted course numbers, and only the course found is built.
+# A truncated or damaged file raises ValueError.
+class CourseIndex:
+    def __init__(self, index_path, factory=course_record):
+        self.factory = factory
+        with open(index_path, 'rb') as index_file:
+            try:
+                self.mapped = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{index_path} is empty.")
+
+        try:
+            magic, version, count, stamp_length = HEADER.unpack_from(self.mapped, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{index_path} is not a course index of this version.")
+            self.count = count
+
+            offset = _aligned(HEADER.size)
+            self.stamp = json.loads(self.mapped[offset:offset + stamp_length])
+            offset = _aligned(offset + stamp_length)
+            self.sections_start = offset
+
+            view = self._view = memoryview(self.mapped)
+            self.key_offsets = view[offset:offset + 8 * (count + 1)].cast('Q')
+            offset = _aligned(offset + 8 * (count + 1))
+            self.record_offsets = view[offset:offset + 8 * (count + 1)].cast('Q')
+            offset = _aligned(offset + 8 * (count + 1))
+            self.keys_start = offset
+            self.records_start = _aligned(offset + self.key_offsets[count])
+            if self.records_start + self.record_offsets[count] > len(self.mapped):
+                raise ValueError(f"{index_path} is truncated.")
+        except (struct.error, ValueError, TypeError, IndexError) as e:
+            self.close()
+            if isinstance(e, ValueError):
+                raise
+            raise ValueError(f"{index_path} is damaged: {e}") from e
+
+    def close(self):
+        # Views into the map have to be released before it can be closed
+        for name in ('key_offsets', 'record_offsets', '_view'):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+                setattr(self, name, None)
+        self.mapped.close()
+
+    def __len__(self):
+        return self.count
+
+    def key_bytes(self, i):
+        return self.mapped[self.keys_start + self.key_offsets[i]:self.keys_start + self.key_offsets[i + 1]]
+
+    def key_at(self, i):
+        return self.key_bytes(i).decode('utf-8')
+
+    def course_at(self, i):
+        start = self.records_start + self.record_offsets[i]
+        title_length, prereq_count = RECORD.unpack_from(self.mapped, start)
+        start += RECORD.size
+        title = self.mapped[start:start + title_length].decode('utf-8')
+        start += title_length
+        prereqs = array('I', self.mapped[start:start + 4 * prereq_count])
+        return self.factory(title, [self.key_at(prereq) for prereq in prereqs])
+
+    # Position of the first course number >= key. UTF-8 bytes sort in the same
+    # order as the strings, so keys are compared without decoding them.
+    def bisect(self, key):
+        target = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_bytes(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Same result shape as AVLTree.search: an object with key and value, or None
+    def search(self, key):
+        i = self.bisect(key)
+        if i < self.count and self.key_at(i) == key:
+            return IndexEntry(key, self.course_at(i))
+        return None
+
+    # Same as AVLTree.rank, select and page. Positions in the index are ranks.
+    def rank(self, key):
+        return self.bisect(key)
+
+    def select(self, rank):
+        if not 0 <= rank < self.count:
+            raise IndexError(f"Rank {rank} is outside the index of {self.count} courses.")
+        return IndexEntry(self.key_at(rank), self.course_at(rank))
+
+    def page(self, number, size):
+        if number < 1 or size < 1:
+            raise ValueError("Pages are numbered from 1 and hold at least one course.")
+        start = (number - 1) * size
+        return [self.select(i) for i in range(start, min(start + size, self.count))]
+
+    # Entries with low <= key <= high in order, either bound may be None
+    def range_search(self, low=None, high=None, limit=None):
+        entries = []
+        start = self.bisect(low) if low is not None else 0
+        for key, course in self.items(start):
+            if (high is not None and key > high) or (limit is not None and len(entries) >= limit):
+                break
+            entries.append(IndexEntry(key, course))
+        return entries
+
+    # Entries whose key starts with prefix in order
+    def prefix_search(self, prefix, limit=None):
+        entries = []
+        for i in range(self.bisect(prefix), self.count):
+            key = self.key_at(i)
+            if not key.startswith(prefix) or (limit is not None and len(entries) >= limit):
+                break
+            entries.append(IndexEntry(key, self.course_at(i)))
+        return entries
+
+    # (course number, course) pairs in order, decoded one at a time
+    def items(self, start=0):
+        for i in range(start, self.count):
+            yield self.key_at(i), self.course_at(i)
+
+    # Every course decoded, e.g. to build the AVL tree or prerequisite graph
+    def to_dict(self):
+        return dict(self.items())
+
+# Opens the index for the given catalog files, rebuilding it first with
+# load_courses when it is missing, unreadable or the files have changed.
+# Returns (index, courses): courses is the loaded dict after a rebuild and None
+# when the index was current. index is None if the rebuilt index could not be written.
+def open_index(file_names, load_courses, factory=course_record, index_path=None):
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    index_path = index_path or file_names[0] + INDEX_SUFFIX
+
+    try:
+        index = CourseIndex(index_path, factory)
+        try:
+            stamp = current_stamp(index.stamp, file_names)
+        except (KeyError, TypeError, AttributeError) as e:
+            index.close()
+            raise ValueError(f"{index_path} has a damaged stamp: {e!r}") from e
+        if stamp == index.stamp:
+            return index, None
+        if stamp is not None:
+            # Touched but unchanged sources: record their new times once
+            try:
+                restamp_index(index, index_path, stamp)
+            except OSError as e:
+                print(f"Error updating course index stamp: {e}")
+                return index, None
+            index.close()
+            return CourseIndex(index_path, factory), None
+        index.close()
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"Rebuilding course index: {e}")
+
+    # Stamp the files before reading them, so a change made while loading
+    # leaves the index stale rather than wrongly current
+    stamp = source_stamp(file_names)
+    courses = load_courses(file_names)
+    try:
+        build_index(courses, index_path, stamp)
+        return CourseIndex(index_path, factory), courses
+    except OSError as e:
+        print(f"Error writing course index: {e}")
+        return None, courses
+
+def _aligned(offset):
+    return offset + (-offset % 8)
@@ -1,11 +1,34 @@
 # ============================================================================
 # Author      : Milton Francisco
-# Version     : 1.1
+# Version     : 1.2
 # Description : Advising Assistance Program
 # ============================================================================
-import csv
+from itertools import islice
+import re
+import threading
 
+from catalog_loader import load_catalog
+from course_index import open_index
+from course_search import TitleIndex, edit_distance, typo_limit
+from prereq_graph import PrereqGraph
+
+# Validation problems printed when a catalog does not load
+MAX_REPORTED_ERRORS = 20
+
+# Courses listed when a search has several results
+MAX_SUGGESTIONS = 10
+
+# Courses compared when looking for a mistyped course number
+NEIGHBOURS_SCANNED = 200
+
+# Course number range such as MATH200-MATH299
+COURSE_RANGE = re.compile(r"\s*([A-Z]+\d+\w*)\s*-\s*([A-Z]+\d+\w*)\s*")
+
+# __slots__ keeps one course or tree node to a few pointers instead of a
+# per-instance dict, which matters for catalogs with hundreds of thousands of courses
 class Course:
+    __slots__ = ('course_title', 'prereqs')
+
     def __init__(self, course_title, prereqs=None):
         self.course_title = course_title
         self.prereqs = prereqs if prereqs is not None else []
@@ -15,12 +38,15 @@ class Course:
         return f"{self.course_title}\nPrerequisites: {prereq_str}"
 
 class AVLNode:
+    __slots__ = ('key', 'value', 'left', 'right', 'height', 'size')
+
     def __init__(self, key, value):
         self.key = key            # Course number
         self.value = value        # Course object
         self.left = None
         self.right = None
         self.height = 1
+        self.size = 1             # Nodes in this subtree, for rank and select
 
 # -------------------------------
 # AVL Tree
@@ -34,6 +60,17 @@ class AVLTree:
             return 0
         return node.height
     
+    def get_size(self, node):
+        if not node:
+            return 0
+        return node.size
+
+    def __len__(self):
+        return self.get_size(self.root)
+
+    def __iter__(self):
+        return self.iter_from()
+
     def get_balance(self, node):
         if not node:
             return 0
@@ -47,9 +84,11 @@ class AVLTree:
         x.right = y
         y.left = T2
         
-        # Update heights
+        # Update heights and sizes
         y.height = 1 + max(self.get_height(y.left), self.get_height(y.right))
         x.height = 1 + max(self.get_height(x.left), self.get_height(x.right))
+        y.size = 1 + self.get_size(y.left) + self.get_size(y.right)
+        x.size = 1 + self.get_size(x.left) + self.get_size(x.right)
         
         return x
     
@@ -61,30 +100,87 @@ class AVLTree:
         y.left = x
         x.right = T2
         
-        # Update heights
+        # Update heights and sizes
         x.height = 1 + max(self.get_height(x.left), self.get_height(x.right))
         y.height = 1 + max(self.get_height(y.left), self.get_height(y.right))
+        x.size = 1 + self.get_size(x.left) + self.get_size(x.right)
+        y.size = 1 + self.get_size(y.left) + self.get_size(y.right)
         
         return y
     
+    # Builds a perfectly balanced tree in O(n) from (key, value) pairs sorted by key,
+    # replacing the current contents. The middle pair of each range becomes the root.
+    def bulk_load(self, sorted_items):
+        items = []
+        for key, value in sorted_items:
+            if items and key == items[-1][0]:
+                items[-1] = (key, value)  # Later duplicates win, like insert
+            elif items and key < items[-1][0]:
+                raise ValueError("bulk_load requires items sorted by key.")
+            else:
+                items.append((key, value))
+        self.root = self._build(items, 0, len(items))
+
+    # Recursion depth is only log2(n) here
+    def _build(self, items, low, high):
+        if low >= high:
+            return None
+        middle = (low + high) // 2
+        node = AVLNode(*items[middle])
+        node.left = self._build(items, low, middle)
+        node.right = self._build(items, middle + 1, high)
+        # A balanced subtree of m nodes has height m.bit_length()
+        node.height = (high - low).bit_length()
+        node.size = high - low
+        return node
+
     # Root Node Insertion
+    # Walks down without recursion, then rebalances the recorded path bottom-up
     def insert(self, key, value):
-        self.root = self._insert(self.root, key, value)
-    
-    # Recursive insertion of a node in the subtree 
-    def _insert(self, node, key, value):
-        # Normal BST insertion
-        if not node:
-            return AVLNode(key, value)
-        if key < node.key:
-            node.left = self._insert(node.left, key, value)
-        elif key > node.key:
-            node.right = self._insert(node.right, key, value)
+        path = []
+        node = self.root
+        while node:
+            if key == node.key:
+                node.value = value
+                return
+            path.append(node)
+            node = node.left if key < node.key else node.right
+
+        child = AVLNode(key, value)
+        if not path:
+            self.root = child
+            return
+        parent = path[-1]
+        if key < parent.key:
+            parent.left = child
         else:
-            node.value = value
-            return node
-        
-        # Update the node's height
+            parent.right = child
+
+        # Every subtree on the path gained the new node, including those above
+        # where rebalancing stops
+        for node in path:
+            node.size += 1
+
+        for index in range(len(path) - 1, -1, -1):
+            node = path[index]
+            old_height = node.height
+            subtree = self._rebalance(node, key)
+
+            # Reattach the subtree if a rotation gave it a new root
+            if subtree is not node:
+                if index == 0:
+                    self.root = subtree
+                elif path[index - 1].left is node:
+                    path[index - 1].left = subtree
+                else:
+                    path[index - 1].right = subtree
+
+            # Nothing above changes once a subtree keeps its height
+            if subtree.height == old_height:
+                break
+
+    # Update the node's height and rotate if the insertion of key unbalanced it
+    def _rebalance(self, node, key):
         node.height = 1 + max(self.get_height(node.left), self.get_height(node.right))
         
         # Check the balance factor to see if this node addition caused imbalance
@@ -110,66 +206,273 @@ class AVLTree:
         
         return node
     
+    # Iterative search for a key
     def search(self, key):
-        return self._search(self.root, key)
-    
-    # Recursive search for a key
-    def _search(self, node, key):
-        if not node:
-            return None
-        if key == node.key:
-            return node
-        elif key < node.key:
-            return self._search(node.left, key)
+        node = self.root
+        while node:
+            if key == node.key:
+                return node
+            node = node.left if key < node.key else node.right
+        return None
+
+    # Number of keys smaller than key, whether or not key is in the tree
+    def rank(self, key):
+        rank = 0
+        node = self.root
+        while node:
+            if key <= node.key:
+                node = node.left
+            else:
+                rank += self.get_size(node.left) + 1
+                node = node.right
+        return rank
+
+    # Node at position rank in key order, 0 being the smallest key
+    def select(self, rank):
+        if not 0 <= rank < len(self):
+            raise IndexError(f"Rank {rank} is outside the tree of {len(self)} courses.")
+        node = self.root
+        while True:
+            left = self.get_size(node.left)
+            if rank == left:
+                return node
+            if rank < left:
+                node = node.left
+            else:
+                rank -= left + 1
+                node = node.right
+
+    # Nodes on page number (from 1) of size nodes each, in key order
+    def page(self, number, size):
+        if number < 1 or size < 1:
+            raise ValueError("Pages are numbered from 1 and hold at least one course.")
+        return list(islice(self.iter_from(rank=(number - 1) * size), size))
+
+    # Nodes with low <= key <= high in order, either bound may be None. Only the
+    # path down to low and the nodes returned are visited, not the whole tree.
+    def range_search(self, low=None, high=None, limit=None):
+        nodes = []
+        for node in self.iter_from(low):
+            if (high is not None and node.key > high) or (limit is not None and len(nodes) >= limit):
+                break
+            nodes.append(node)
+        return nodes
+
+    # Nodes whose key starts with prefix in order, e.g. "MATH2" for all MATH2xx
+    def prefix_search(self, prefix, limit=None):
+        nodes = []
+        for node in self.iter_from(prefix):
+            if not node.key.startswith(prefix) or (limit is not None and len(nodes) >= limit):
+                break
+            nodes.append(node)
+        return nodes
+
+    # In-order generator starting at the first key >= key, or at position rank.
+    # Only the path down to the start is walked before the first node, and each
+    # later node costs O(1) amortized, so a page of k nodes costs O(log n + k).
+    # The stack holds the nodes still to be visited after their left subtrees.
+    def iter_from(self, key=None, rank=None):
+        stack = []
+        node = self.root
+        if rank is not None:
+            rank = max(rank, 0)
+            while node:
+                left = self.get_size(node.left)
+                if rank <= left:
+                    stack.append(node)
+                    if rank == left:
+                        break
+                    node = node.left
+                else:
+                    rank -= left + 1
+                    node = node.right
         else:
-            return self._search(node.right, key)
+            while node:
+                if key is None or node.key >= key:
+                    stack.append(node)
+                    node = node.left
+                else:
+                    node = node.right
+        while stack:
+            node = stack.pop()
+            yield node
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
     
     # Prints all of the course numbers & titles in order
-    def in_order_traversal(self, node):
-        if node:
-            self.in_order_traversal(node.left)
+    def in_order_traversal(self, node=None):
+        if node is None or node is self.root:
+            nodes = self.iter_from()
+        else:
+            # A subtree on its own, walked the same way
+            subtree = AVLTree()
+            subtree.root = node
+            nodes = subtree.iter_from()
+        for node in nodes:
             print(node.key, " - " , node.value.course_title)
-            self.in_order_traversal(node.right)
     
     # Hidden function to ensure tree structure populates correctly
     def print_tree_structure(self, node=None, level=0):
         if node is None:
             return
         self.print_tree_structure(node.right, level + 1)
-        print("          " * level + f"{node.key} (H={node.height})") # Displays visual representation of tree structure
+        print("          " * level + f"{node.key} (H={node.height}, N={node.size})") # Displays visual representation of tree structure
         self.print_tree_structure(node.left, level + 1)
             
 # -------------------------------
 # File Verification
 # -------------------------------
+# Accepts one file name or a list of them. Every problem in the files is
+# printed with its line number before the ValueError is raised.
 def load_courses(file_name):
-    courses = {}
-    try:
-        with open(file_name, newline='', encoding='utf-8-sig') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                # Each row must have at least course number and title.
-                if len(row) < 2:
-                    raise ValueError("Improper file format: Each line must have at least 2 parameters (course number and title).")
-                course_number = row[0].strip().upper()
-                course_title = row[1].strip()
-                
-                # Any additional fields are prerequisites
-                prereqs = [pr.strip() for pr in row[2:] if pr.strip() != '']
-
-                courses[course_number] = Course(course_title, prereqs)
+    courses, errors = load_catalog(file_name, factory=Course)
+    if errors:
+        for error in errors[:MAX_REPORTED_ERRORS]:
+            print(error)
+        if len(errors) > MAX_REPORTED_ERRORS:
+            print(f"... and {len(errors) - MAX_REPORTED_ERRORS} more.")
+        raise ValueError(f"Improper file format: {len(errors)} problem(s) found in the course data.")
 
-        # Check if all prereqs are valid course numbers in the file
-        missing_prereqs = {pr for course in courses.values() for pr in course.prereqs if pr not in courses}
-
-        if missing_prereqs:
-            print(f"Missing prerequisite(s): {', '.join(missing_prereqs)}")
-            raise ValueError("Improper file format: Some prerequisites do not have a corresponding course in the file.") 
-    except FileNotFoundError:
-        raise FileNotFoundError("Could not open input file.")
+    # Circular prerequisites could never be completed
+    cycle = PrereqGraph(courses).find_cycle()
+    if cycle:
+        print(f"Circular prerequisites: {' -> '.join(cycle)}")
+        raise ValueError("Improper file format: Some prerequisites are circular.")
     
     return courses
 
+# -------------------------------
+# Course Catalog
+# -------------------------------
+# Answers lookups from the compiled course index when there is one. The AVL
+# tree and prerequisite graph are only built the first time a choice needs them,
+# once even when several threads ask at the same time.
+class CourseCatalog:
+    def __init__(self, index=None, courses=None):
+        self.index = index
+        self._courses = courses
+        self._tree = None
+        self._graph = None
+        self._titles = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, file_names):
+        index, courses = open_index(file_names, load_courses, factory=Course)
+        return cls(index, courses)
+
+    def __len__(self):
+        return len(self.index) if self.index is not None else len(self.courses())
+
+    # {course number: Course}, decoded from the index if it was not loaded
+    def courses(self):
+        with self._lock:
+            if self._courses is None:
+                self._courses = self.index.to_dict()
+            return self._courses
+
+    @property
+    def tree(self):
+        with self._lock:
+            if self._tree is None:
+                # Build the AVL tree in one pass from the sorted course numbers
+                tree = AVLTree()
+                tree.bulk_load(self.index.items() if self.index is not None else sorted(self.courses().items()))
+                self._tree = tree
+            return self._tree
+
+    @property
+    def graph(self):
+        with self._lock:
+            if self._graph is None:
+                graph = PrereqGraph(self.courses())
+                graph.topological_order()  # Orders the graph before it is shared
+                self._graph = graph
+            return self._graph
+
+    # Lookups go to the index when there is one, the tree otherwise. Results
+    # have key and value either way.
+    @property
+    def _ordered(self):
+        return self.index if self.index is not None else self.tree
+
+    def search(self, key):
+        return self._ordered.search(key)
+
+    def range_search(self, low=None, high=None, limit=None):
+        return self._ordered.range_search(low, high, limit)
+
+    def prefix_search(self, prefix, limit=None):
+        return self._ordered.prefix_search(prefix, limit)
+
+    def rank(self, key):
+        return self._ordered.rank(key)
+
+    def select(self, rank):
+        return self._ordered.select(rank)
+
+    def page(self, number, size):
+        return self._ordered.page(number, size)
+
+    # Courses whose titles best match the words in query, typos allowed
+    def title_search(self, query, limit=MAX_SUGGESTIONS):
+        with self._lock:
+            if self._titles is None:
+                self._titles = TitleIndex(self.items())
+        return [self.search(key) for key, _score in self._titles.search(query, limit)]
+
+    # Courses an unknown course number or title may have meant: course numbers
+    # starting with it, else the closest course numbers, then title matches
+    def suggest(self, query, limit=MAX_SUGGESTIONS):
+        key = query.upper().strip()
+        matches = self.prefix_search(key, limit) if key else []
+        if not matches and any(character.isdigit() for character in key):
+            # Only something with a digit in it is taken for a course number
+            matches = self._near_keys(key, limit)
+
+        found = {match.key for match in matches}
+        for match in self.title_search(query, limit):
+            if len(matches) >= limit:
+                break
+            if match.key not in found:
+                matches.append(match)
+        return matches
+
+    # Course numbers a few typos from key, looked for among the courses that
+    # share the longest prefix with it
+    def _near_keys(self, key, limit):
+        for length in range(len(key) - 1, 0, -1):
+            neighbours = self.prefix_search(key[:length], NEIGHBOURS_SCANNED)
+            if neighbours:
+                break
+        else:
+            return []
+
+        most = typo_limit(key)
+        ranked = []
+        for neighbour in neighbours:
+            distance = edit_distance(key, neighbour.key, most)
+            if distance <= most:
+                ranked.append((distance, neighbour.key, neighbour))
+        ranked.sort(key=lambda entry: entry[:2])
+        return [neighbour for _distance, _key, neighbour in ranked[:limit]]
+
+    # (course number, course) pairs in sorted order
+    def items(self):
+        if self.index is not None:
+            return self.index.items()
+        return sorted(self.courses().items())
+
+def print_courses(entries, heading):
+    if not entries:
+        print("No matching courses.")
+        return
+    print(f"\n{heading}")
+    for entry in entries:
+        print(entry.key, " - " , entry.value.course_title)
+
 # -------------------------------
 # Main function
 # -------------------------------
@@ -180,23 +483,20 @@ def main():
     print()
     
     while True:
-        file_name = input("Please enter the file name that contains the course data (or type 'exit' to exit): ")
+        file_name = input("Please enter the file name(s) that contain the course data, separated by commas (or type 'exit' to exit): ")
         if file_name.lower() == "exit":
             print("Good bye.")
             return
         try:
             print("Loading courses...")
-            courses = load_courses(file_name)
+            # Several files are parsed in parallel. Unchanged files are not parsed
+            # at all, the compiled index saved next to the first one is used.
+            catalog = CourseCatalog.open([name.strip() for name in file_name.split(',') if name.strip()])
             break
         except Exception as e:
             print(e)
             print("Please try again or type 'exit' to quit.\n")
     
-    # Build the AVL tree
-    tree = AVLTree()
-    for course_number, course in courses.items():
-        tree.insert(course_number, course)
-    
     print("\nWelcome to the course planner.")
     
     # Main Menu
@@ -204,33 +504,77 @@ def main():
         print("\nMain Menu:")
         print("  1. Print Course List")
         print("  2. Find Specific Course Details")
+        print("  4. List All Prerequisites for a Course")
+        print("  5. Plan Semesters")
+        print("  6. Search Courses")
         print("  9. Exit")
         choice = input("\nWhat would you like to do? ")
         
         if choice == "1":
-            # In-order traversal prints courses in sorted order.
+            # Courses are printed in sorted order.
             print("\nCourse List:")
-            tree.in_order_traversal(tree.root)
+            for key, course in catalog.items():
+                print(key, " - " , course.course_title)
 
             input("\nPress Enter to continue...")
         
         elif choice == "2":
-            course_choice = input("What course do you want to know about? ").upper().strip()
-            course = tree.search(course_choice)
+            course_text = input("What course do you want to know about? ")
+            course_choice = course_text.upper().strip()
+            course = catalog.search(course_choice)
             if course:
                 print("\nCourse Details:")
                 print(course.key, "- ", course.value)
                 
             else:
                 print(f"Course {course_choice} not found.")
+                # Partial course numbers, typos and titles still find courses
+                print_courses(catalog.suggest(course_text), "Did you mean:")
                    
             input("\nPress Enter to continue...")
 
         elif choice == "3":
             # Hidden choice to display tree structure
-            tree.print_tree_structure(tree.root)
+            catalog.tree.print_tree_structure(catalog.tree.root)
             input("\nPress Enter to continue...")
         
+        elif choice == "4":
+            course_choice = input("What course do you want to take? ").upper().strip()
+            if catalog.search(course_choice):
+                # Listed in an order they can be taken in
+                prereqs = catalog.graph.all_prereqs(course_choice)
+                print(f"\nCourses needed before {course_choice}: {', '.join(prereqs) if prereqs else 'None'}")
+            else:
+                print(f"Course {course_choice} not found.")
+
+            input("\nPress Enter to continue...")
+
+        elif choice == "5":
+            course_choice = input("Which course do you want to plan for (leave blank for every course)? ").upper().strip()
+            max_courses = input("How many courses can be taken per semester? ").strip()
+            if course_choice and not catalog.search(course_choice):
+                print(f"Course {course_choice} not found.")
+            elif not max_courses.isdigit() or int(max_courses) < 1:
+                print("Please enter a whole number of courses.")
+            else:
+                semesters = catalog.graph.schedule(targets=[course_choice] if course_choice else None, max_courses=int(max_courses))
+                print()
+                for number, semester in enumerate(semesters, start=1):
+                    print(f"Semester {number}: {', '.join(semester)}")
+
+            input("\nPress Enter to continue...")
+
+        elif choice == "6":
+            query = input("Enter title words, the start of a course number, or a range such as MATH200-MATH299: ")
+            course_range = COURSE_RANGE.fullmatch(query.upper())
+            if course_range:
+                low, high = sorted(course_range.groups())
+                print_courses(catalog.range_search(low, high), f"Courses from {low} to {high}:")
+            else:
+                print_courses(catalog.suggest(query), "Matching courses:")
+
+            input("\nPress Enter to continue...")
+
         elif choice == "9":
             print("Thank you for using the course planner!")
             break
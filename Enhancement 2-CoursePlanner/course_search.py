@@ -0,0 +1,194 @@
+# ============================================================================
+# Author      : Milton Francisco
+# Version     : 1.2
+# Description : Course title search for the Advising Assistance Program
+# ============================================================================
+from bisect import bisect_left
+import heapq
+from itertools import combinations
+import math
+import re
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+# Words shorter than this are only matched exactly, a typo in a short word
+# matches too many unrelated ones
+MIN_FUZZY_LENGTH = 4
+
+# Completions tried for a possibly shortened or unfinished query word, and the
+# length it needs to be completed at all
+MAX_COMPLETIONS = 10
+MIN_COMPLETION_LENGTH = 3
+
+# Words of a query beyond this are ignored
+MAX_QUERY_WORDS = 6
+
+# Weights of a word matched by completing it or by correcting a typo,
+# relative to an exact match
+COMPLETION_WEIGHT = 0.8
+TYPO_WEIGHT = 0.6
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+# Typo candidates checked with edit_distance per query word, those sharing
+# the most trigrams with it first
+MAX_TYPO_CHECKS = 8
+
+# Levenshtein distance counting a swap of neighbouring letters as one edit.
+# Only cells within limit of the diagonal are computed, and the result is
+# limit + 1 once the distance is certain to exceed limit.
+def edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    beyond = limit + 1
+    previous2 = None
+    previous = [j if j <= limit else beyond for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [beyond] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            value = previous[j - 1] + (a[i - 1] != b[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1] and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value if value < beyond else beyond
+        if min(current) > limit:
+            return beyond
+        previous2, previous = previous, current
+    return previous[-1]
+
+# Edits allowed for a word of this length
+def typo_limit(word):
+    return 1 if len(word) <= 5 else 2
+
+def _trigrams(word):
+    padded = f"^{word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# -------------------------------
+# Title Index
+# -------------------------------
+# Inverted index from title words to the sets of courses using them. Courses
+# are numbered in course-number order, and queries are answered with set
+# operations that run in C rather than loops over the courses. Typos are
+# found through the trigrams of the distinct words, which is a much smaller
+# set than the titles, kept apart by word length so only words of a possible
+# length are counted.
+class TitleIndex:
+    def __init__(self, items):
+        self.course_numbers = []
+        postings = {}
+        for position, (course_number, course) in enumerate(items):
+            self.course_numbers.append(course_number)
+            for word in set(tokenize(course.course_title)):
+                posting = postings.get(word)
+                if posting is None:
+                    posting = postings[word] = set()
+                posting.add(position)
+        self.postings = postings
+        self.words = sorted(postings)  # For completing words
+
+        self.trigrams = {}
+        for word in self.words:
+            if len(word) >= MIN_FUZZY_LENGTH and not word.isdigit():
+                for gram in _trigrams(word):
+                    self.trigrams.setdefault((gram, len(word)), []).append(word)
+
+    def __len__(self):
+        return len(self.course_numbers)
+
+    # Rarer words say more about a title
+    def _weight(self, word):
+        return math.log(1 + len(self.course_numbers) / len(self.postings[word]))
+
+    # Index words matching a query word with their weights: the word itself,
+    # words starting with it, and words one or two typos away
+    def variants(self, word):
+        matches = {}
+        if word in self.postings:
+            matches[word] = 1.0
+        if len(word) >= MIN_COMPLETION_LENGTH:
+            start = bisect_left(self.words, word)
+            for candidate in self.words[start:start + MAX_COMPLETIONS + 1]:
+                if not candidate.startswith(word):
+                    break
+                matches.setdefault(candidate, COMPLETION_WEIGHT)
+        if len(word) >= MIN_FUZZY_LENGTH and word not in self.postings:
+            limit = typo_limit(word)
+            grams = _trigrams(word)
+            # Each edit changes at most three trigrams
+            needed = len(grams) - 3 * limit
+            shared = {}
+            for length in range(max(len(word) - limit, MIN_FUZZY_LENGTH), len(word) + limit + 1):
+                for gram in grams:
+                    for candidate in self.trigrams.get((gram, length), ()):
+                        shared[candidate] = shared.get(candidate, 0) + 1
+            likely = sorted((candidate for candidate, count in shared.items() if count >= needed),
+                            key=lambda candidate: (-shared[candidate], candidate))
+            for candidate in likely[:MAX_TYPO_CHECKS]:
+                if candidate not in matches:
+                    distance = edit_distance(word, candidate, limit)
+                    if distance <= limit:
+                        matches[candidate] = TYPO_WEIGHT * (1 - distance / (len(word) + 1))
+        return matches
+
+    # Up to limit (course number, score) pairs. Titles matching more of the
+    # query words come first, then higher scores, then lower course numbers.
+    # Each query word adds the weight of its best match in a title.
+    def search(self, query, limit=10):
+        words = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_WORDS]
+        if not words or limit < 1:
+            return []
+
+        # (weight, courses) for each matching index word, best first, per query word
+        matched = []
+        for word in words:
+            variants = self.variants(word)
+            if variants:
+                matched.append(sorted(((weight * self._weight(variant), self.postings[variant])
+                                       for variant, weight in variants.items()),
+                                      key=lambda pair: -pair[0]))
+        if not matched:
+            return []
+
+        # Titles matching every word come first, so when there are enough of them
+        # no other title is looked at. Otherwise titles matching all but one word
+        # are added, and so on.
+        covered = [pairs[0][1] if len(pairs) == 1 else set().union(*(courses for _weight, courses in pairs))
+                   for pairs in matched]
+        for required in range(len(covered), 0, -1):
+            candidates = set().union(*(set.intersection(*subset) if required > 1 else subset[0]
+                                       for subset in combinations(covered, required)))
+            if len(candidates) >= limit:
+                break
+
+        # Split the candidates into groups sharing a score, with one set operation
+        # per group and index word instead of any work per course
+        groups = [(0, 0.0, candidates)]
+        for pairs in matched:
+            split = []
+            for count, score, courses in groups:
+                for weight, variant in pairs:
+                    hits = courses & variant
+                    if hits:
+                        split.append((count + 1, score + weight, hits))
+                        courses = courses - hits
+                        if not courses:
+                            break
+                if courses:
+                    split.append((count, score, courses))
+            groups = split
+        groups.sort(key=lambda group: (-group[0], -group[1]))
+
+        results = []
+        for _count, score, courses in groups:
+            for position in heapq.nsmallest(limit - len(results), courses):
+                results.append((self.course_numbers[position], round(score, 3)))
+            if len(results) >= limit:
+                break
+        return results
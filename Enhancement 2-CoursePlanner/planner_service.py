@@ -0,0 +1,397 @@
+# ============================================================================
+# Author      : Milton Francisco
+# Version     : 1.2
+# Description : Batch and HTTP/JSON front ends for the Advising Assistance Program
+# ============================================================================
+#
+#   python planner_service.py batch courses.csv --queries queries.txt --output results.json
+#   python planner_service.py serve courses.csv --port 8080 --workers 4
+#   python planner_service.py bench courses.csv --requests 20000 --clients 16
+#
+# Every worker opens the compiled course index, so all of them share one copy
+# of the catalog through the operating system's page cache.
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from course_planner import MAX_SUGGESTIONS, CourseCatalog
+
+DEFAULT_PORT = 8080
+
+# Courses returned by a listing that does not give a limit
+DEFAULT_PAGE_SIZE = 100
+
+# Requests sent to a worker process at a time in batch mode
+BATCH_CHUNK_SIZE = 256
+
+# Course lookups per second the service should sustain per worker on the
+# benchmark's request mix. bench reports whether it was reached.
+TARGET_REQUESTS_PER_SECOND = 1000
+
+# -------------------------------
+# Engine
+# -------------------------------
+# A course number a request refers to is not in the catalog
+class CourseNotFound(KeyError):
+    def __init__(self, course_number):
+        super().__init__(f"Course {course_number} not found.")
+        self.course_number = course_number
+
+# Non-interactive access to a catalog. Every call returns plain data that can be
+# written as JSON, and nothing is printed. Several threads can share one engine.
+class PlannerEngine:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.operations = {
+            'course': self.course,
+            'courses': self.courses,
+            'search': self.search,
+            'range': self.range,
+            'prereqs': self.prereqs,
+            'plan': self.plan,
+        }
+
+    @classmethod
+    def open(cls, file_names):
+        return cls(CourseCatalog.open(file_names))
+
+    def course(self, course):
+        course_number = course.upper().strip()
+        entry = self.catalog.search(course_number)
+        if entry is None:
+            raise CourseNotFound(course_number)
+        return course_json(entry)
+
+    # Courses in order from the course number start, or page number page of
+    # limit courses each
+    def courses(self, start=None, limit=DEFAULT_PAGE_SIZE, page=None):
+        if page is not None:
+            return [course_json(entry) for entry in self.catalog.page(_count(page), _count(limit))]
+        return [course_json(entry) for entry in self.catalog.range_search(_upper(start), None, _count(limit))]
+
+    def search(self, query, limit=MAX_SUGGESTIONS):
+        return [course_json(entry) for entry in self.catalog.suggest(query, _count(limit))]
+
+    def range(self, low=None, high=None, limit=DEFAULT_PAGE_SIZE):
+        return [course_json(entry) for entry in self.catalog.range_search(_upper(low), _upper(high), _count(limit))]
+
+    def prereqs(self, course):
+        return self.catalog.graph.all_prereqs(self.course(course)['course_number'])
+
+    def plan(self, targets=None, completed=(), max_courses=4, max_credits=None):
+        if isinstance(targets, str):
+            targets = [targets]
+        if isinstance(completed, str):
+            completed = [completed]
+        targets = [self.course(target)['course_number'] for target in targets] if targets else None
+        return self.catalog.graph.schedule(targets=targets,
+                                           completed=[self.course(course)['course_number'] for course in completed],
+                                           max_courses=_count(max_courses),
+                                           max_credits=_count(max_credits) if max_credits is not None else None)
+
+    # Answers one request such as {"op": "course", "course": "CSCI101"} with
+    # {"ok": true, "result": ...} or {"ok": false, "error": ...}. A course that is
+    # not found, by any operation, comes back with suggestions.
+    def handle(self, request):
+        if not isinstance(request, dict) or request.get('op') not in self.operations:
+            return {'ok': False, 'error': f"Unknown operation. Use one of: {', '.join(self.operations)}."}
+        arguments = {key: value for key, value in request.items() if key != 'op'}
+        try:
+            return {'ok': True, 'result': self.operations[request['op']](**arguments)}
+        except CourseNotFound as e:
+            return {'ok': False, 'error': e.args[0],
+                    'suggestions': [entry.key for entry in self.catalog.suggest(e.course_number)]}
+        except KeyError as e:
+            return {'ok': False, 'error': e.args[0] if e.args else str(e)}
+        except (AttributeError, TypeError, ValueError) as e:
+            # Arguments of the wrong kind, such as a number for a course number
+            return {'ok': False, 'error': str(e)}
+
+def course_json(entry):
+    return {'course_number': entry.key, 'title': entry.value.course_title, 'prereqs': list(entry.value.prereqs)}
+
+def _upper(course_number):
+    return course_number.upper().strip() if course_number is not None else None
+
+def _count(value):
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Expected a whole number, got {value!r}.")
+    if count < 1:
+        raise ValueError(f"Expected a positive number, got {count}.")
+    return count
+
+# -------------------------------
+# Batch Mode
+# -------------------------------
+# One query per line: a JSON request, or a bare course number or title words
+# which are looked up as a course
+def answer_query(engine, line):
+    line = line.strip()
+    if not line.startswith('{'):
+        return engine.handle({'op': 'course', 'course': line})
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return {'ok': False, 'error': f"Invalid JSON: {e}"}
+    return engine.handle(request)
+
+# Answers every query in queries_path and writes the responses, in the same
+# order, to output_path as a JSON array. With more than one worker the queries
+# are spread over a process pool.
+def run_batch(file_names, queries_path, output_path, workers=None):
+    engine = PlannerEngine.open(file_names)  # Builds the index once for the workers
+    with open(queries_path, encoding='utf-8') as queries_file:
+        lines = [line for line in queries_file if line.strip()]
+
+    workers = min(workers or os.cpu_count() or 1, max(1, len(lines) // BATCH_CHUNK_SIZE))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_engine,
+                                 initargs=(file_names,)) as pool:
+            _write_json_array(output_path, pool.map(_answer_in_worker, lines, chunksize=BATCH_CHUNK_SIZE))
+    else:
+        _write_json_array(output_path, (answer_query(engine, line) for line in lines))
+    return len(lines)
+
+_worker_engine = None
+
+def _open_worker_engine(file_names):
+    global _worker_engine
+    _worker_engine = PlannerEngine.open(file_names)
+
+def _answer_in_worker(line):
+    return answer_query(_worker_engine, line)
+
+# Written one response per line as they arrive instead of building one string
+def _write_json_array(output_path, responses):
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        output_file.write('[')
+        for i, response in enumerate(responses):
+            output_file.write(',\n' if i else '\n')
+            output_file.write(json.dumps(response))
+        output_file.write('\n]\n')
+
+# -------------------------------
+# HTTP Service
+# -------------------------------
+# GET /courses/CSCI101          one course
+# GET /courses?start=&limit=    courses in order
+# GET /courses?page=&limit=     one page of the course list
+# GET /search?q=&limit=         course number, prefix and title search
+# GET /range?low=&high=&limit=  courses in a range of course numbers
+# GET /prereqs/CSCI101          every course needed first
+# GET /plan?target=&completed=&max_courses=&max_credits=
+# POST /batch                   JSON array of requests as in batch mode
+class PlannerRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so clients reuse connections
+    # Headers and body go out in separate writes, which Nagle's algorithm would
+    # hold back for the client's delayed acknowledgement on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        query = {key: values if key in ('target', 'completed') else values[-1]
+                 for key, values in parse_qs(url.query).items()}
+
+        if len(parts) == 2 and parts[0] in ('courses', 'prereqs'):
+            request = {'op': 'course' if parts[0] == 'courses' else 'prereqs', 'course': parts[1]}
+        elif len(parts) == 1 and parts[0] in ('courses', 'search', 'range'):
+            request = dict(query, op=parts[0])
+            if 'q' in request:
+                request['query'] = request.pop('q')
+        elif len(parts) == 1 and parts[0] == 'plan':
+            request = {'op': 'plan', **{('targets' if key == 'target' else key): value for key, value in query.items()}}
+        else:
+            self._send(404, {'ok': False, 'error': f"Unknown path {url.path}."})
+            return
+        response = self.server.engine.handle(request)
+        self._send(_status(response), response)
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip('/') != '/batch':
+            self._send(404, {'ok': False, 'error': f"Unknown path {self.path}."})
+            return
+        try:
+            requests = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as e:
+            self._send(400, {'ok': False, 'error': f"Invalid JSON: {e}"})
+            return
+        if not isinstance(requests, list):
+            self._send(400, {'ok': False, 'error': "Expected a JSON array of requests."})
+            return
+        self._send(200, [self.server.engine.handle(request) for request in requests])
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # One line per request would cost more than answering it
+
+# A course that is not found is 404 from every endpoint, any other failed
+# request is the client's mistake
+def _status(response):
+    if response['ok']:
+        return 200
+    return 404 if 'suggestions' in response else 400
+
+# One thread per connection, all reading the same engine
+class PlannerServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, engine, reuse_port=False):
+        self.engine = engine
+        # Lets several worker processes listen on the same port, the kernel
+        # spreads the connections over them
+        self.allow_reuse_port = reuse_port
+        super().__init__(address, PlannerRequestHandler)
+
+# Serves the catalog on host:port with a pool of worker processes, one per core
+# by default. Workers share the port where the platform allows it (SO_REUSEPORT),
+# otherwise the service runs in a single process.
+def serve(file_names, host='127.0.0.1', port=DEFAULT_PORT, workers=None):
+    engine = PlannerEngine.open(file_names)  # Builds the index once for the workers
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        print("Worker processes need SO_REUSEPORT, serving from one process.")
+        workers = 1
+
+    processes = [multiprocessing.Process(target=_serve_worker, args=(file_names, host, port), daemon=True)
+                 for _ in range(workers - 1)]
+    for process in processes:
+        process.start()
+    with PlannerServer((host, port), engine, reuse_port=workers > 1) as server:
+        print(f"Serving {len(engine.catalog)} courses on http://{host}:{server.server_address[1]} with {workers} worker(s)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                process.terminate()
+
+def _serve_worker(file_names, host, port, ready=None):
+    with PlannerServer((host, port), PlannerEngine.open(file_names), reuse_port=True) as server:
+        if ready is not None:
+            ready.set()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+# -------------------------------
+# Benchmark
+# -------------------------------
+# Starts the service and sends it course lookups from concurrent keep-alive
+# clients. Returns the measured requests per second.
+def benchmark(file_names, requests=20000, clients=16, workers=None, port=DEFAULT_PORT, seed=0):
+    workers = workers or os.cpu_count() or 1
+    catalog = CourseCatalog.open(file_names)  # Builds the index once for the workers
+
+    servers = []
+    for _ in range(workers):
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=_serve_worker, args=(file_names, '127.0.0.1', port, ready),
+                                         daemon=True)
+        server.start()
+        servers.append((server, ready))
+    for server, ready in servers:
+        if not ready.wait(600):
+            for server, _ready in servers:
+                server.terminate()
+            raise RuntimeError("The service did not start.")
+
+    course_numbers = _sample_course_numbers(catalog, 1000, seed)
+    per_client = max(1, requests // clients)
+    failures = []
+
+    def client(client_seed):
+        chooser = random.Random(client_seed)
+        connection = HTTPConnection('127.0.0.1', port)
+        try:
+            for _ in range(per_client):
+                connection.request('GET', f"/courses/{chooser.choice(course_numbers)}")
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failures.append(response.status)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client, args=(seed + i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for server, _ready in servers:
+        server.terminate()
+
+    total = per_client * clients
+    rate = total / elapsed
+    target = TARGET_REQUESTS_PER_SECOND * workers
+    print(f"{total} requests from {clients} clients to {workers} worker(s) in {elapsed:.2f} s: "
+          f"{rate:.0f} requests/s, target {target} ({'met' if rate >= target else 'missed'})")
+    if failures:
+        print(f"{len(failures)} request(s) failed")
+    return rate
+
+def _sample_course_numbers(catalog, count, seed):
+    chooser = random.Random(seed)
+    if catalog.index is not None:
+        return [catalog.index.key_at(chooser.randrange(len(catalog.index))) for _ in range(count)]
+    return chooser.choices(sorted(catalog.courses()), k=count)
+
+# -------------------------------
+# Command Line
+# -------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Batch and HTTP/JSON access to the course planner")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch = commands.add_parser('batch', help="answer a file of queries")
+    batch.add_argument('catalogs', nargs='+', help="course data file(s)")
+    batch.add_argument('--queries', required=True, help="one JSON request, course number or title per line")
+    batch.add_argument('--output', required=True, help="JSON file for the responses")
+    batch.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+
+    service = commands.add_parser('serve', help="run the HTTP/JSON service")
+    service.add_argument('catalogs', nargs='+', help="course data file(s)")
+    service.add_argument('--host', default='127.0.0.1')
+    service.add_argument('--port', type=int, default=DEFAULT_PORT)
+    service.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+
+    bench = commands.add_parser('bench', help="measure the service's requests per second")
+    bench.add_argument('catalogs', nargs='+', help="course data file(s)")
+    bench.add_argument('--requests', type=int, default=20000)
+    bench.add_argument('--clients', type=int, default=16)
+    bench.add_argument('--port', type=int, default=DEFAULT_PORT)
+    bench.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+
+    args = parser.parse_args()
+    if args.command == 'batch':
+        count = run_batch(args.catalogs, args.queries, args.output, args.workers)
+        print(f"Answered {count} queries into {args.output}")
+    elif args.command == 'serve':
+        serve(args.catalogs, args.host, args.port, args.workers)
+    else:
+        benchmark(args.catalogs, args.requests, args.clients, args.workers, args.port)
+
+if __name__ == "__main__":
+    main()
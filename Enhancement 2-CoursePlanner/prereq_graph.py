@@ -0,0 +1,258 @@
+# ============================================================================
+# Author      : Milton Francisco
+# Version     : 1.2
+# Description : Prerequisite graph for the Advising Assistance Program
+# ============================================================================
+import gc
+import heapq
+
+# Credits assumed for a course when the catalog does not list them
+DEFAULT_CREDITS = 3
+
+# -------------------------------
+# Prerequisite Graph
+# -------------------------------
+# Courses are numbered 0..n-1 in sorted course-number order and every edge runs
+# from a course to one of its prerequisites. All passes are iterative, so deep
+# prerequisite chains cannot hit Python's recursion limit.
+class PrereqGraph:
+    def __init__(self, courses):
+        # The graph is hundreds of thousands of small lists that all stay alive, so
+        # collection passes while building them would only cost time
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self._build(courses)
+        finally:
+            if collecting:
+                gc.enable()
+
+        # Topological position of each course, None while the graph has a cycle
+        self.order = None
+        self.position = None
+
+        # Transitive prerequisites of the courses asked about so far
+        self._closures = {}
+
+    def _build(self, courses):
+        self.course_numbers = sorted(courses)
+        self.index = index = {course_number: i for i, course_number in enumerate(self.course_numbers)}
+
+        self.prereqs = []
+        missing = set()
+        lookup = index.__getitem__
+        for course_number in self.course_numbers:
+            prereqs = courses[course_number].prereqs
+            try:
+                direct = list(map(lookup, prereqs))
+            except KeyError:
+                missing.update(prereq for prereq in prereqs if prereq not in index)
+                direct = [index[prereq] for prereq in prereqs if prereq in index]
+            if len(direct) > 1:
+                direct = list(dict.fromkeys(direct))  # Drop repeated prereqs
+            self.prereqs.append(direct)
+        if missing:
+            raise ValueError(f"Unknown prerequisite(s): {', '.join(sorted(missing))}")
+
+        # Reverse edges, from a course to the courses that require it
+        self.dependents = [[] for _ in self.course_numbers]
+        appends = [dependents.append for dependents in self.dependents]
+        for course, direct in enumerate(self.prereqs):
+            for prereq in direct:
+                appends[prereq](course)
+
+    # Kahn's algorithm: courses whose prerequisites are all placed are placed next.
+    # Courses on or behind a cycle are never placed.
+    def _kahn(self):
+        remaining = [len(direct) for direct in self.prereqs]
+        order = [course for course, count in enumerate(remaining) if count == 0]
+        head = 0
+        while head < len(order):
+            for dependent in self.dependents[order[head]]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    order.append(dependent)
+            head += 1
+        return order, remaining
+
+    # Returns one circular prerequisite chain as course numbers, e.g.
+    # ['CSCI200', 'CSCI300', 'CSCI200'] when each requires the next, or None
+    def find_cycle(self):
+        order, remaining = self._kahn()
+        if len(order) == len(self.course_numbers):
+            return None
+
+        # Every unplaced course has an unplaced prerequisite, so following those
+        # from any unplaced course has to come back around a cycle
+        course = next(course for course, count in enumerate(remaining) if count > 0)
+        step = {}
+        while course not in step:
+            step[course] = next(prereq for prereq in self.prereqs[course] if remaining[prereq] > 0)
+            course = step[course]
+
+        chain = [course]
+        while step[chain[-1]] != course:
+            chain.append(step[chain[-1]])
+        chain.append(course)
+        return [self.course_numbers[i] for i in chain]
+
+    # Course numbers ordered so every course comes after all of its prerequisites
+    def topological_order(self):
+        self._ensure_order()
+        return [self.course_numbers[i] for i in self.order]
+
+    def _ensure_order(self):
+        if self.order is not None:
+            return
+        order, _remaining = self._kahn()
+        if len(order) < len(self.course_numbers):
+            raise ValueError(f"Circular prerequisites: {' -> '.join(self.find_cycle())}")
+
+        position = [0] * len(order)
+        for i, course in enumerate(order):
+            position[course] = i
+        # order is set last, so another thread never sees it without positions
+        self.position = position
+        self.order = order
+
+    # Every course needed before course_number, direct or indirect, in an order
+    # they can be taken in
+    def all_prereqs(self, course_number):
+        bits = self._closure(self._course(course_number))
+        return [self.course_numbers[self.order[position]] for position in _bit_positions(bits)]
+
+    # True when prereq_number is needed, directly or indirectly, before course_number
+    def requires(self, course_number, prereq_number):
+        bits = self._closure(self._course(course_number))
+        return bool(bits >> self.position[self._course(prereq_number)] & 1)
+
+    def _course(self, course_number):
+        if course_number not in self.index:
+            raise KeyError(f"Course {course_number} not found.")
+        self._ensure_order()
+        return self.index[course_number]
+
+    # The transitive prerequisites of a course as an int bitset over topological
+    # positions. Results are memoized, and a later search stops at any course
+    # whose set is already known and merges it in whole.
+    def _closure(self, course):
+        closures = self._closures
+        if course in closures:
+            return closures[course]
+
+        seen = bytearray(len(self.course_numbers))
+        stack = []
+        for prereq in self.prereqs[course]:
+            seen[prereq] = 1
+            stack.append(prereq)
+
+        bits = 0
+        marks = bytearray((len(self.course_numbers) + 7) // 8)
+        while stack:
+            current = stack.pop()
+            position = self.position[current]
+            marks[position >> 3] |= 1 << (position & 7)
+            known = closures.get(current)
+            if known is not None:
+                bits |= known
+                continue
+            for prereq in self.prereqs[current]:
+                if not seen[prereq]:
+                    seen[prereq] = 1
+                    stack.append(prereq)
+
+        bits |= int.from_bytes(marks, 'little')
+        closures[course] = bits
+        return bits
+
+    # Groups the courses into semesters so each course follows all of its
+    # prerequisites. targets limits the plan to those courses and everything they
+    # need. Completed courses are left out together with everything they needed,
+    # which must have been taken before them. Each semester holds at most
+    # max_courses courses and max_credits credits. Courses that head the longest
+    # remaining prerequisite chains are scheduled first.
+    def schedule(self, targets=None, completed=(), max_courses=4, max_credits=None, credits=None):
+        if max_courses < 1:
+            raise ValueError("A semester must allow at least one course.")
+        self._ensure_order()
+        credits = credits or {}
+
+        if targets is None:
+            needed = bytearray(b'\x01') * len(self.course_numbers)
+        else:
+            needed = bytearray(len(self.course_numbers))
+            for course_number in targets:
+                course = self._course(course_number)
+                needed[course] = 1
+                for position in _bit_positions(self._closure(course)):
+                    needed[self.order[position]] = 1
+        done = 0
+        for course_number in completed:
+            course = self._course(course_number)
+            done |= self._closure(course) | 1 << self.position[course]
+        for position in _bit_positions(done):
+            needed[self.order[position]] = 0
+
+        def course_credits(course):
+            return credits.get(self.course_numbers[course], DEFAULT_CREDITS)
+
+        if max_credits is not None:
+            for course in range(len(self.course_numbers)):
+                if needed[course] and course_credits(course) > max_credits:
+                    raise ValueError(f"Course {self.course_numbers[course]} has more credits than a semester allows.")
+
+        # Longest chain of needed courses that still depend on each course, and the
+        # number of needed prerequisites each course is waiting for. Courses that
+        # are not needed keep a chain of 0, so they add nothing.
+        chain = [0] * len(self.course_numbers)
+        remaining = [0] * len(self.course_numbers)
+        every_course = targets is None and not done
+        chain_of = chain.__getitem__
+        is_needed = needed.__getitem__
+        ready = []
+        for course in reversed(self.order):
+            if not needed[course]:
+                continue
+            chain[course] = 1 + max(map(chain_of, self.dependents[course]), default=0)
+            prereqs = self.prereqs[course]
+            remaining[course] = len(prereqs) if every_course else sum(map(is_needed, prereqs))
+            if remaining[course] == 0:
+                ready.append((-chain[course], self.course_numbers[course], course))
+        heapq.heapify(ready)
+
+        semesters = []
+        heappop, heappush = heapq.heappop, heapq.heappush
+        dependents, course_numbers = self.dependents, self.course_numbers
+        while ready:
+            semester, semester_credits, deferred = [], 0, []
+            while ready and len(semester) < max_courses:
+                entry = heappop(ready)
+                course = entry[2]
+                if max_credits is not None:
+                    if semester_credits + course_credits(course) > max_credits:
+                        deferred.append(entry)
+                        continue
+                    semester_credits += course_credits(course)
+                semester.append(course)
+            for entry in deferred:
+                heappush(ready, entry)
+
+            # Dependents become available from the next semester on
+            for course in semester:
+                for dependent in dependents[course]:
+                    if needed[dependent]:
+                        remaining[dependent] -= 1
+                        if not remaining[dependent]:
+                            heappush(ready, (-chain[dependent], course_numbers[dependent], dependent))
+            semesters.append(sorted([course_numbers[course] for course in semester]))
+        return semesters
+
+# Positions of the set bits of a non-negative int, lowest first
+def _bit_positions(bits):
+    digits = bin(bits)[:1:-1]  # Least significant bit first, without the '0b' prefix
+    positions = []
+    position = digits.find('1')
+    while position != -1:
+        positions.append(position)
+        position = digits.find('1', position + 1)
+    return positions
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The planner modules live next to this directory rather than in a package
+PLANNER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLANNER_DIR)
+
+COURSES_CSV = os.path.join(PLANNER_DIR, 'courses.csv')
+
+
+# A copy of the sample catalog, so the compiled index is written to a scratch directory
+@pytest.fixture
+def catalog_file(tmp_path):
+    path = tmp_path / 'courses.csv'
+    with open(COURSES_CSV, 'rb') as source:
+        path.write_bytes(source.read())
+    return str(path)
+
+
+@pytest.fixture
+def sample_courses():
+    from course_planner import load_courses
+    return load_courses(COURSES_CSV)
@@ -0,0 +1,72 @@
+import pytest
+
+from catalog_loader import load_catalog, parse_file
+
+CATALOG = (
+    'MATH201,Discrete Mathematics\n'
+    'CSCI100,"Introduction to\nComputer Science"\n'
+    'CSCI101,Programming Fundamentals,CSCI100\n'
+    'CSCI200,"Data Structures, ""with"" Algorithms",CSCI101,MATH201\n'
+    '\n'
+    'BAD1\n'
+    ',No number\n'
+    'CSCI300,Systems,CSCI999\n'
+    'MATH201,Discrete Mathematics Again\r\n'
+    'CSCI400,Ethics\u2028and\x85Society\x0c,CSCI300\r\n'
+)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = tmp_path / 'catalog.csv'
+    path.write_bytes(b'\xef\xbb\xbf' + CATALOG.encode('utf-8'))
+    return str(path)
+
+
+def error_lines(errors):
+    return [(error.line_number, error.message) for error in errors]
+
+
+# Tiny chunks put quoted newlines across chunk boundaries
+@pytest.mark.parametrize('chunk_size, use_mmap', [(1 << 20, False), (1 << 20, True), (8, False), (8, True)])
+def test_parse_keeps_quoted_newlines_and_line_numbers(catalog, chunk_size, use_mmap):
+    rows, errors = parse_file(catalog, chunk_size, use_mmap)
+    assert rows == [
+        ('MATH201', 'Discrete Mathematics', [], 1),
+        ('CSCI100', 'Introduction to\nComputer Science', [], 2),
+        ('CSCI101', 'Programming Fundamentals', ['CSCI100'], 4),
+        ('CSCI200', 'Data Structures, "with" Algorithms', ['CSCI101', 'MATH201'], 5),
+        ('CSCI300', 'Systems', ['CSCI999'], 9),
+        ('MATH201', 'Discrete Mathematics Again', [], 10),
+        ('CSCI400', 'Ethics\u2028and\x85Society', ['CSCI300'], 11),  # Only \r and \n end a line
+    ]
+    assert error_lines(errors) == [
+        (7, 'Each line must have at least 2 parameters (course number and title).'),
+        (8, 'Missing course number.'),
+    ]
+
+
+def test_load_catalog_reports_every_error(catalog):
+    courses, errors = load_catalog(catalog)
+    assert courses['CSCI200'] == ('Data Structures, "with" Algorithms', ['CSCI101', 'MATH201'])
+    assert courses['MATH201'] == ('Discrete Mathematics', [])
+    assert error_lines(errors) == [
+        (7, 'Each line must have at least 2 parameters (course number and title).'),
+        (8, 'Missing course number.'),
+        (9, 'Prerequisite CSCI999 does not have a corresponding course.'),
+        (10, 'Course MATH201 is defined more than once.'),
+    ]
+
+
+def test_prerequisite_defined_in_a_later_file(tmp_path):
+    first, second = tmp_path / 'a.csv', tmp_path / 'b.csv'
+    first.write_text('CSCI200,Data Structures,CSCI101\n')
+    second.write_text('CSCI101,Programming\n')
+    courses, errors = load_catalog([str(first), str(second)], processes=1)
+    assert errors == []
+    assert courses['CSCI200'][1] == ['CSCI101']
+
+
+def test_missing_file():
+    with pytest.raises(FileNotFoundError):
+        load_catalog('no-such-catalog.csv')
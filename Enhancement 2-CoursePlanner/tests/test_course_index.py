@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+import course_index
+from course_index import CourseIndex, open_index
+from course_planner import Course, load_courses
+
+
+def open_catalog(catalog_file, loads):
+    def counting_load(file_names):
+        loads.append(file_names)
+        return load_courses(file_names)
+    return open_index(catalog_file, counting_load, factory=Course)
+
+
+def test_index_matches_the_catalog(catalog_file, sample_courses):
+    index, courses = open_index(catalog_file, load_courses, factory=Course)
+    assert courses is not None  # Built on first use
+    assert len(index) == len(sample_courses)
+    assert [key for key, _course in index.items()] == sorted(sample_courses)
+    for key, course in sample_courses.items():
+        found = index.search(key).value
+        assert (found.course_title, found.prereqs) == (course.course_title, course.prereqs)
+    assert index.search('NOPE100') is None
+    assert index.select(index.rank(key)).key == key
+    index.close()
+
+
+def test_current_index_is_reused(catalog_file):
+    loads = []
+    open_catalog(catalog_file, loads)[0].close()
+    index, courses = open_catalog(catalog_file, loads)
+    assert courses is None and len(loads) == 1
+    index.close()
+
+
+def test_touched_catalog_is_hashed_once(monkeypatch, catalog_file):
+    loads = []
+    open_catalog(catalog_file, loads)[0].close()
+    status = os.stat(catalog_file)
+    os.utime(catalog_file, ns=(status.st_atime_ns, status.st_mtime_ns + 10 ** 9))
+
+    hashes = []
+    file_hash = course_index.file_hash
+    monkeypatch.setattr(course_index, 'file_hash', lambda name: hashes.append(name) or file_hash(name))
+    for _attempt in range(3):
+        index, courses = open_catalog(catalog_file, loads)
+        assert courses is None
+        index.close()
+    assert len(hashes) == 1 and len(loads) == 1
+
+
+def test_changed_catalog_is_rebuilt(catalog_file):
+    loads = []
+    open_catalog(catalog_file, loads)[0].close()
+    with open(catalog_file, 'a') as catalog:
+        catalog.write('ZZZ999,Capstone\n')
+    index, courses = open_catalog(catalog_file, loads)
+    assert 'ZZZ999' in courses and index.search('ZZZ999') is not None
+    index.close()
+
+
+# Every truncation of the file, plus damaged offsets and stamp, is rebuilt
+def test_damaged_index_is_rebuilt(catalog_file, capsys):
+    loads = []
+    open_catalog(catalog_file, loads)[0].close()
+    index_path = catalog_file + '.idx'
+    with open(index_path, 'rb') as index_file:
+        good = index_file.read()
+
+    stamp_start = good.index(b'{')
+    damaged = [good[:length] for length in range(0, len(good), 7)]
+    damaged.append(good[:16] + b'\xff' * 8 + good[24:])
+    damaged.append(good[:stamp_start] + b'[' + b' ' * (good.index(b'}', stamp_start) - stamp_start - 1) + b']'
+                   + good[good.index(b'}', stamp_start) + 1:])
+    for data in damaged:
+        with open(index_path, 'wb') as index_file:
+            index_file.write(data)
+        index, courses = open_catalog(catalog_file, loads)
+        assert courses is not None and len(index) == len(courses)
+        index.close()
+    assert len(loads) == 1 + len(damaged)
+    assert 'Rebuilding course index' in capsys.readouterr().out
+
+
+def test_truncated_index_raises_value_error(catalog_file):
+    open_index(catalog_file, load_courses, factory=Course)[0].close()
+    index_path = catalog_file + '.idx'
+    with open(index_path, 'r+b') as index_file:
+        index_file.truncate(os.path.getsize(index_path) - 9)
+    with pytest.raises(ValueError):
+        CourseIndex(index_path)
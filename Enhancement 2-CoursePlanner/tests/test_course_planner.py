@@ -0,0 +1,93 @@
+from bisect import bisect_left
+import random
+
+import pytest
+
+from course_planner import AVLTree, CourseCatalog
+
+
+# Heights, balance and subtree sizes of every node, returns (height, size)
+def check(node):
+    if node is None:
+        return 0, 0
+    left_height, left_size = check(node.left)
+    right_height, right_size = check(node.right)
+    assert abs(left_height - right_height) <= 1
+    assert node.height == 1 + max(left_height, right_height)
+    assert node.size == 1 + left_size + right_size
+    return node.height, node.size
+
+
+@pytest.fixture(params=['insert', 'bulk_load', 'both'])
+def tree_and_keys(request):
+    rnd = random.Random(3)
+    tree = AVLTree()
+    expected = {}
+    if request.param in ('bulk_load', 'both'):
+        keys = sorted(rnd.sample(range(10 ** 6), 300))
+        tree.bulk_load((f"K{key:07d}", key) for key in keys)
+        expected.update((f"K{key:07d}", key) for key in keys)
+    if request.param in ('insert', 'both'):
+        for value in range(500):
+            key = f"K{rnd.randrange(2000):07d}"
+            tree.insert(key, value)
+            expected[key] = value
+    check(tree.root)
+    return tree, sorted(expected), expected
+
+
+def test_iteration_and_search(tree_and_keys):
+    tree, keys, expected = tree_and_keys
+    assert len(tree) == len(keys)
+    assert [node.key for node in tree] == keys
+    assert all(tree.search(key).value == expected[key] for key in keys)
+    assert tree.search('K9999999') is None
+
+
+def test_rank_and_select(tree_and_keys):
+    tree, keys, _expected = tree_and_keys
+    for position, key in enumerate(keys):
+        assert tree.rank(key) == position
+        assert tree.select(position).key == key
+    for probe in ('A', 'K0000500', 'K0001500x', 'Z'):
+        assert tree.rank(probe) == bisect_left(keys, probe)
+    for rank in (-1, len(keys)):
+        with pytest.raises(IndexError):
+            tree.select(rank)
+
+
+def test_pages(tree_and_keys):
+    tree, keys, _expected = tree_and_keys
+    for size in (1, 7, 50):
+        for number in range(1, len(keys) // size + 3):
+            assert [node.key for node in tree.page(number, size)] == keys[(number - 1) * size:number * size]
+    with pytest.raises(ValueError):
+        tree.page(0, 10)
+    for rank in (-1, 0, 17, len(keys), len(keys) + 1):
+        assert [node.key for node in tree.iter_from(rank=rank)] == keys[max(rank, 0):]
+
+
+def test_ranges(tree_and_keys):
+    tree, keys, _expected = tree_and_keys
+    low, high = 'K0000500', 'K0001000'
+    assert [node.key for node in tree.range_search(low, high)] == [key for key in keys if low <= key <= high]
+    assert [node.key for node in tree.range_search(low, limit=3)] == keys[bisect_left(keys, low):][:3]
+    assert [node.key for node in tree.prefix_search('K00001')] == [key for key in keys if key.startswith('K00001')]
+
+
+def test_bulk_load_rejects_unsorted_items():
+    with pytest.raises(ValueError):
+        AVLTree().bulk_load([('B', 1), ('A', 2)])
+
+
+# The catalog answers the same from the compiled index and from the tree
+def test_catalog_index_and_tree_agree(catalog_file):
+    indexed = CourseCatalog.open([catalog_file])
+    tree_only = CourseCatalog(None, indexed.courses())
+    for catalog in (indexed, tree_only):
+        assert [entry.key for entry in catalog.page(2, 3)] == [key for key, _course in indexed.items()][3:6]
+        assert catalog.select(catalog.rank('MATH')).key >= 'MATH'
+        assert [entry.key for entry in catalog.prefix_search('CSCI1')] == \
+            sorted(key for key in indexed.courses() if key.startswith('CSCI1'))
+        assert [entry.key for entry in catalog.suggest('CSCI10')][:1] == ['CSCI100']
+    indexed.index.close()
@@ -0,0 +1,54 @@
+from itertools import product
+import random
+
+import pytest
+
+from course_search import TitleIndex, edit_distance, tokenize
+
+
+# Optimal string alignment distance computed in full, without the band
+def reference_distance(a, b):
+    table = [[max(i, j) if not i or not j else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i, j in product(range(1, len(a) + 1), range(1, len(b) + 1)):
+        table[i][j] = min(table[i - 1][j] + 1, table[i][j - 1] + 1, table[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+        if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+            table[i][j] = min(table[i][j], table[i - 2][j - 2] + 1)
+    return table[-1][-1]
+
+
+def test_edit_distance_matches_the_full_table():
+    rnd = random.Random(5)
+    for _trial in range(2000):
+        a = ''.join(rnd.choice('abc') for _ in range(rnd.randrange(8)))
+        b = ''.join(rnd.choice('abc') for _ in range(rnd.randrange(8)))
+        limit = rnd.randrange(4)
+        assert edit_distance(a, b, limit) == min(reference_distance(a, b), limit + 1)
+    assert edit_distance('algorithms', 'algoritmhs', 2) == 1  # A swap is one edit
+
+
+@pytest.fixture
+def titles(sample_courses):
+    return TitleIndex(sorted(sample_courses.items()))
+
+
+def test_search_ranks_titles_matching_every_word_first(titles):
+    results = titles.search('introduction computer', limit=3)
+    assert results[0][0] == 'CSCI100'
+    # Equal scores are ordered by course number
+    assert titles.search('algorithms') == [('CSCE350', 3.62), ('CSCE500', 3.62), ('CSCI103', 3.62)]
+
+
+def test_search_completes_and_corrects_words(titles):
+    assert 'CSCI102' in [course for course, _score in titles.search('data struct')]
+    assert 'CSCI102' in [course for course, _score in titles.search('data strcutures')]
+    assert 'BIOL130' in [course for course, _score in titles.search('biolgy')]
+
+
+def test_search_without_matches(titles):
+    assert titles.search('') == []
+    assert titles.search('zzzz qqqq') == []
+    assert titles.search('algorithms', limit=0) == []
+
+
+def test_tokenize():
+    assert tokenize('Data-Structures & C++ 101') == ['data', 'structures', 'c', '101']
@@ -0,0 +1,150 @@
+from http.client import HTTPConnection
+import json
+import threading
+
+import pytest
+
+from planner_service import BATCH_CHUNK_SIZE, PlannerEngine, PlannerServer, run_batch
+
+
+@pytest.fixture
+def engine(catalog_file):
+    return PlannerEngine.open([catalog_file])
+
+
+# The service on an ephemeral port, answered by threads of this process
+@pytest.fixture
+def server(engine):
+    server = PlannerServer(('127.0.0.1', 0), engine)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def connection(server):
+    connection = HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    yield connection
+    connection.close()
+
+
+def request(connection, method, path, body=None):
+    connection.request(method, path, body=body)
+    response = connection.getresponse()
+    assert response.getheader('Content-Type') == 'application/json'
+    return response.status, json.loads(response.read())
+
+
+def get(connection, path):
+    return request(connection, 'GET', path)
+
+
+def test_course(connection):
+    status, body = get(connection, '/courses/csci101')
+    assert status == 200
+    assert body['ok']
+    assert body['result']['course_number'] == 'CSCI101'
+    assert body['result']['title']
+
+
+@pytest.mark.parametrize('path', ['/courses/CSCI10', '/prereqs/CSCI10', '/plan?target=CSCI10',
+                                  '/plan?target=CSCI101&completed=CSCI10'])
+def test_unknown_course_is_404_from_every_endpoint(connection, path):
+    status, body = get(connection, path)
+    assert status == 404
+    assert body['ok'] is False
+    assert body['error'] == 'Course CSCI10 not found.'
+    assert 'CSCI101' in body['suggestions']
+
+
+def test_course_listings(connection, engine):
+    status, body = get(connection, '/courses?limit=3')
+    assert status == 200
+    first = [course['course_number'] for course in body['result']]
+    assert first == sorted(first) and len(first) == 3
+
+    _status, body = get(connection, f'/courses?start={first[1]}&limit=2')
+    assert [course['course_number'] for course in body['result']] == first[1:3]
+
+    _status, body = get(connection, '/courses?page=2&limit=2')
+    assert [course['course_number'] for course in body['result']] == \
+        [course['course_number'] for course in engine.courses(page=2, limit=2)]
+
+    _status, body = get(connection, '/range?low=CSCI100&high=CSCI102')
+    assert [course['course_number'] for course in body['result']] == ['CSCI100', 'CSCI101', 'CSCI102']
+
+
+def test_search_and_prereqs(connection, engine):
+    _status, body = get(connection, '/search?q=csci1&limit=2')
+    assert [course['course_number'] for course in body['result']] == ['CSCI100', 'CSCI101']
+
+    status, body = get(connection, '/prereqs/AI521')
+    assert status == 200
+    assert body['result'] == engine.prereqs('AI521')
+
+
+def test_plan_with_repeated_parameters(connection):
+    status, body = get(connection, '/plan?target=AI521&completed=AI520&completed=DATA510&completed=MATH201')
+    assert (status, body) == (200, {'ok': True, 'result': [['AI521']]})
+
+
+@pytest.mark.parametrize('path', ['/courses?limit=0', '/courses?page=x', '/plan?target=AI521&max_courses=0'])
+def test_bad_arguments_are_400(connection, path):
+    status, body = get(connection, path)
+    assert status == 400
+    assert body['ok'] is False and 'suggestions' not in body
+
+
+def test_unknown_path_is_404(connection):
+    status, body = get(connection, '/nothing')
+    assert status == 404
+    assert body == {'ok': False, 'error': 'Unknown path /nothing.'}
+
+
+def test_connection_is_kept_alive(connection):
+    for _ in range(3):
+        assert get(connection, '/courses/CSCI101')[0] == 200
+    assert get(connection, '/courses/CSCI10')[0] == 404
+    assert get(connection, '/courses/CSCI101')[0] == 200
+
+
+def test_batch_route_answers_in_order(connection, engine):
+    requests = [{'op': 'course', 'course': 'CSCI101'}, {'op': 'course', 'course': 'CSCI10'},
+                {'op': 'nothing'}, {'op': 'plan', 'targets': 'AI521', 'completed': ['AI520', 'DATA510', 'MATH201']}]
+    status, body = request(connection, 'POST', '/batch', json.dumps(requests))
+    assert status == 200
+    assert body == [engine.handle(item) for item in requests]
+    assert [response['ok'] for response in body] == [True, False, False, True]
+
+
+@pytest.mark.parametrize('payload', ['{"op": "course"}', '[{"op": '])
+def test_batch_route_needs_a_json_array(connection, payload):
+    status, body = request(connection, 'POST', '/batch', payload)
+    assert status == 400
+    assert body['ok'] is False
+
+
+def test_post_to_another_path_is_404(connection):
+    assert request(connection, 'POST', '/courses', '[]')[0] == 404
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_batch(catalog_file, engine, tmp_path, workers):
+    lines = ['CSCI101', 'csci10', '{"op": "range", "low": "CSCI100", "high": "CSCI101"}', '{"op": ']
+    # Enough lines for two workers to get a chunk each
+    lines = lines * (BATCH_CHUNK_SIZE // 2 * workers)
+    queries = tmp_path / 'queries.txt'
+    queries.write_text('\n'.join(lines) + '\n\n')
+    output = tmp_path / 'results.json'
+
+    assert run_batch([catalog_file], str(queries), str(output), workers=workers) == len(lines)
+    responses = json.loads(output.read_text())
+    assert len(responses) == len(lines)
+    assert responses[:3] == [engine.handle({'op': 'course', 'course': 'CSCI101'}),
+                             engine.handle({'op': 'course', 'course': 'csci10'}),
+                             engine.handle({'op': 'range', 'low': 'CSCI100', 'high': 'CSCI101'})]
+    assert responses[3]['ok'] is False and responses[3]['error'].startswith('Invalid JSON')
+    assert responses[4:8] == responses[:4]
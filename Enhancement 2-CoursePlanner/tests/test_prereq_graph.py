@@ -0,0 +1,69 @@
+import pytest
+
+from course_planner import Course
+from planner_service import PlannerEngine
+from prereq_graph import PrereqGraph
+
+
+def make_graph(edges):
+    return PrereqGraph({course: Course(course, prereqs) for course, prereqs in edges.items()})
+
+
+def test_topological_order_puts_prereqs_first(sample_courses):
+    order = PrereqGraph(sample_courses).topological_order()
+    position = {course: i for i, course in enumerate(order)}
+    assert sorted(order) == sorted(sample_courses)
+    assert all(position[prereq] < position[course]
+               for course, details in sample_courses.items() for prereq in details.prereqs)
+
+
+def test_find_cycle_reports_the_chain():
+    graph = make_graph({'A': ['B'], 'B': ['C'], 'C': ['A'], 'D': []})
+    cycle = graph.find_cycle()
+    assert cycle[0] == cycle[-1] and set(cycle) == {'A', 'B', 'C'}
+    with pytest.raises(ValueError, match='Circular prerequisites'):
+        graph.topological_order()
+    assert make_graph({'A': ['B'], 'B': []}).find_cycle() is None
+
+
+def test_unknown_prerequisite_is_rejected():
+    with pytest.raises(ValueError, match='Unknown prerequisite'):
+        make_graph({'A': ['Z']})
+
+
+def test_all_prereqs_and_requires():
+    graph = make_graph({'A': [], 'B': ['A'], 'C': ['B'], 'D': ['A', 'A']})
+    assert graph.all_prereqs('C') == ['A', 'B']
+    assert graph.all_prereqs('A') == []
+    assert graph.requires('C', 'A') and not graph.requires('D', 'B')
+    with pytest.raises(KeyError):
+        graph.all_prereqs('X')
+
+
+def test_schedule_respects_prerequisites_and_limits(sample_courses):
+    graph = PrereqGraph(sample_courses)
+    semesters = graph.schedule(max_courses=5, max_credits=12)
+    taken = {course: i for i, semester in enumerate(semesters) for course in semester}
+    assert sorted(taken) == sorted(sample_courses)
+    assert all(len(semester) <= 4 for semester in semesters)  # 12 credits of 3 each
+    assert all(taken[prereq] < taken[course]
+               for course, details in sample_courses.items() for prereq in details.prereqs)
+
+
+def test_completed_courses_imply_their_prerequisites(sample_courses):
+    graph = PrereqGraph(sample_courses)
+    assert graph.schedule(targets=['AI521'], completed=['AI520', 'DATA510', 'MATH201']) == [['AI521']]
+
+    semesters = graph.schedule(targets=['AI521'], completed=['MATH201'])
+    planned = {course for semester in semesters for course in semester}
+    assert planned.isdisjoint({'MATH201', 'MATH200', 'MATH150'} | set(graph.all_prereqs('MATH201')))
+    assert semesters[-1] == ['AI521']
+
+
+def test_plan_endpoint_leaves_out_completed_closures(catalog_file):
+    engine = PlannerEngine.open([catalog_file])
+    response = engine.handle({'op': 'plan', 'targets': ['AI521'], 'completed': ['ai520', 'DATA510', 'MATH201']})
+    assert response == {'ok': True, 'result': [['AI521']]}
+
+    response = engine.handle({'op': 'plan', 'targets': 'AI521', 'completed': 'NOPE100'})
+    assert response == {'ok': False, 'error': 'Course NOPE100 not found.', 'suggestions': []}
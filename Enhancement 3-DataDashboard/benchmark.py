@@ -0,0 +1,217 @@
+# Benchmarks for AnimalShelter, the rescue filters and the dashboard callbacks
+#
+#   python benchmark.py --rows 10000 100000                 # in-process stand-in (mongomock)
+#   python benchmark.py --backend mongod --rows 1000000     # local mongod on localhost:27017
+#
+# Every run reloads a scratch collection with synthetic outcomes, so never
+# point it at the production database.
+import argparse
+import gzip
+import json
+import math
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DB = 'aac_benchmark'
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, pct):
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+# Time fn over repeat runs, then run it once more under tracemalloc for peak memory
+def measure(name, fn, repeat):
+    fn()  # Warm up connections and caches that a real worker would already have
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+
+    tracemalloc.start()
+    fn()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'runs': repeat,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+# Point the dashboard at the benchmark collection before anything imports crud_module
+def configure_environment(args):
+    os.environ['MONGO_DB'] = BENCHMARK_DB
+    os.environ['LIVE_DATASET'] = '0'
+    os.environ['CACHE_BACKEND'] = 'memory'
+    if args.backend == 'mongod':
+        os.environ['MONGO_HOST'] = args.host
+        os.environ['MONGO_PORT'] = str(args.port)
+        os.environ['AAC_USER'] = ''
+
+def make_client(args):
+    if args.backend == 'memory':
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("The memory backend needs mongomock: pip install mongomock")
+        return mongomock.MongoClient()
+
+    from pymongo import MongoClient
+    return MongoClient(host=args.host, port=args.port)
+
+def run_size(rows, args, client, dashboard):
+    from crud_module import AnimalShelter
+    from rescue_profiles import RescueRegistry
+    from synthetic_data import generate_outcomes
+
+    shelter = AnimalShelter(None, None, client=client)
+    shelter.collection.drop()
+    results = []
+
+    # CRUD throughput
+    start = time.perf_counter()
+    shelter.create_many(generate_outcomes(rows, seed=args.seed), batch_size=args.batch_size)
+    load_seconds = time.perf_counter() - start
+    results.append({'name': 'create_many', 'rows': rows, 'docs_per_second': round(rows / load_seconds)})
+    shelter.ensure_indexes()
+    shelter.ensure_geo_points()
+
+    probe = rows // 2
+    results.append(measure('read one by rec_num', lambda: shelter.read({'rec_num': probe}, {'_id': 0}), args.repeat))
+    results.append(measure('count all', lambda: shelter.count({}), args.repeat))
+    results.append(measure('update one', lambda: shelter.update({'rec_num': probe}, {'name': 'Benchmark'}), args.repeat))
+    extra = list(generate_outcomes(1, seed=args.seed + 1, start_rec_num=rows + 1))[0]
+    results.append(measure('create + delete one',
+                           lambda: (shelter.create(dict(extra)), shelter.delete({'rec_num': rows + 1})),
+                           args.repeat))
+
+    # Rescue filters
+    registry = RescueRegistry(shelter)
+    for name in registry.compiled:
+        profile = registry.get(name)
+        results.append(measure(f"filter {name}",
+                               lambda: shelter.read_dataframe(profile.query, {'_id': 0}, hint=profile.hint),
+                               args.repeat))
+
+    # The same filters answered from memory by the vectorized engine
+    from frame_engine import FrameQueryEngine
+    start = time.perf_counter()
+    engine = FrameQueryEngine.from_shelter(shelter, dashboard.desired_order)
+    results.append({'name': 'frame engine build', 'rows': rows,
+                    'docs_per_second': round(rows / (time.perf_counter() - start))})
+    for name in registry.compiled:
+        profile = registry.get(name)
+        results.append(measure(f"engine count {name}", lambda: engine.count(profile.query), args.repeat))
+        results.append(measure(f"engine page {name}",
+                               lambda: engine.read_dataframe(profile.query, sort=[('_id', 1)], limit=dashboard.PAGE_SIZE),
+                               args.repeat))
+
+    # Dashboard callbacks, called directly with the cache disabled
+    dashboard.rescue_registry.refresh()
+    if dashboard.rescue_views is not None:
+        # Rebuild the materialized rescue categories from the freshly loaded rows
+        start = time.perf_counter()
+        dashboard.rescue_views.refresh()
+        results.append({'name': 'rescue views refresh', 'rows': rows,
+                        'docs_per_second': round(rows / (time.perf_counter() - start))})
+    page, _page_count = dashboard.table_page('Reset', '', [], 0, dashboard.PAGE_SIZE)
+    for filter_type in ['Reset', 'Dogs', 'Water', 'Service']:
+        results.append(measure(f"update_dashboard {filter_type}",
+                               lambda: dashboard.table_page(filter_type, '', [], 0, dashboard.PAGE_SIZE),
+                               args.repeat))
+        results.append(measure(f"update_graphs {filter_type}",
+                               lambda: dashboard.update_graphs(filter_type, ''),
+                               args.repeat))
+        results.append(measure(f"update_clusters {filter_type}",
+                               lambda: dashboard.update_clusters(filter_type, '', None, dashboard.MAP_ZOOM),
+                               args.repeat))
+    results.append(measure('update_dashboard Reset page 50',
+                           lambda: dashboard.table_page('Reset', '', [{'column_id': 'breed', 'direction': 'asc'}], 50, dashboard.PAGE_SIZE),
+                           args.repeat))
+    results.append(measure('update_map', lambda: dashboard.update_map(page, [0]), args.repeat))
+    results.extend(payload_sizes(dashboard))
+
+    for result in results:
+        result['rows'] = rows
+    return results
+
+# Bytes on the wire for one table page: every column versus the visible
+# columns only, each uncompressed, gzip and brotli compressed
+def payload_sizes(dashboard):
+    from plotly.utils import PlotlyJSONEncoder
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    results = []
+    for label, hidden in [('all columns', []), ('visible columns', dashboard.hidden_columns)]:
+        for filter_type in ['Reset', 'Dogs']:
+            data, page_count = dashboard.table_page(filter_type, '', [], 0, dashboard.PAGE_SIZE, hidden)
+            raw = json.dumps({'data': data, 'page_count': page_count}, cls=PlotlyJSONEncoder).encode()
+            results.append({
+                'name': f"payload {filter_type} page, {label}",
+                'raw_bytes': len(raw),
+                'gzip_bytes': len(gzip.compress(raw)),
+                'brotli_bytes': len(brotli.compress(raw)) if brotli else None,
+            })
+    return results
+
+def print_results(results):
+    print(f"\n{'benchmark':<40}{'rows':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak KB':>12}")
+    for result in results:
+        if 'docs_per_second' in result:
+            print(f"{result['name']:<40}{result['rows']:>10}{result['docs_per_second']:>30} docs/s")
+        elif 'raw_bytes' in result:
+            print(f"{result['name']:<40}{result['rows']:>10}{result['raw_bytes']:>10} B raw"
+                  f"{result['gzip_bytes']:>8} B gzip{result['brotli_bytes'] or '-':>8} B brotli")
+        else:
+            print(f"{result['name']:<40}{result['rows']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                  f"{result['p99_ms']:>10}{result['peak_kb']:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark AnimalShelter and the dashboard callbacks.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000], help='collection sizes, e.g. 10000 100000 1000000')
+    parser.add_argument('--backend', choices=['memory', 'mongod'], default='memory')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per benchmark')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true', help="keep the dashboard's result cache enabled")
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    configure_environment(args)
+    client = make_client(args)
+
+    # The dashboard builds its own AnimalShelter at import, so give it the same client
+    import crud_module
+    crud_module.MongoClient = lambda **options: client
+    import dashboard
+    if not args.cache:
+        dashboard.db.cache = None
+
+    results = []
+    for rows in args.rows:
+        print(f"Benchmarking {rows} rows on {args.backend}...")
+        results.extend(run_size(rows, args, client, dashboard))
+
+    print_results(results)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"\nPeak RSS: {peak_rss / 1024:.1f} MB")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'backend': args.backend, 'peak_rss_kb': peak_rss, 'results': results}, output, indent=2)
+
+if __name__ == '__main__':
+    main()
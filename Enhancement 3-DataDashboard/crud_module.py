@@ -1,43 +1,683 @@
-from pymongo import MongoClient
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+import json
+import os
+import threading
+import time
 
-class AnimalShelter(object):
+from pymongo import MongoClient, ReplaceOne, ASCENDING, GEOSPHERE
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from metrics import COMMAND_METRICS
+
+# AsyncMongoClient ships with pymongo 4.9 and later
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    AsyncMongoClient = None
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype, union_categoricals
+
+# Connection Constants
+HOST = os.getenv('MONGO_HOST', 'ec2-3-145-82-100.us-east-2.compute.amazonaws.com')
+PORT = int(os.getenv('MONGO_PORT', 27017))
+DB = os.getenv('MONGO_DB', 'AAC')
+COL = os.getenv('MONGO_COLLECTION', 'animals')
+
+# Connection pool and timeout settings shared by the sync and async clients.
+# Timeouts keep a slow or unreachable server from holding callback threads.
+POOL_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+    'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 2)),
+    'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+}
+
+# Keyword arguments for MongoClient/AsyncMongoClient. Credentials are passed
+# separately instead of being formatted into the URI, so they need no escaping.
+# An empty user connects without authentication, e.g. to a local mongod.
+# Every command is timed by the metrics command listener.
+def client_options(user, password, host=None, port=None, **pool_options):
+    credentials = {'username': user, 'password': password, 'authSource': DB} if user else {}
+    return {
+        'host': host or HOST,
+        'port': port or PORT,
+        'event_listeners': [COMMAND_METRICS],
+        **credentials,
+        **POOL_OPTIONS,
+        **pool_options,
+    }
+
+# Indexes backing the dashboard filters and the default (_id) sort, as
+# (name, keys) or (name, keys, options). Compound keys follow equality, then
+# breed, then the age range. An outcome is identified by animal_id and rec_num,
+# the key upsert_many matches on. That index only covers documents having both
+# fields, so documents created without them do not collide on a null key.
+# rec_num alone serves the row lookups of the map and the newest-first reads of
+# the live dataset.
+INDEX_SPEC = [
+    ('animal_type_id', [('animal_type', ASCENDING), ('_id', ASCENDING)]),
+    ('sex_breed_age', [('sex_upon_outcome', ASCENDING), ('breed', ASCENDING), ('age_upon_outcome_in_weeks', ASCENDING)]),
+    ('breed_age', [('breed', ASCENDING), ('age_upon_outcome_in_weeks', ASCENDING)]),
+    ('age', [('age_upon_outcome_in_weeks', ASCENDING)]),
+    ('location', [('location_lat', ASCENDING), ('location_long', ASCENDING)]),
+    ('location_point', [('location_point', GEOSPHERE)]),
+    ('animal_id_rec_num', [('animal_id', ASCENDING), ('rec_num', ASCENDING)],
+     {'unique': True, 'partialFilterExpression': {'animal_id': {'$exists': True}, 'rec_num': {'$exists': True}}}),
+    ('rec_num', [('rec_num', ASCENDING)]),
+]
+
+# Server error codes for an index that exists under the same name or keys with other options
+INDEX_CONFLICT_CODES = {85, 86}
+
+# Size of a map grid cell in degrees at zoom 0, halved with every zoom level
+GRID_DEGREES_AT_ZOOM_0 = 45.0
+
+# Add the GeoJSON point used by the 2dsphere index when the document has coordinates
+def with_geo_point(document):
+    lat, lng = document.get('location_lat'), document.get('location_long')
+    if isinstance(lat, (int, float)) and isinstance(lng, (int, float)) and 'location_point' not in document:
+        document = {**document, 'location_point': {'type': 'Point', 'coordinates': [lng, lat]}}
+    return document
+
+# Update document setting update_data. New coordinates also recompute the
+# GeoJSON point, in a pipeline so both change in the same update.
+def update_document(update_data):
+    if 'location_lat' in update_data or 'location_long' in update_data:
+        return [{'$set': {key: {'$literal': value} for key, value in update_data.items()}},
+                {'$set': {'location_point': {'type': 'Point', 'coordinates': ['$location_long', '$location_lat']}}}]
+    return {'$set': update_data}
+
+# $geoWithin condition for a Leaflet bounds pair [[south, west], [north, east]]
+def viewport_query(bounds):
+    (south, west), (north, east) = bounds
+    # Polygons wider than a hemisphere are ambiguous on a sphere, so skip the filter
+    if east - west >= 180:
+        return {}
+    ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+    return {'location_point': {'$geoWithin': {'$geometry': {'type': 'Polygon', 'coordinates': [ring]}}}}
+
+# Column types for the AAC outcomes collection, in the order the dashboard shows
+# the fields. Repeated labels are stored as categories, coordinates as float32
+# (about a metre at Austin's latitude) and timestamps as parsed datetimes. Ages
+# stay float64 so the rescue age windows compare exactly as MongoDB does.
+AAC_SCHEMA = {
+    'animal_type': 'category',
+    'animal_id': 'string',
+    'age_upon_outcome': 'category',
+    'breed': 'category',
+    'color': 'category',
+    'date_of_birth': 'datetime',
+    'name': 'string',
+    'outcome_type': 'category',
+    'outcome_subtype': 'category',
+    'sex_upon_outcome': 'category',
+    'rec_num': 'Int32',
+    'datetime': 'datetime',
+    'monthyear': 'datetime',
+    'location_lat': 'float32',
+    'location_long': 'float32',
+    'age_upon_outcome_in_weeks': 'float64',
+}
+AAC_FIELDS = list(AAC_SCHEMA)
+
+# Text layout of each datetime field. Values are parsed with it and formatted
+# back with it, so a stored string comes back unchanged.
+DATETIME_LAYOUTS = {
+    'date_of_birth': '%Y-%m-%d',
+    'datetime': '%Y-%m-%d %H:%M:%S',
+    'monthyear': '%Y-%m-%dT%H:%M:%S',
+}
+
+# Layouts numpy's ISO formatting can produce, as (unit, date/time separator).
+# It is many times faster than strftime.
+ISO_LAYOUTS = {'%Y-%m-%d': ('D', 'T'), '%Y-%m-%dT%H:%M:%S': ('s', 'T'), '%Y-%m-%d %H:%M:%S': ('s', ' ')}
+
+# Text of datetime64 values in the given layout, as an object array
+def format_datetimes(values, layout):
+    values = np.asarray(values, dtype='datetime64[ns]')
+    if layout in ISO_LAYOUTS:
+        unit, separator = ISO_LAYOUTS[layout]
+        text = np.datetime_as_string(values, unit=unit)
+        if separator != 'T' and len(text):
+            text = np.char.replace(text, 'T', separator)
+        return text.astype(object)
+    return pd.DatetimeIndex(values).strftime(layout).to_numpy(dtype=object)
+
+# Column types of the given fields, fields outside AAC_SCHEMA are kept as they are
+def schema_for(fields):
+    return {field: AAC_SCHEMA.get(field, 'object') for field in fields}
+
+# Convert one batch of raw values to the declared column type. A batch with a
+# value the type cannot hold exactly, e.g. rec_num stored as text, keeps its
+# values unchanged in an object column instead.
+def typed_column(values, dtype, layout=None):
+    values = pd.Series(values, dtype=object)
+    kind = infer_dtype(values, skipna=True)
+    if dtype in ('category', 'string') and kind in ('string', 'empty'):
+        if dtype == 'string':
+            return values.astype('string')
+        codes, uniques = pd.factorize(values)
+        return pd.Series(pd.Categorical.from_codes(codes, categories=pd.Index(uniques, dtype=object)))
+    if dtype == 'Int32' and kind in ('integer', 'empty'):
+        numbers = pd.to_numeric(values)
+        if numbers.isna().all() or (numbers.min() >= -2 ** 31 and numbers.max() < 2 ** 31):
+            return numbers.astype('Int32')
+    if dtype in ('float32', 'float64') and kind in ('floating', 'integer', 'mixed-integer-float', 'empty'):
+        return pd.to_numeric(values).astype(dtype)
+    if dtype == 'datetime' and kind in ('string', 'empty'):
+        # The length check rejects the unpadded forms the parser would also accept
+        parsed = pd.to_datetime(values, format=layout, errors='coerce')
+        present = values.notna()
+        if (parsed.notna() == present).all() and (values[present].str.len() == _layout_length(layout)).all():
+            return parsed
+    if dtype in ('float32', 'float64'):
+        # Numbers read back the same whichever way their column ended up stored
+        return pd.Series([typed_value(value, dtype) for value in values], dtype=object)
+    return values
+
+def _layout_length(layout):
+    return len(datetime(2000, 1, 1).strftime(layout))
+
+# The value a typed column gives back for a raw value, e.g. a coordinate rounded to float32
+def typed_value(value, dtype):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if dtype == 'float32':
+            return float(str(np.float32(value)))
+        if dtype == 'float64':
+            return float(value)
+    return value
+
+# Join the typed batches of one column, merging category sets as needed. When
+# one batch had to keep its raw values the whole column does.
+def concat_column(chunks, layout=None):
+    if all(isinstance(chunk.dtype, pd.CategoricalDtype) for chunk in chunks):
+        return pd.Series(union_categoricals([chunk.array for chunk in chunks]))
+    if len({str(chunk.dtype) for chunk in chunks}) > 1:
+        chunks = [pd.Series(column_values(chunk, layout), dtype=object) for chunk in chunks]
+    return pd.concat(chunks, ignore_index=True)
+
+# Python values of a typed column as MongoDB would return them, None where missing
+def column_values(column, layout=None):
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        values = format_datetimes(column.to_numpy(), layout)
+    elif column.dtype == np.float32:
+        # The shortest text of each float32 is the value it was rounded from
+        values = np.array(column.to_numpy().astype(str).astype(np.float64).tolist(), dtype=object)
+    elif pd.api.types.is_integer_dtype(column.dtype):
+        values = np.array(column.to_numpy(dtype=np.int64, na_value=0).tolist(), dtype=object)
+    elif pd.api.types.is_float_dtype(column.dtype):
+        values = np.array(column.to_numpy().tolist(), dtype=object)
+    else:
+        values = column.to_numpy(dtype=object, copy=True)
+    values[column.isna().to_numpy()] = None
+    return values
+
+# Typed DataFrame of documents, one column per schema field. Missing fields are missing values.
+def typed_frame(documents, schema):
+    return pd.DataFrame({field: typed_column([document.get(field) for document in documents], dtype,
+                                             DATETIME_LAYOUTS.get(field))
+                         for field, dtype in schema.items()})
+
+# Join typed frames with the same columns
+def concat_frames(frames):
+    return pd.DataFrame({column: concat_column([frame[column] for frame in frames], DATETIME_LAYOUTS.get(column))
+                         for column in frames[0].columns})
+
+# The rows of a typed frame as documents
+def frame_records(frame):
+    columns = [column_values(frame[column], DATETIME_LAYOUTS.get(column)) for column in frame.columns]
+    return [dict(zip(frame.columns, values)) for values in zip(*columns)]
+
+# Plan stages that mean MongoDB read the whole collection
+COLLECTION_SCAN_STAGES = {'COLLSCAN'}
+
+# Collect every stage name in a query plan tree
+def plan_stages(plan):
+    stages = {plan.get('stage')}
+    for child_key in ('inputStage', 'queryPlan'):
+        if child_key in plan:
+            stages |= plan_stages(plan[child_key])
+    for child in plan.get('inputStages', []):
+        stages |= plan_stages(child)
+    stages.discard(None)
+    return stages
+
+# Split any iterable into lists of at most size items without loading it all
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+# Pipeline counting matching documents per value of a field, with the top_n
+# values and the overall total computed in one round trip
+def count_by_pipeline(field, query, top_n):
+    return [
+        {'$match': query},
+        {'$group': {'_id': '$' + field, 'count': {'$sum': 1}}},
+        {'$facet': {
+            'top': [{'$sort': {'count': -1, '_id': 1}}, {'$limit': top_n}],
+            'total': [{'$group': {'_id': None, 'count': {'$sum': '$count'}}}],
+        }},
+    ]
+
+def count_by_result(result):
+    total = result['total'][0]['count'] if result['total'] else 0
+    return with_other_bucket([(row['_id'], row['count']) for row in result['top']], total), total
+
+# Keep the top_n (value, count) pairs and fold the rest into one bucket
+def with_other_bucket(top, total, other_label='Other'):
+    rows = [(value, count) for value, count in top]
+    other = total - sum(count for _value, count in rows)
+    if other > 0:
+        rows.append((other_label, other))
+    return rows
+
+# Per-batch counts from a bulk_write result or BulkWriteError details
+def _bulk_summary(details):
+    return {
+        'inserted': details.get('nInserted', 0),
+        'matched': details.get('nMatched', 0),
+        'modified': details.get('nModified', 0),
+        'upserted': details.get('nUpserted', 0),
+        'errors': len(details.get('writeErrors', [])),
+    }
+
+class QueryCache(object):
+    """ Bounded LRU cache of query results with a per-entry time to live """
+
+    def __init__(self, max_entries=128, ttl=60, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+# Normalize the query and read options into a stable cache key
+    @staticmethod
+    def make_key(*parts):
+        return json.dumps(parts, sort_keys=True, default=str)
+
+# Returns (found, value) so cached empty results still count as hits
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self.clock():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+# Writes report the _ids they changed up to this many, beyond that listeners get None
+MAX_CHANGED_IDS = 10000
+
+class WriteNotifier(object):
+    """ Result cache and write listeners shared by the sync and async shelters """
+
+    def _init_writes(self, cache):
+        # Optional result cache, cleared by writes made through this instance.
+        # Cached results are shared between callers and must not be modified.
+        # Any object with QueryCache's get/put/clear/stats methods can be passed in.
+        self.cache = cache
+
+        # Called with the _ids changed by each write, or None when they are not
+        # known, e.g. RescueViews.refresh_ids to keep the materialized views current
+        self.write_listeners = []
+
+# Notify the write listeners and clear cached reads after a write changes the collection
+    def _invalidate(self, ids=None):
+        for listener in self.write_listeners:
+            listener(ids)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+class AnimalShelter(WriteNotifier):
     """ CRUD operations for Animal collection in MongoDB """
 
-    def __init__(self, user, password):
-        
-        # Connection Constants
-        HOST = 'ec2-3-145-82-100.us-east-2.compute.amazonaws.com'
-        PORT = 27017
-        DB = 'AAC'
-        COL = 'animals'
-
-        # Initialize Connection
-        self.client = MongoClient('mongodb://%s:%s@%s:%d/%s?authSource=%s' % (user,password, HOST, PORT, DB, DB))
+    def __init__(self, user, password, cache_size=0, cache_ttl=60, host=None, port=None, cache=None, client=None,
+                 collection=None, **pool_options):
+
+        # Initialize Connection, an existing client can be passed in instead
+        self.client = client if client is not None else MongoClient(**client_options(user, password, host, port, **pool_options))
         self.database = self.client['%s' % (DB)]
-        self.collection = self.database['%s' % (COL)]
+        self.collection = self.database['%s' % (collection or COL)]
+
+        if cache is None and cache_size > 0:
+            cache = QueryCache(cache_size, cache_ttl)
+        self._init_writes(cache)
+
+# Return a cached result or compute and store it. Failed reads are not cached.
+    def _cached(self, key_parts, compute, default):
+        key = QueryCache.make_key(self.collection.name, *key_parts) if self.cache is not None else None
+        if key is not None:
+            found, value = self.cache.get(key)
+            if found:
+                return value
+        try:
+            value = compute()
+        except Exception as e:
+            print(f"Error querying documents: {e}")
+            return default
+        if key is not None:
+            self.cache.put(key, value)
+        return value
+
+# _ids a write is about to change, only looked up when someone is listening.
+# None once there are too many to pass around.
+    def _matching_ids(self, query, limit=MAX_CHANGED_IDS):
+        if not self.write_listeners:
+            return None
+        ids = [document['_id'] for document in self.collection.find(query, {'_id': 1}, limit=limit + 1)]
+        return ids if len(ids) <= limit else None
+
+# Create any missing indexes from INDEX_SPEC, existing indexes are left untouched
+# unless their options changed, in which case they are dropped and rebuilt.
+# Each index is created on its own so one that cannot be built, e.g. a unique
+# index over duplicate documents, does not keep the others from being created.
+    def ensure_indexes(self, spec=None):
+        spec = spec if spec is not None else INDEX_SPEC
+        created = []
+        for name, keys, *options in spec:
+            options = options[0] if options else {}
+            try:
+                try:
+                    created.append(self.collection.create_index(keys, name=name, **options))
+                except OperationFailure as e:
+                    if e.code not in INDEX_CONFLICT_CODES:
+                        raise
+                    self.collection.drop_index(name)
+                    created.append(self.collection.create_index(keys, name=name, **options))
+            except Exception as e:
+                print(f"Error creating index {name}: {e}")
+        return created
+
+# Index on the fields upserts are matched on, from INDEX_SPEC when it lists one.
+# Without it every replace scans the collection.
+    def _ensure_key_index(self, key_fields):
+        keys = [(field, ASCENDING) for field in key_fields]
+        entry = next((entry for entry in INDEX_SPEC if entry[1] == keys), ('_'.join(key_fields), keys))
+        self.ensure_indexes([entry])
+
+# Run explain on a query and summarize how MongoDB executed it
+    def explain(self, query, sort=None, hint=None, limit=0):
+        command = {'find': self.collection.name, 'filter': query}
+        if sort:
+            command['sort'] = dict(sort)
+        if hint:
+            command['hint'] = hint
+        if limit:
+            command['limit'] = limit
+
+        try:
+            result = self.database.command('explain', command, verbosity='executionStats')
+        except Exception as e:
+            print(f"Error explaining query: {e}")
+            return None
+
+        winning_plan = result['queryPlanner']['winningPlan']
+        stats = result.get('executionStats', {})
+        stages = plan_stages(winning_plan)
+        return {
+            'keys_examined': stats.get('totalKeysExamined'),
+            'docs_examined': stats.get('totalDocsExamined'),
+            'returned': stats.get('nReturned'),
+            'execution_ms': stats.get('executionTimeMillis'),
+            'stages': sorted(stages),
+            'collection_scan': bool(stages & COLLECTION_SCAN_STAGES),
+            'winning_plan': winning_plan,
+        }
 
 # Insert information
     def create(self, data):
         try:
-            inserted = self.collection.insert_one(data)
+            inserted = self.collection.insert_one(with_geo_point(data))
+            self._invalidate([inserted.inserted_id])
             return True if inserted.inserted_id else False
         except Exception as e:
             print(f"Error inserting document: {e}")
             return False
 
+# Insert many documents with unordered bulk inserts, one round trip per batch.
+# Returns a summary per batch so partial failures can be reported.
+    def create_many(self, documents, batch_size=1000):
+        results = []
+        inserted_ids = []
+        for batch in batched(documents, batch_size):
+            try:
+                inserted = self.collection.insert_many([with_geo_point(document) for document in batch], ordered=False)
+                if inserted_ids is not None:
+                    inserted_ids.extend(inserted.inserted_ids)
+                results.append({'inserted': len(inserted.inserted_ids), 'errors': 0})
+            except BulkWriteError as e:
+                # Which documents made it in is not reported, so listeners rebuild everything
+                inserted_ids = None
+                results.append({'inserted': e.details.get('nInserted', 0), 'errors': len(e.details.get('writeErrors', []))})
+            except Exception as e:
+                print(f"Error inserting documents: {e}")
+                results.append({'inserted': 0, 'errors': len(batch)})
+        self._invalidate(inserted_ids)
+        return results
+
+# Insert or replace many documents matched on key_fields with unordered bulk writes.
+# Documents missing a key field cannot be matched and are skipped, rather than
+# all being replaced into the one document whose key fields are null.
+    def upsert_many(self, documents, key_fields=('animal_id', 'rec_num'), batch_size=1000):
+        self._ensure_key_index(key_fields)
+        results = []
+        for batch in batched(documents, batch_size):
+            requests = [ReplaceOne({field: document[field] for field in key_fields}, with_geo_point(document), upsert=True)
+                        for document in batch
+                        if all(document.get(field) is not None for field in key_fields)]
+            skipped = len(batch) - len(requests)
+            if not requests:
+                summary = _bulk_summary({})
+            else:
+                try:
+                    summary = _bulk_summary(self.collection.bulk_write(requests, ordered=False).bulk_api_result)
+                except BulkWriteError as e:
+                    summary = _bulk_summary(e.details)
+                except Exception as e:
+                    print(f"Error upserting documents: {e}")
+                    summary = _bulk_summary({'writeErrors': requests})
+            summary['skipped'] = skipped
+            results.append(summary)
+        self._invalidate()
+        return results
+
 # Read documents in database
-    def read(self, query):
+    def read(self, query, projection=None, **options):
+        return self._cached(('read', query, projection, options),
+                            lambda: [document for batch in self._find_batches(query, projection, **options)
+                                     for document in batch],
+                            [])
+
+# Stream documents in batches so the full result set is never held in memory at once.
+# A failed read ends the stream early unless raise_errors is set, which callers
+# that must not mistake a partial result for a complete one should use.
+    def read_batches(self, query, projection=None, raise_errors=False, **options):
+        if raise_errors:
+            yield from self._find_batches(query, projection, **options)
+            return
         try:
-            current = self.collection.find(query)
-            return list(current)
+            yield from self._find_batches(query, projection, **options)
         except Exception as e:
             print(f"Error querying documents: {e}")
-            return []
-        
+
+    def _find_batches(self, query, projection=None, sort=None, skip=0, limit=0, batch_size=1000, max_time_ms=None, hint=None):
+        cursor = self.collection.find(query, projection, skip=skip, limit=limit, batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+        if hint:
+            cursor = cursor.hint(hint)
+
+        with cursor:
+            batch = []
+            for document in cursor:
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+# Stream documents one at a time
+    def read_iter(self, query, projection=None, **options):
+        for batch in self.read_batches(query, projection, **options):
+            yield from batch
+
+# Build a DataFrame chunk by chunk from the streamed batches
+    def read_dataframe(self, query, projection=None, columns=None, **options):
+        return self._cached(('read_dataframe', query, projection, columns, options),
+                            lambda: self._build_dataframe(query, projection, columns, **options),
+                            pd.DataFrame(columns=columns))
+
+    def _build_dataframe(self, query, projection=None, columns=None, **options):
+        chunks = [pd.DataFrame.from_records(batch, columns=columns)
+                  for batch in self._find_batches(query, projection, **options)]
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(chunks, ignore_index=True)
+
+# Build a typed, column-oriented DataFrame directly from the cursor. Each batch
+# is split into per-column value lists and converted, so no list of dicts is
+# kept. include_id adds the _id column first, as the live dataset keys rows by it.
+    def read_typed_dataframe(self, query, schema=None, batch_size=5000, include_id=False, **options):
+        schema = schema if schema is not None else AAC_SCHEMA
+        if include_id:
+            schema = {'_id': 'object', **schema}
+        projection = {'_id': int(include_id), **{column: 1 for column in schema if column != '_id'}}
+        chunks = {column: [] for column in schema}
+
+        for batch in self.read_batches(query, projection, batch_size=batch_size, **options):
+            for column, dtype in schema.items():
+                chunks[column].append(typed_column([document.get(column) for document in batch], dtype,
+                                                   DATETIME_LAYOUTS.get(column)))
+
+        if not any(chunks.values()):
+            return typed_frame([], schema)
+        return pd.DataFrame({column: concat_column(chunks[column], DATETIME_LAYOUTS.get(column)) for column in schema})
+
+# Count documents matching a query
+    def count(self, query, max_time_ms=None, hint=None):
+        return self._cached(('count', query, hint), lambda: self._count(query, max_time_ms, hint), 0)
+
+    def _count(self, query, max_time_ms=None, hint=None):
+        # An empty query can use the collection metadata instead of scanning
+        if not query:
+            return self.collection.estimated_document_count()
+        options = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+        if hint:
+            options['hint'] = hint
+        return self.collection.count_documents(query, **options)
+
+# Count matching documents per value of a field with a $group in MongoDB.
+# Returns the top_n (value, count) pairs plus an Other bucket, and the total.
+    def count_by(self, field, query=None, top_n=20, hint=None):
+        return self._cached(('count_by', field, query, top_n, hint),
+                            lambda: self._count_by(field, query or {}, top_n, hint),
+                            ([], 0))
+
+    def _count_by(self, field, query, top_n, hint):
+        options = {'hint': hint} if hint else {}
+        return count_by_result(next(self.collection.aggregate(count_by_pipeline(field, query, top_n), **options)))
+
+# Bin the matching animals inside the map viewport into a grid sized for the
+# zoom level. Each cell comes back with its count and average position, plus
+# the name and breed of one animal for cells holding a single outcome.
+    def map_clusters(self, query, bounds=None, zoom=10, max_cells=2000):
+        return self._cached(('map_clusters', query, bounds, zoom, max_cells),
+                            lambda: list(self.collection.aggregate(self._map_cluster_pipeline(query, bounds, zoom, max_cells))),
+                            [])
+
+    def _map_cluster_pipeline(self, query, bounds, zoom, max_cells):
+        cell = GRID_DEGREES_AT_ZOOM_0 / (2 ** zoom)
+        geo = viewport_query(bounds) if bounds else {'location_point': {'$exists': True}}
+        match = {'$and': [query, geo]} if query and geo else (query or geo)
+        return [
+            {'$match': match},
+            {'$group': {
+                '_id': {'lat': {'$floor': {'$divide': ['$location_lat', cell]}},
+                        'lng': {'$floor': {'$divide': ['$location_long', cell]}}},
+                'count': {'$sum': 1},
+                'lat': {'$avg': '$location_lat'},
+                'lng': {'$avg': '$location_long'},
+                'name': {'$first': '$name'},
+                'breed': {'$first': '$breed'},
+            }},
+            {'$sort': {'count': -1}},
+            {'$limit': max_cells},
+            {'$project': {'_id': 0, 'count': 1, 'lat': 1, 'lng': 1,
+                          'name': {'$cond': [{'$eq': ['$count', 1]}, '$name', '$$REMOVE']},
+                          'breed': {'$cond': [{'$eq': ['$count', 1]}, '$breed', '$$REMOVE']}}},
+        ]
+
+# Backfill location_point on documents loaded before it existed
+    def ensure_geo_points(self):
+        try:
+            result = self.collection.update_many(
+                {'location_point': {'$exists': False},
+                 'location_lat': {'$type': 'number'},
+                 'location_long': {'$type': 'number'}},
+                [{'$set': {'location_point': {'type': 'Point', 'coordinates': ['$location_long', '$location_lat']}}}])
+            self._invalidate()
+            return result.modified_count
+        except Exception as e:
+            print(f"Error adding location points: {e}")
+            return 0
+
 # Modify information in documents
     def update(self, query, update_data):
         try:
-            update_result = self.collection.update_many(query, {'$set': update_data})
+            ids = self._matching_ids(query)
+            update_result = self.collection.update_many(query, update_document(update_data))
+            self._invalidate(ids)
             return update_result.modified_count
         except Exception as e:
             print(f"Error updating documents: {e}")
@@ -46,9 +686,128 @@ class AnimalShelter(object):
 # Remove a document
     def delete(self, query):
         try:
+            ids = self._matching_ids(query)
             delete_result = self.collection.delete_many(query)
+            self._invalidate(ids)
+            return delete_result.deleted_count
+        except Exception as e:
+            print(f"Error deleting documents: {e}")
+            return 0
+
+class AsyncAnimalShelter(WriteNotifier):
+    """ asyncio CRUD operations for Animal collection in MongoDB """
+
+    def __init__(self, user, password, host=None, port=None, cache=None, **pool_options):
+        if AsyncMongoClient is None:
+            raise RuntimeError("AsyncAnimalShelter requires pymongo 4.9 or later")
+
+        # Initialize Connection, the pool is shared by every coroutine using this instance
+        self.client = AsyncMongoClient(**client_options(user, password, host, port, **pool_options))
+        self.database = self.client[DB]
+        self.collection = self.database[COL]
+        self._init_writes(cache)
+
+    async def close(self):
+        await self.client.close()
+
+# Listeners and caches may block, so they run outside the event loop
+    async def _invalidate_async(self, ids=None):
+        if self.write_listeners or self.cache is not None:
+            await asyncio.to_thread(self._invalidate, ids)
+
+    async def _matching_ids(self, query, limit=MAX_CHANGED_IDS):
+        if not self.write_listeners:
+            return None
+        ids = [document['_id'] async for document in self.collection.find(query, {'_id': 1}, limit=limit + 1)]
+        return ids if len(ids) <= limit else None
+
+# Insert information
+    async def create(self, data):
+        try:
+            inserted = await self.collection.insert_one(with_geo_point(data))
+            await self._invalidate_async([inserted.inserted_id])
+            return True if inserted.inserted_id else False
+        except Exception as e:
+            print(f"Error inserting document: {e}")
+            return False
+
+# Read documents in database
+    async def read(self, query, projection=None, **options):
+        documents = []
+        async for batch in self.read_batches(query, projection, **options):
+            documents.extend(batch)
+        return documents
+
+# Stream documents in batches without blocking the event loop
+    async def read_batches(self, query, projection=None, sort=None, skip=0, limit=0, batch_size=1000, max_time_ms=None, hint=None):
+        try:
+            cursor = self.collection.find(query, projection, skip=skip, limit=limit, batch_size=batch_size)
+            if sort:
+                cursor = cursor.sort(sort)
+            if max_time_ms:
+                cursor = cursor.max_time_ms(max_time_ms)
+            if hint:
+                cursor = cursor.hint(hint)
+
+            batch = []
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        except Exception as e:
+            print(f"Error querying documents: {e}")
+
+    async def read_dataframe(self, query, projection=None, columns=None, **options):
+        chunks = []
+        async for batch in self.read_batches(query, projection, **options):
+            chunks.append(pd.DataFrame.from_records(batch, columns=columns))
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(chunks, ignore_index=True)
+
+# Count documents matching a query
+    async def count(self, query, max_time_ms=None, hint=None):
+        try:
+            if not query:
+                return await self.collection.estimated_document_count()
+            options = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+            if hint:
+                options['hint'] = hint
+            return await self.collection.count_documents(query, **options)
+        except Exception as e:
+            print(f"Error counting documents: {e}")
+            return 0
+
+    async def count_by(self, field, query=None, top_n=20, hint=None):
+        try:
+            options = {'hint': hint} if hint else {}
+            cursor = await self.collection.aggregate(count_by_pipeline(field, query or {}, top_n), **options)
+            return count_by_result(await cursor.next())
+        except Exception as e:
+            print(f"Error querying documents: {e}")
+            return [], 0
+
+# Modify information in documents
+    async def update(self, query, update_data):
+        try:
+            ids = await self._matching_ids(query)
+            update_result = await self.collection.update_many(query, update_document(update_data))
+            await self._invalidate_async(ids)
+            return update_result.modified_count
+        except Exception as e:
+            print(f"Error updating documents: {e}")
+            return 0
+
+# Remove a document
+    async def delete(self, query):
+        try:
+            ids = await self._matching_ids(query)
+            delete_result = await self.collection.delete_many(query)
+            await self._invalidate_async(ids)
             return delete_result.deleted_count
         except Exception as e:
             print(f"Error deleting documents: {e}")
             return 0
-      
@@ -1,52 +1,160 @@
 # Configure the necessary Python module imports for dashboard components
 import os
+import atexit
+import threading
 import dash_leaflet as dl
-from dash import Dash, dcc, html, dash_table, Input, Output
+from dash import Dash, dcc, html, dash_table, Input, Output, ctx, no_update
 import dash_leaflet as dl
 import plotly.express as px
-import base64
 import pandas as pd
 
 # Import CRUD module
-from crud_module import AnimalShelter
+from crud_module import AAC_FIELDS, AnimalShelter, QueryCache
+from table_query import translate_filter, translate_sort, combine_queries
+from rescue_profiles import RescueRegistry
+from rescue_views import RescueViews
+from live_dataset import LiveDataset
+from frame_engine import LiveFrameEngine
+from shared_cache import cache_from_env
+from metrics import ContextThreadPoolExecutor, instrumented, render as render_metrics
 
 ###########################
 # Data Manipulation / Model
 ###########################
 # Connection Variables
-username = "aacuser"
-password = "SNHU1234!"
+username = os.getenv('AAC_USER', "aacuser")
+password = os.getenv('AAC_PASSWORD', "SNHU1234!")
 
 
 # Connect to database via CRUD Module
-db = AnimalShelter(username, password)
+# Repeated filter clicks are served from a result cache. CACHE_BACKEND=file or
+# redis shares it between worker processes, see gunicorn.conf.py.
+db = AnimalShelter(username, password, cache=cache_from_env(max_entries=256, ttl=300))
 
-# sending the read method an empty document requests all documents be returned
-df = pd.DataFrame.from_records(db.read({}))
+desired_order = AAC_FIELDS
 
-# Drop unnecessary MongoDB id column
-df.drop(columns=['_id'],inplace=True)
+# Columns hidden in the table by default. Their values are not sent to the
+# browser until the user shows them.
+hidden_columns = ['rec_num', 'datetime', 'monthyear', 'location_lat', 'location_long',
+                  'age_upon_outcome_in_weeks']
 
-desired_order = ['animal_type', 'animal_id', 'age_upon_outcome', 'breed', 'color', 'date_of_birth', 
-                 'name', 'outcome_type', 'outcome_subtype', 'sex_upon_outcome', 'rec_num', 
-                 'datetime', 'monthyear', 'location_lat', 'location_long', 'age_upon_outcome_in_weeks']
-df = df[desired_order]
+# rec_num is always sent so the map can look up the selected row on demand
+ROW_KEY = 'rec_num'
+
+# Fields the map needs for the selected row, read only when a row is selected
+map_projection = {'_id': 0, 'location_lat': 1, 'location_long': 1, 'breed': 1, 'name': 1}
+
+# Only request the visible fields and leave out the MongoDB id column
+def visible_columns(hidden):
+    return [column for column in desired_order if column not in (hidden or []) or column == ROW_KEY]
+
+# Rescue filters are compiled into index-friendly queries against the breed list.
+# They are recompiled when a write brings a new breed and every
+# RESCUE_BREEDS_INTERVAL seconds for breeds written by other processes.
+rescue_registry = RescueRegistry(db, refresh=False)
+
+# The rescue categories are also kept as pre-filtered collections. RESCUE_VIEWS=1
+# rebuilds them on a schedule in this process and updates them after every write
+# through db. RESCUE_VIEWS=read only reads the views kept by a separate
+# `python rescue_views.py` refresher, which is how gunicorn workers should use
+# them. RESCUE_VIEWS=0 turns them off.
+RESCUE_VIEWS_MODE = os.getenv('RESCUE_VIEWS', '1')
+rescue_views = None
+if RESCUE_VIEWS_MODE in ('1', 'read'):
+    rescue_views = RescueViews(db, rescue_registry, desired_order)
+
+# Callbacks read from an in-memory copy of the collection that follows the change
+# feed, so refreshes cost only the changed documents. LIVE_DATASET=0 queries MongoDB directly.
+# The copy warm-starts from a local Parquet snapshot when it is still current.
+# The copy is held as typed columns (categories, float32 coordinates, parsed
+# datetimes), and queries on it are answered by a column-oriented engine with
+# per-value codes. Changed rows are applied to a copy of the engine, and only
+# large or ill-typed changes rebuild it in the background.
+live_dataset = None
+live_engine = None
+if os.getenv('LIVE_DATASET', '1') == '1':
+    live_dataset = LiveDataset(db, desired_order, snapshot_path=os.getenv('SNAPSHOT_PATH', 'animals_snapshot.parquet'))
+    live_engine = LiveFrameEngine(live_dataset)
+    atexit.register(lambda: live_dataset.ready.is_set() and live_dataset.save_snapshot())
+
+# Nothing touches the database at import so the layout is served right away.
+# Indexes, the breed list and the live dataset are prepared in the background.
+def warm_up():
+    # Make sure the filtered and sorted fields are indexed before the filters are compiled
+    db.ensure_indexes()
+    rescue_registry.refresh()
+    rescue_registry.start(interval=int(os.getenv('RESCUE_BREEDS_INTERVAL', 300)))
+    rescue_registry.report_collection_scans()
+    if live_dataset is not None:
+        live_dataset.start(background=True)
+    if rescue_views is not None and RESCUE_VIEWS_MODE == 'read':
+        rescue_views.attach()
+    elif rescue_views is not None:
+        rescue_views.start(interval=int(os.getenv('RESCUE_VIEWS_INTERVAL', 300)))
+
+threading.Thread(target=warm_up, daemon=True).start()
+
+# Callbacks query MongoDB directly until the live dataset has finished loading
+def data_source():
+    if live_dataset is not None and live_dataset.ready.is_set():
+        return live_engine
+    return db
+
+# Version of the rows a source answers from, part of the key of anything cached
+# from them. The live dataset changes without writes through db, so its results
+# cannot rely on db clearing the cache.
+def data_version(source):
+    return live_dataset.version if source is live_engine else None
+
+# Where to read a filter from. A materialized rescue category already holds only
+# the matching animals, so just the table filter is applied to it. The live
+# dataset answers the profile queries from memory and does not need the views.
+def filtered_query(filter_type, filter_query, source):
+    table_filter = translate_filter(filter_query)
+    view = rescue_views.get(filter_type) if rescue_views is not None and source is db else None
+    if view is not None:
+        return view, table_filter, None
+
+    profile = rescue_registry.get(filter_type)
+    return source, combine_queries(rescue_registry.query(filter_type), table_filter), profile.hint if profile else None
+
+# Independent queries within a callback run side by side over the shared connection
+# pool. Their MongoDB commands count towards the callback's slow-call log.
+query_pool = ContextThreadPoolExecutor(max_workers=int(os.getenv('QUERY_THREADS', 8)))
+
+# Number of rows sent to the browser per page of the data table
+PAGE_SIZE = 10
+
+# Default map view over the Austin, TX area
+MAP_CENTER = [30.75, -97.48]
+MAP_ZOOM = 10
+
+# Largest breeds shown in the pie chart, the rest are grouped as Other
+PIE_SLICES = 20
 
 #########################
 # Dashboard Layout / View
 #########################
-app = Dash(__name__)
+# Callback responses are gzip/brotli compressed when the browser accepts it
+app = Dash(__name__, compress=True)
+
+# WSGI entry point for production servers: gunicorn -c gunicorn.conf.py dashboard:server
+server = app.server
+
+# Callback and MongoDB timings in the Prometheus text format
+@server.route('/metrics')
+def metrics_endpoint():
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-#Add in Grazioso Salvare’s logo
+#Add in Grazioso Salvare’s logo, served as a static file from the assets folder
 image_filename = 'Grazioso_Salvare_Logo.png' # replace with your own image
-encoded_image = base64.b64encode(open(image_filename, 'rb').read())
 
 # Title
 app.layout = html.Div([
     html.Div(className='row',
             style={'display': 'flex', 'margin': '10px'},
              children=[
-                 html.Img(src='data:image/png;base64,{}'.format(encoded_image.decode()),style={'height':'5%','width':'5%'}),
+                 html.Img(src=app.get_asset_url(image_filename),style={'height':'5%','width':'5%'}),
                  html.Center(html.B(html.H1('Austin Animal Shelter - Data Dashboard')))
              ]),
 
@@ -71,23 +179,26 @@ app.layout = html.Div([
     ),
     html.Hr(),
     dash_table.DataTable(id='datatable-id',
-                         columns=[{"name": i, "id": i, "deletable": False, "selectable": True, "hideable": True} for i in df.columns],
-                         hidden_columns=['rec_num', 'datetime', 'monthyear', 'location_lat', 'location_long', 
-                                         'age_upon_outcome_in_weeks'],
-                         data=df.to_dict('records'),
+                         columns=[{"name": i, "id": i, "deletable": False, "selectable": True, "hideable": True} for i in desired_order],
+                         hidden_columns=hidden_columns,
+                         data=[],
                         # Features for the interactive data table to make it user-friendly for the client
+                        # Paging, sorting and filtering run in MongoDB so only one page is sent to the browser
                          editable=False,
-                         filter_action = "native",
-                         sort_action = "native",
+                         filter_action = "custom",
+                         filter_query = "",
+                         sort_action = "custom",
                          sort_mode = "multi",
                          column_selectable = False,
                          row_selectable = "single",
                          row_deletable = False,
                          selected_columns = [],
                          selected_rows = [0],
-                         page_action = "native",
+                         sort_by = [],
+                         page_action = "custom",
                          page_current = 0,
-                         page_size = 10,
+                         page_size = PAGE_SIZE,
+                         page_count = 1,
                         ),
     html.Br(),
     html.Hr(),
@@ -103,128 +214,108 @@ app.layout = html.Div([
             ),
         html.Div(
             id='map-id',
-            className='col s12 m6'
-            )
+            className='col s12 m6',
+            children=[
+                dl.Map(id='map-view-id', style={'width': '1000px', 'height': '500px'}, center=MAP_CENTER, zoom=MAP_ZOOM, children=[
+                    dl.TileLayer(id="base-layer-id"),
+                    dl.LayerGroup(id='cluster-layer-id'),
+                    dl.LayerGroup(id='selected-layer-id'),
+                ])
+            ])
         ])
 ])
 
 #############################################
 # Interaction Between Components / Controller
 #############################################    
-@app.callback(Output('datatable-id','data'),
-              [Input('filter-type', 'value')])
-def update_dashboard(filter_type):
+# Only the requested page of the current filter and sort is read from the database
+@app.callback([Output('datatable-id','data'),
+               Output('datatable-id','page_count'),
+               Output('datatable-id','page_current')],
+              [Input('filter-type', 'value'),
+               Input('datatable-id', 'filter_query'),
+               Input('datatable-id', 'sort_by'),
+               Input('datatable-id', 'page_current'),
+               Input('datatable-id', 'page_size'),
+               Input('datatable-id', 'hidden_columns')])
+@instrumented('update_dashboard')
+def update_dashboard(filter_type, filter_query, sort_by, page_current, page_size, hidden):
     if filter_type is None:
-        return
+        return [], 1, 0
+
+    # A new filter starts back on the first page
+    triggered = ctx.triggered_prop_ids
+    if not triggered or 'filter-type.value' in triggered or 'datatable-id.filter_query' in triggered:
+        page_current = 0
+
+    data, page_count = table_page(filter_type, filter_query, sort_by, page_current, page_size, hidden)
+    return data, page_count, page_current
 
-    data_frame = None
-
-    # Query data based on the selected filter type
-    if filter_type == 'Water':
-        data_frame = pd.DataFrame.from_records(db.read(
-            { "$and": [
-                {"$or": [
-                    {"breed": {"$regex": "Labrador Retriever Mix"}},
-                    {'breed': {'$regex': 'Chesapeake Bay Retriever'}},
-                    {'breed': {'$regex': 'Newfoundland'}}
-                ]},
-                {'sex_upon_outcome': 'Intact Female'},
-                {'$and': [
-                    {'age_upon_outcome_in_weeks': {'$gt': 26}},
-                    {'age_upon_outcome_in_weeks': {'$lt': 156}}
-                ]}
-            ]}
-        ))
-    elif filter_type == 'Mountain':
-        data_frame = pd.DataFrame.from_records(db.read(
-            { "$and": [
-                {"$or": [
-                    {"breed": {"$regex": 'German Shepherd'}},
-                    {'breed': {'$regex': 'Alaskan Malamute'}},
-                    {'breed': {'$regex': 'Old English Sheepdog'}},
-                    {'breed': {'$regex': 'Siberian Husky'}},
-                    {'breed': {'$regex': 'Rottweiler'}}
-                ]},
-                {'sex_upon_outcome': 'Intact Male'},
-                {'$and': [
-                    {'age_upon_outcome_in_weeks': {'$gt': 26}},
-                    {'age_upon_outcome_in_weeks': {'$lt': 156}}
-                ]}
-            ]}
-        ))
-    elif filter_type == 'Disaster':
-        data_frame = pd.DataFrame.from_records(db.read(
-            { "$and": [
-                {"$or": [
-                    {"breed": {"$regex": 'Doberman Pinscher'}},
-                    {'breed': {'$regex': 'German Shepherd'}},
-                    {'breed': {'$regex': 'Golden Retriever'}},
-                    {'breed': {'$regex': 'Bloodhound'}},
-                    {'breed': {'$regex': 'Rottweiler'}}
-                ]},
-                {'sex_upon_outcome': 'Intact Male'},
-                {'$and': [
-                    {'age_upon_outcome_in_weeks': {'$gt': 20}},
-                    {'age_upon_outcome_in_weeks': {'$lt': 300}}
-                ]}
-            ]}
-        ))
-    elif filter_type == 'Service':
-        data_frame = pd.DataFrame.from_records(db.read(
-            { "$and": [
-                {"$or": [
-                    {"breed": {"$regex": "Labrador Retriever"}},
-                    {"breed": {"$regex": "Golden Retriever"}},
-                    {"breed": {"$regex": "German Shepherd"}},
-                ]},
-                {"$and": [
-                    {"age_upon_outcome_in_weeks": {"$gt": 52}},
-                    {"age_upon_outcome_in_weeks": {"$lt": 520}} 
-                ]}
-            ]}
-        ))
-    elif filter_type == 'Cats':
-        data_frame = pd.DataFrame.from_records(db.read({'animal_type': 'Cat'}))
-    elif filter_type == 'Dogs':
-        data_frame = pd.DataFrame.from_records(db.read({'animal_type': 'Dog'}))
-    else:
-        data_frame = pd.DataFrame.from_records(db.read({}))
-
-    data_frame.drop(columns=['_id'], inplace=True)
-    return data_frame.to_dict('records')
+# Read one page of the table, kept separate from the callback so it can be benchmarked
+def table_page(filter_type, filter_query, sort_by, page_current, page_size, hidden=hidden_columns):
+    page_size = page_size or PAGE_SIZE
+    columns = visible_columns(hidden)
+    projection = {'_id': 0, **{column: 1 for column in columns}}
+    source, query, hint = filtered_query(filter_type, filter_query, data_source())
+    total = query_pool.submit(source.count, query, hint=hint)
+
+    data_frame = source.read_dataframe(query, projection, columns=columns,
+                                   sort=translate_sort(sort_by),
+                                   skip=page_current * page_size,
+                                   limit=page_size,
+                                   hint=hint)
+    page_count = max(1, -(-total.result() // page_size))
+    return data_frame.to_dict('records'), page_count
 
 # Display the breeds of animal based on quantity represented in
 # the data table
+# Breed counts are grouped by the data source, so only the top slices are sent to the figure
 @app.callback(
     Output('graph-id', "children"),
-    [Input('datatable-id', "derived_virtual_data")]
+    [Input('filter-type', 'value'),
+     Input('datatable-id', 'filter_query')]
 )
-def update_graphs(viewData):
-    if viewData is None:
+@instrumented('update_graphs')
+def update_graphs(filter_type, filter_query):
+    if filter_type is None:
         return
 
-    df = pd.DataFrame.from_records(viewData)
-    animal_count = len(df)
+    # Built figures are kept in the shared cache next to the query results
+    source = data_source()
+    cache_key = QueryCache.make_key('breed_pie', filter_type, filter_query, data_version(source))
+    found, figure = db.cache.get(cache_key) if db.cache is not None else (False, None)
+    if not found:
+        figure = breed_pie(filter_type, filter_query, source)
+        if db.cache is not None:
+            db.cache.put(cache_key, figure)
+
+    return [
+        dcc.Graph(            
+            figure = figure
+        )    
+    ]
+
+def breed_pie(filter_type, filter_query, source=None):
+    source, query, hint = filtered_query(filter_type, filter_query, source or data_source())
+    breed_counts, animal_count = source.count_by('breed', query, top_n=PIE_SLICES, hint=hint)
 
     title = f'Found Animals - {animal_count} Total'
 
     # Add a Pie Chart
-    fig = px.pie(df, names='breed', title=title)
+    fig = px.pie(names=[breed for breed, _count in breed_counts],
+                 values=[count for _breed, count in breed_counts],
+                 title=title)
     fig.update_traces(textposition='inside', 
                       hovertemplate='Breed: %{label} <br>Count: %{value}')
     fig.update_layout(uniformtext_minsize=12, uniformtext_mode='hide')
-
-    return [
-        dcc.Graph(            
-            figure = fig
-        )    
-    ]
+    return fig.to_dict()
 
 #This callback will highlight a cell on the data table when the user selects it
 @app.callback(
     Output('datatable-id', 'style_data_conditional'),
     [Input('datatable-id', 'selected_columns')]
 )
+@instrumented('update_styles')
 def update_styles(selected_columns):
     return [{
         'if': { 'column_id': i },
@@ -232,44 +323,73 @@ def update_styles(selected_columns):
     } for i in selected_columns]
 
 
-# This callback will update the geo-location chart for the selected data entry
-# The iloc method allows for a row, column notation to pull data from the datatable
+# Every animal in the current filter is drawn as grid clusters binned in MongoDB
+# for the visible part of the map, so the marker count depends on the viewport
+@app.callback(
+    Output('cluster-layer-id', "children"),
+    [Input('filter-type', 'value'),
+     Input('datatable-id', 'filter_query'),
+     Input('map-view-id', 'bounds'),
+     Input('map-view-id', 'zoom')]
+)
+@instrumented('update_clusters')
+def update_clusters(filter_type, filter_query, bounds, zoom):
+    if filter_type is None:
+        return []
+
+    source, query, _hint = filtered_query(filter_type, filter_query, db)
+    clusters = source.map_clusters(query, bounds=bounds, zoom=int(zoom if zoom is not None else MAP_ZOOM))
+    largest = max([cluster['count'] for cluster in clusters], default=1)
+
+    markers = []
+    for cluster in clusters:
+        if cluster['count'] == 1:
+            label = f"{cluster.get('name') or 'Unnamed'} - {cluster.get('breed')}"
+        else:
+            label = f"{cluster['count']} animals"
+        markers.append(dl.CircleMarker(center=[cluster['lat'], cluster['lng']],
+                                       radius=5 + 20 * (cluster['count'] / largest) ** 0.5,
+                                       children=[dl.Tooltip(label)]))
+    return markers
+
+# This callback will mark the selected data entry on the map
+# Only the selected row is read from the page data, the table is not rebuilt
 @app.callback(
-    Output('map-id', "children"),
+    [Output('selected-layer-id', "children"),
+     Output('map-view-id', 'viewport')],
     [Input('datatable-id', "derived_virtual_data"),
      Input('datatable-id', "derived_virtual_selected_rows")]
 )
-def update_map(viewData, index):  
-    if viewData is None:
-        return
-    elif index is None:
-        return
+@instrumented('update_map')
+def update_map(viewData, index):
+    # Because we only allow single row selection, the list can be converted to a row index here
+    if not viewData or not index or index[0] >= len(viewData):
+        return [], no_update
 
-    dff = pd.DataFrame.from_dict(viewData)
-    
-    # Default map to Austin, TX area if columns are not present
-    if 'location_lat' not in dff.columns or 'location_long' not in dff.columns:
-        return [dl.Map(style={'width': '1000px', 'height': '500px'}, center=[30.75,-97.48], zoom=10, children=[dl.TileLayer(id="base-layer-id")])]
+    # The location fields are not part of the page data, so read them for this row only
+    rows = data_source().read({ROW_KEY: viewData[index[0]].get(ROW_KEY)}, map_projection, limit=1)
+    if not rows:
+        return [], no_update
 
-    # Because we only allow single row selection, the list can be converted to a row index here
-    row = index[0]
+    selected = rows[0]
+    lat, lng = selected.get('location_lat'), selected.get('location_long')
+
+    # Leave the map on the Austin, TX area if the row has no location
+    if pd.isna(lat) or pd.isna(lng):
+        return [], no_update
 
     return [
-        dl.Map(style={'width': '1000px', 'height': '500px'}, center=[dff['location_lat'].iloc[row],dff['location_long'].iloc[row]], zoom=10, children=[
-            dl.TileLayer(id="base-layer-id"),
-
-            # Marker with tool tip and popup
-            dl.Marker(position=[dff['location_lat'].iloc[row],dff['location_long'].iloc[row]], 
-                children=[
-                    dl.Tooltip(dff['breed'].iloc[row]),
-                    dl.Popup([
-                    html.H3("Animal Name"),
-                    html.P(dff['name'].iloc[row])
-                ])
+        # Marker with tool tip and popup
+        dl.Marker(position=[lat, lng],
+            children=[
+                dl.Tooltip(selected.get('breed')),
+                dl.Popup([
+                html.H3("Animal Name"),
+                html.P(selected.get('name'))
             ])
         ])
-    ]
-    
+    ], {'center': [lat, lng], 'zoom': MAP_ZOOM, 'transition': 'flyTo'}
+
 if __name__ == '__main__':
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', 8050))
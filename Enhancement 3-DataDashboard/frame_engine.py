@@ -0,0 +1,535 @@
+from collections import Counter
+import copy
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from bson import ObjectId
+
+from crud_module import DATETIME_LAYOUTS, column_values, format_datetimes, schema_for, typed_column, with_other_bucket
+from live_dataset import COMPARISONS, matches_field, sort_key
+
+# Fields kept as per-row codes into their distinct values even when their column
+# could not be typed as a category. These are the fields the rescue profiles and
+# type filters test for equality.
+INDEXED_FIELDS = ('animal_type', 'breed', 'sex_upon_outcome')
+
+# Numeric fields kept in sorted order so range conditions are two binary searches.
+# rec_num is the usual target of numeric table filters.
+SORTED_FIELDS = ('age_upon_outcome_in_weeks', 'rec_num')
+
+# Layout of datetime columns without one in DATETIME_LAYOUTS
+DEFAULT_DATETIME_LAYOUT = '%Y-%m-%d %H:%M:%S'
+
+NUMBER_COMPARISONS = {'$gt': np.greater, '$gte': np.greater_equal, '$lt': np.less, '$lte': np.less_equal}
+
+# Changed rows applied to the engine in place of a rebuild: at least
+# DELTA_MIN_ROWS, or this share of the rows when that is more
+DELTA_MIN_ROWS = 1000
+DELTA_SHARE = 0.05
+
+
+class FrameQueryEngine(object):
+    """ Column-oriented copy of a typed frame answering queries with vectorized masks """
+
+    def __init__(self, frame, fields=None, indexed=INDEXED_FIELDS, sorted_fields=SORTED_FIELDS):
+        self.fields = list(fields) if fields is not None else [column for column in frame.columns if column != '_id']
+        self.size = len(frame)
+
+        # Each column is kept in one of four kinds:
+        #   codes     per-row codes into the distinct values, -1 where missing
+        #   number    int64 or float64 values with a mask of the missing ones
+        #   datetime  int64 nanoseconds with a missing mask, shown in the field's layout
+        #   object    the values as MongoDB returned them
+        self.kinds = {}
+        self.columns = {}
+        self.missing = {}
+        self.codes = {}
+        self.uniques = {}
+        for field in ['_id'] + self.fields:
+            if field in frame:
+                self._add_column(field, frame[field], field in indexed)
+
+        # Ascending numeric values and the row each came from, non-numbers left out
+        self.sorted = {}
+        self._sort_fields(sorted_fields)
+
+        # Sort ranks and the row of each _id are built on first use
+        self.ranks = {}
+        self.rows_by_id = None
+
+    @classmethod
+    def from_shelter(cls, shelter, fields, query=None, **options):
+        frame = shelter.read_typed_dataframe(query or {}, schema_for(fields), include_id=True, raise_errors=True)
+        return cls(frame, fields, **options)
+
+    def _add_column(self, field, column, indexed):
+        dtype = column.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            self.kinds[field] = 'codes'
+            self.codes[field] = column.cat.codes.to_numpy().astype(np.int64)
+            self.uniques[field] = list(dtype.categories)
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            self.kinds[field] = 'datetime'
+            self.columns[field] = column.to_numpy(dtype='datetime64[ns]').view(np.int64)
+            self.missing[field] = column.isna().to_numpy()
+        elif pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            self.kinds[field] = 'number'
+            if pd.api.types.is_integer_dtype(dtype):
+                self.columns[field] = column.to_numpy(dtype=np.int64, na_value=0)
+            elif dtype == np.float32:
+                # Widened through the shortest text, the value the float32 was rounded from
+                self.columns[field] = column.to_numpy().astype(str).astype(np.float64)
+            else:
+                self.columns[field] = column.to_numpy(dtype=np.float64)
+            self.missing[field] = column.isna().to_numpy()
+        else:
+            values = column_values(column)
+            if indexed:
+                try:
+                    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+                except TypeError:
+                    # Unhashable values such as embedded documents
+                    indexed = False
+            if indexed:
+                self.kinds[field] = 'codes'
+                self.codes[field] = codes.astype(np.int64)
+                self.uniques[field] = list(uniques)
+            else:
+                self.kinds[field] = 'object'
+                self.columns[field] = values
+
+    def _sort_fields(self, sorted_fields):
+        for field in sorted_fields:
+            numbers = self._numbers(field)
+            if numbers is not None:
+                order = np.argsort(numbers, kind='stable')
+                order = order[:np.count_nonzero(~np.isnan(numbers))]
+                self.sorted[field] = (numbers[order], order)
+
+    # Float values of a numeric column, NaN where a row holds no number
+    def _numbers(self, field):
+        kind = self.kinds.get(field)
+        if kind == 'number':
+            return np.where(self.missing[field], np.nan, self.columns[field].astype(np.float64))
+        if kind == 'object':
+            return np.array([value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+                             for value in self.columns[field]], dtype=np.float64)
+        return None
+
+# Per-row codes and the distinct values they point to. Datetime columns get
+# theirs on first use, as only text conditions and counts need them.
+    def _dictionary(self, field):
+        if field in self.codes:
+            return self.codes[field], self.uniques[field]
+        if self.kinds.get(field) != 'datetime':
+            return np.full(self.size, -1, dtype=np.int64), []
+        present = ~self.missing[field]
+        values, inverse = np.unique(self.columns[field][present], return_inverse=True)
+        codes = np.full(self.size, -1, dtype=np.int64)
+        codes[present] = inverse
+        uniques = format_datetimes(values.view('datetime64[ns]'), self._layout(field)).tolist()
+        self.uniques[field] = uniques
+        self.codes[field] = codes
+        return codes, uniques
+
+    def _layout(self, field):
+        return DATETIME_LAYOUTS.get(field, DEFAULT_DATETIME_LAYOUT)
+
+# Python values of a column for the given rows (all rows by default), None where missing
+    def _values(self, field, rows=None):
+        kind = self.kinds.get(field)
+        pick = (lambda array: array) if rows is None else (lambda array: array[rows])
+        if kind is None:
+            return np.full(self.size if rows is None else len(rows), None, dtype=object)
+        if kind == 'codes':
+            lookup = np.empty(len(self.uniques[field]) + 1, dtype=object)
+            lookup[:-1] = self.uniques[field]
+            lookup[-1] = None
+            return lookup[pick(self.codes[field])]
+        if kind == 'object':
+            return pick(self.columns[field])
+        if kind == 'number':
+            values = np.empty(len(pick(self.missing[field])), dtype=object)
+            values[:] = pick(self.columns[field]).tolist()
+        else:
+            values = format_datetimes(pick(self.columns[field]).view('datetime64[ns]'), self._layout(field))
+        values[pick(self.missing[field])] = None
+        return values
+
+    def _row_of(self):
+        if self.rows_by_id is None:
+            self.rows_by_id = {document_id: row for row, document_id in enumerate(self._values('_id'))}
+        return self.rows_by_id
+
+# A copy of the engine with the given documents inserted or replaced and the
+# given _ids removed, so readers of this engine are not affected. Costs a copy of
+# the arrays rather than a load of every value. Returns None when a value does
+# not fit its column, e.g. text in a number column, which needs a rebuild.
+    def with_changes(self, documents, removed_ids=()):
+        row_of = self._row_of()
+        updated = [document for document in documents if document['_id'] in row_of]
+        inserted = [document for document in documents if document['_id'] not in row_of]
+        update_rows = np.array([row_of[document['_id']] for document in updated], dtype=np.int64)
+        keep = np.ones(self.size + len(inserted), dtype=bool)
+        keep[[row_of[document_id] for document_id in removed_ids if document_id in row_of]] = False
+
+        engine = copy.copy(self)
+        engine.columns, engine.missing, engine.codes, engine.uniques = {}, {}, {}, {}
+        for field in self.kinds:
+            encoded = engine._encode(field, [document.get(field) for document in updated + inserted], self)
+            if encoded is None:
+                return None
+            for store, values in encoded.items():
+                array = np.concatenate([getattr(self, store)[field], values[len(updated):]])
+                array[update_rows] = values[:len(updated)]
+                getattr(engine, store)[field] = array if keep.all() else array[keep]
+
+        engine.size = int(np.count_nonzero(keep))
+        engine.ranks = {}
+        # Rows keep their place unless some were removed
+        engine.rows_by_id = None
+        if keep.all():
+            engine.rows_by_id = row_of if not inserted else {
+                **row_of, **{document['_id']: self.size + index for index, document in enumerate(inserted)}}
+        engine.sorted = {}
+        engine._sort_fields(self.sorted)
+        return engine
+
+    # New values of a field by the store holding them, None when one does not fit.
+    # New distinct values are added to the engine's own copy of the uniques.
+    def _encode(self, field, values, source):
+        kind = self.kinds[field]
+        if kind == 'codes':
+            uniques = self.uniques[field] = list(source.uniques[field])
+            code_of = {value: code for code, value in enumerate(uniques)}
+            codes = np.full(len(values), -1, dtype=np.int64)
+            for index, value in enumerate(values):
+                if value is None:
+                    continue
+                if not _hashable(value):
+                    return None
+                if value not in code_of:
+                    code_of[value] = len(uniques)
+                    uniques.append(value)
+                codes[index] = code_of[value]
+            return {'codes': codes}
+        if kind == 'object':
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+            return {'columns': column}
+
+        missing = np.array([value is None for value in values], dtype=bool)
+        if kind == 'datetime':
+            column = typed_column(values, 'datetime', self._layout(field))
+            if not pd.api.types.is_datetime64_any_dtype(column.dtype):
+                return None
+            return {'columns': column.to_numpy(dtype='datetime64[ns]').view(np.int64), 'missing': missing}
+        dtype = source.columns[field].dtype
+        for value in values:
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, int if dtype.kind == 'i' else (int, float)):
+                return None
+            if dtype.kind == 'i' and not -2 ** 31 <= value < 2 ** 31:
+                return None
+        return {'columns': np.array([0 if value is None else value for value in values], dtype=dtype),
+                'missing': missing}
+
+# Boolean mask of the rows matching a query, same operators as live_dataset.matches
+    def mask(self, query):
+        result = np.ones(self.size, dtype=bool)
+        for key, condition in query.items():
+            if key == '$and':
+                for part in condition:
+                    result &= self.mask(part)
+            elif key == '$or':
+                result &= self._any(condition)
+            elif key == '$nor':
+                result &= ~self._any(condition)
+            else:
+                result &= self._field_mask(key, condition)
+        return result
+
+    def _any(self, queries):
+        result = np.zeros(self.size, dtype=bool)
+        for part in queries:
+            result |= self.mask(part)
+        return result
+
+    def _field_mask(self, field, condition):
+        if self.kinds.get(field) in ('codes', 'datetime', None):
+            return self._by_value(field, condition)
+        if not (isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)):
+            return self._equal(field, condition)
+
+        result = np.ones(self.size, dtype=bool)
+        for operator, operand in condition.items():
+            if operator == '$eq':
+                result &= self._equal(field, operand)
+            elif operator == '$ne':
+                result &= ~self._equal(field, operand)
+            elif operator == '$in':
+                result &= self._in(field, operand)
+            elif operator == '$nin':
+                result &= ~self._in(field, operand)
+            elif operator == '$exists':
+                present = self._present(field)
+                result &= present if operand else ~present
+            elif operator == '$regex':
+                result &= self._regex(field, operand, condition.get('$options', ''))
+            elif operator == '$options':
+                continue
+            elif operator == '$not':
+                result &= ~self._field_mask(field, operand)
+            elif operator in COMPARISONS:
+                result &= self._compare(field, operator, operand)
+            else:
+                raise ValueError(f"Unsupported query operator: {operator}")
+        return result
+
+# Test the condition once per distinct value and once for a missing value,
+# then look the answer up by each row's code
+    def _by_value(self, field, condition):
+        codes, uniques = self._dictionary(field)
+        table = np.array([matches_field(value, condition) for value in uniques] + [matches_field(None, condition)],
+                         dtype=bool)
+        return table[codes]
+
+    def _column(self, field):
+        return self._values(field)
+
+    def _present(self, field):
+        if self.kinds[field] == 'number':
+            return ~self.missing[field]
+        return ~pd.isna(self.columns[field])
+
+    def _rows_mask(self, rows):
+        result = np.zeros(self.size, dtype=bool)
+        result[rows] = True
+        return result
+
+    def _equal(self, field, value):
+        if self.kinds[field] == 'number':
+            if value is None:
+                return self.missing[field].copy()
+            if isinstance(value, (int, float)):
+                return (self.columns[field] == value) & ~self.missing[field]
+            return np.zeros(self.size, dtype=bool)
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            return self.columns[field] == value
+        return self._each(field, value)
+
+    def _in(self, field, values):
+        if self.kinds[field] == 'number':
+            result = np.zeros(self.size, dtype=bool)
+            for value in values:
+                result |= self._equal(field, value)
+            return result
+        return pd.Series(self.columns[field], dtype=object).isin(list(values)).to_numpy()
+
+    def _regex(self, field, pattern, options):
+        # Like MongoDB, only string values can match, numbers and missing values never do
+        result = np.zeros(self.size, dtype=bool)
+        if self.kinds[field] == 'number':
+            return result
+        flags = re.IGNORECASE if 'i' in options else 0
+        column = self.columns[field]
+        is_string = np.fromiter((isinstance(value, str) for value in column), dtype=bool, count=self.size)
+        if is_string.any():
+            strings = pd.Series(column[is_string], dtype=object)
+            result[is_string] = strings.str.contains(pattern, flags=flags, regex=True).to_numpy(dtype=bool)
+        return result
+
+    def _compare(self, field, operator, operand):
+        if field in self.sorted and isinstance(operand, (int, float)) and not isinstance(operand, bool):
+            numbers, order = self.sorted[field]
+            if operator == '$gt':
+                return self._rows_mask(order[np.searchsorted(numbers, operand, 'right'):])
+            if operator == '$gte':
+                return self._rows_mask(order[np.searchsorted(numbers, operand, 'left'):])
+            if operator == '$lt':
+                return self._rows_mask(order[:np.searchsorted(numbers, operand, 'left')])
+            return self._rows_mask(order[:np.searchsorted(numbers, operand, 'right')])
+        if self.kinds[field] == 'number':
+            if not isinstance(operand, (int, float)):
+                # MongoDB never matches comparisons across types
+                return np.zeros(self.size, dtype=bool)
+            return NUMBER_COMPARISONS[operator](self.columns[field], operand) & ~self.missing[field]
+        return self._each(field, {operator: operand})
+
+    # Row by row fallback for conditions without a vectorized form
+    def _each(self, field, condition):
+        return np.fromiter((matches_field(value, condition) for value in self._column(field)),
+                           dtype=bool, count=self.size)
+
+# Position of each row's value in MongoDB sort order, equal values share a rank
+    def _rank(self, field):
+        ranks = self.ranks.get(field)
+        if ranks is None:
+            keys = self._sort_keys(field)
+            if keys is not None:
+                # One type per column, so ascending values are MongoDB's order
+                present = ~self.missing[field] if field in self.missing else np.ones(self.size, dtype=bool)
+                ranks = np.zeros(self.size, dtype=np.int64)
+                ranks[present] = np.unique(keys[present], return_inverse=True)[1] + 1
+            else:
+                if self.kinds.get(field) == 'codes':
+                    codes, uniques = self._dictionary(field)
+                else:
+                    codes, uniques = pd.factorize(pd.Series(self._column(field), dtype=object))
+                by_value = sorted(range(len(uniques)), key=lambda code: sort_key(uniques[code]))
+                code_ranks = np.empty(len(uniques), dtype=np.int64)
+                code_ranks[by_value] = np.arange(1, len(uniques) + 1)
+                # Missing values sort first like null
+                ranks = np.where(codes < 0, 0, code_ranks[codes] if len(uniques) else 0)
+            self.ranks[field] = ranks
+        return ranks
+
+    # Array sorting like MongoDB, for columns holding one type: numbers, datetimes,
+    # or only ObjectIds (as their bytes) or only strings. None for other columns.
+    def _sort_keys(self, field):
+        kind = self.kinds.get(field)
+        if kind in ('number', 'datetime'):
+            return self.columns[field]
+        if kind != 'object' or not self.size:
+            return None
+        column = self.columns[field]
+        if all(isinstance(value, ObjectId) for value in column):
+            return np.array([value.binary for value in column], dtype='S12')
+        if all(isinstance(value, str) for value in column):
+            return column.astype(str)
+        return None
+
+# Row numbers matching a query in sort order, after skip and limit
+    def find_rows(self, query, sort=None, skip=0, limit=0):
+        rows = np.flatnonzero(self.mask(query or {}))
+        if sort:
+            # lexsort treats its last key as the primary one and is stable like list.sort
+            keys = [self._rank(field)[rows] * (-1 if direction < 0 else 1) for field, direction in reversed(sort)]
+            rows = rows[np.lexsort(keys)]
+        if skip:
+            rows = rows[skip:]
+        if limit:
+            rows = rows[:limit]
+        return rows
+
+# Same signature as AnimalShelter.read_dataframe so callbacks can use either
+    def read_dataframe(self, query, projection=None, columns=None, sort=None, skip=0, limit=0, **options):
+        rows = self.find_rows(query, sort, skip, limit)
+        if columns is None:
+            columns = [field for field in self.fields if not projection or projection.get(field)]
+        return pd.DataFrame({column: self._values(column, rows) for column in columns}, columns=columns)
+
+    def read(self, query, projection=None, **options):
+        return self.read_dataframe(query, projection, **options).to_dict('records')
+
+    def count(self, query, **options):
+        if not query:
+            return self.size
+        return int(np.count_nonzero(self.mask(query)))
+
+# Top values are ordered by count and then value, like AnimalShelter.count_by
+    def count_by(self, field, query=None, top_n=20, **options):
+        selected = self.mask(query) if query else None
+        if self.kinds.get(field) in ('codes', 'datetime'):
+            codes, uniques = self._dictionary(field)
+            codes = codes if selected is None else codes[selected]
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            pairs = [(value, int(count)) for value, count in zip(uniques, counts) if count]
+            missing = int(np.count_nonzero(codes < 0))
+            if missing:
+                pairs.append((None, missing))
+        else:
+            pairs = list(Counter(self._values(field, None if selected is None else np.flatnonzero(selected))).items())
+
+        total = sum(count for _value, count in pairs)
+        pairs.sort(key=lambda pair: (-pair[1], sort_key(pair[0])))
+        return with_other_bucket(pairs[:top_n], total), total
+
+
+class LiveFrameEngine(object):
+    """ FrameQueryEngine over a LiveDataset's typed frame, kept current by applying the changed rows """
+
+    def __init__(self, live_dataset, **options):
+        self.live_dataset = live_dataset
+        self.options = options
+        self.built = (None, None)  # (version, engine), replaced as one pair
+        self.build_lock = threading.Lock()
+        self._builder = None
+
+    @property
+    def ready(self):
+        return self.live_dataset.ready
+
+    @property
+    def engine(self):
+        return self.built[1]
+
+# The engine for the current rows. Only the first call waits for a build.
+# After a change the rows changed since are applied to a copy of the engine,
+# which replaces it. When there are too many of them, or a value does not fit
+# its column, one background thread rebuilds the engine while callers keep
+# using the previous one, which is swapped out once the new one is complete.
+    def current(self):
+        version, engine = self.built
+        if engine is None:
+            with self.build_lock:
+                self._build()
+            return self.engine
+        if version != self.live_dataset.version and self.build_lock.acquire(blocking=False):
+            applied = False
+            try:
+                applied = self._apply_changes()
+            finally:
+                if applied:
+                    self.build_lock.release()
+                else:
+                    self._builder = threading.Thread(target=self._build_in_background, daemon=True)
+                    self._builder.start()
+        return self.engine
+
+    def _apply_changes(self):
+        version, engine = self.built
+        limit = max(DELTA_MIN_ROWS, int(engine.size * DELTA_SHARE))
+        new_version, documents, removed_ids = self.live_dataset.changes_since(version, limit)
+        if documents is None:
+            return False
+        if documents or removed_ids:
+            engine = engine.with_changes(documents, removed_ids)
+            if engine is None:
+                return False
+        self.built = (new_version, engine)
+        return True
+
+    def _build_in_background(self):
+        try:
+            self._build()
+        finally:
+            self.build_lock.release()
+
+    def _build(self):
+        version, frame = self.live_dataset.versioned_frame(self.built[0])
+        if frame is not None:
+            self.built = (version, FrameQueryEngine(frame, self.live_dataset.fields, **self.options))
+
+    def read_dataframe(self, query, projection=None, columns=None, **options):
+        return self.current().read_dataframe(query, projection, columns, **options)
+
+    def read(self, query, projection=None, **options):
+        return self.current().read(query, projection, **options)
+
+    def count(self, query, **options):
+        return self.current().count(query, **options)
+
+    def count_by(self, field, query=None, top_n=20, **options):
+        return self.current().count_by(field, query, top_n, **options)
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
@@ -0,0 +1,42 @@
+# Production server settings for the dashboard
+#
+#   gunicorn -c gunicorn.conf.py dashboard:server
+#
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 8050)}"
+
+# One worker process per core, each with a few threads for concurrent callbacks
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 4))
+timeout = int(os.getenv('WEB_TIMEOUT', 60))
+
+# The app is imported in each worker after the fork, so every worker opens its
+# own MongoDB connection pool (pymongo clients are not fork-safe)
+preload_app = False
+
+# Workers share query results and figures through the cache directory instead
+# of each holding its own copy of the collection
+os.environ.setdefault('CACHE_BACKEND', 'file')
+os.environ.setdefault('LIVE_DATASET', '0')
+
+# Rebuilding the rescue views in every worker would repeat the same $out
+# aggregations once per process. Run a single `python rescue_views.py` refresher
+# next to the server and set RESCUE_VIEWS=read to have the workers read them.
+os.environ.setdefault('RESCUE_VIEWS', '0')
+
+# Each worker keeps its own metrics. They write them to METRICS_DIR, and
+# whichever worker answers /metrics reports the sum over all of them.
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"dashboard_metrics_{os.getenv('PORT', 8050)}"))
+
+# Counters start from zero with the server, not with the files of a previous run
+def on_starting(server):
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+
+accesslog = '-'
+errorlog = '-'
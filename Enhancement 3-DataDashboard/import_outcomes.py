@@ -0,0 +1,89 @@
+# Streaming import of an AAC outcomes export (CSV, JSON or JSON lines) into MongoDB
+#
+#   python import_outcomes.py aac_shelter_outcomes.csv --upsert
+#
+import argparse
+import csv
+import json
+import os
+import time
+
+from crud_module import AnimalShelter
+
+# Numeric fields in the AAC export, everything else is kept as text
+NUMERIC_FIELDS = {
+    'rec_num': int,
+    'location_lat': float,
+    'location_long': float,
+    'age_upon_outcome_in_weeks': float,
+}
+
+# Convert the numeric fields of a CSV row, leaving blanks and bad values as they are
+def convert_row(row):
+    document = {key: value for key, value in row.items() if key}
+    for field, convert in NUMERIC_FIELDS.items():
+        value = document.get(field)
+        if value not in (None, ''):
+            try:
+                document[field] = convert(value)
+            except ValueError:
+                try:
+                    document[field] = convert(float(value))
+                except ValueError:
+                    pass
+    return document
+
+# Input format for an export's file extension
+FORMAT_BY_EXTENSION = {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+def guess_format(path):
+    return FORMAT_BY_EXTENSION.get(os.path.splitext(path)[1].lower(), 'csv')
+
+# Yield documents one at a time. CSV and JSON lines are streamed so the file
+# is never fully loaded, a JSON export is a single array and is parsed whole.
+def read_documents(path, file_format=None):
+    file_format = file_format or guess_format(path)
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        if file_format == 'csv':
+            for row in csv.DictReader(source):
+                yield convert_row(row)
+        elif file_format == 'json':
+            documents = json.load(source)
+            if not isinstance(documents, list):
+                raise ValueError(f"{path}: expected a JSON array of outcomes")
+            yield from documents
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Import AAC outcomes into MongoDB in bulk.')
+    parser.add_argument('path', help='CSV, JSON or JSON lines export to import')
+    parser.add_argument('--format', choices=['csv', 'json', 'jsonl'], help='input format, guessed from the extension by default')
+    parser.add_argument('--batch-size', type=int, default=1000, help='documents per bulk write')
+    parser.add_argument('--upsert', action='store_true', help='replace existing outcomes matched on animal_id and rec_num')
+    parser.add_argument('--user', default=os.getenv('AAC_USER', 'aacuser'))
+    parser.add_argument('--password', default=os.getenv('AAC_PASSWORD'))
+    args = parser.parse_args()
+
+    db = AnimalShelter(args.user, args.password)
+    documents = read_documents(args.path, args.format)
+
+    start = time.perf_counter()
+    if args.upsert:
+        results = db.upsert_many(documents, batch_size=args.batch_size)
+    else:
+        results = db.create_many(documents, batch_size=args.batch_size)
+    # Outcomes imported before location points existed still need one for the map
+    db.ensure_geo_points()
+    elapsed = time.perf_counter() - start
+
+    for number, result in enumerate(results, 1):
+        print(f"Batch {number}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+
+    totals = {key: sum(result[key] for result in results) for key in (results[0] if results else {})}
+    print(f"\nImported {len(results)} batch(es) in {elapsed:.2f}s: " + ", ".join(f"{key}={value}" for key, value in totals.items()))
+
+if __name__ == '__main__':
+    main()
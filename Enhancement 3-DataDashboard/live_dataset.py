@@ -0,0 +1,583 @@
+from bisect import bisect_right
+from collections import Counter
+import os
+import re
+import threading
+import time
+
+from bson import ObjectId, json_util
+import numpy as np
+import pandas as pd
+from pymongo.errors import PyMongoError
+
+from crud_module import (column_values, concat_frames, frame_records, schema_for, typed_frame, typed_value,
+                         with_other_bucket)
+
+# Errors of a snapshot that cannot be written or read. Parquet needs pyarrow,
+# which also rejects columns mixing types, e.g. rec_num stored as text and number.
+try:
+    from pyarrow import ArrowException
+    SNAPSHOT_ERRORS = (ImportError, OSError, ValueError, TypeError, ArrowException)
+except ImportError:
+    SNAPSHOT_ERRORS = (ImportError, OSError, ValueError, TypeError)
+
+# Attempts at a full load before giving up, with the delay doubling after each failure
+RELOAD_ATTEMPTS = 3
+RELOAD_RETRY_DELAY = 1.0
+
+# Documents per batch of a full load, each batch is converted to typed columns
+LOAD_BATCH_SIZE = 5000
+
+# Seconds between full comparisons with MongoDB while polling. They catch the
+# updates and deletes made by other processes, which the watermark cannot see.
+RECONCILE_INTERVAL = 300
+
+# _ids refetched per query when rows written through the shelter are refreshed
+REFETCH_BATCH_SIZE = 1000
+
+# Changes kept beside the typed frame before they are folded into a new one:
+# at least COMPACT_MIN_CHANGES, or this share of the rows when that is more
+COMPACT_MIN_CHANGES = 5000
+COMPACT_SHARE = 0.05
+
+# Entries kept in the change log read by changes_since. Readers further behind rebuild.
+CHANGE_LOG_LIMIT = 100000
+
+class LiveDataset(object):
+    """ In-memory copy of the animals collection kept current from the change feed """
+
+    def __init__(self, shelter, fields, poll_interval=30, snapshot_path=None, reconcile_interval=RECONCILE_INTERVAL):
+        self.shelter = shelter
+        self.fields = list(fields)
+        self.projection = {field: 1 for field in self.fields}
+        self.schema = schema_for(self.fields)
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.snapshot_path = snapshot_path
+
+        # The rows are a typed frame (see crud_module.AAC_SCHEMA) plus the documents
+        # changed since it was built, which are folded in when an engine is built
+        self.frame = typed_frame([], {'_id': 'object', **self.schema})
+        self.positions = {}     # _id -> row of frame
+        self.changes = {}       # _id -> document changed since, None once deleted
+        self.size = 0           # Rows once the changes are applied
+        # Version and _id of every change since log_start, for readers applying deltas
+        self.log_versions = []
+        self.log_ids = []
+        self.log_start = 0
+        self.lock = threading.Lock()
+        self.version = 0        # Incremented on every applied change
+        self.watermark = None   # Highest rec_num seen, used when polling
+        self.mode = None        # 'change_stream' or 'polling' once started
+        self.resume_token = None  # Change stream position the rows are current to
+        self.ready = threading.Event()  # Set once rows are loaded and can be queried
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # Cuts a polling wait short
+        self._pending_ids = set()       # Written through the shelter, refetched on the next poll
+        self._reconcile_due = False     # A write through the shelter did not report its _ids
+        self._thread = None
+
+# Load the collection once and start following changes. With background=True
+# the caller returns immediately and ready is set once the rows are usable.
+    def start(self, background=False):
+        self.shelter.write_listeners.append(self.refresh_ids)
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        else:
+            follow = self._load()
+            self._thread = threading.Thread(target=follow, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            follow = self._load()
+        except PyMongoError as e:
+            # ready stays unset, so callers keep querying MongoDB directly
+            print(f"Live dataset not loaded: {e}")
+            return
+        follow()
+
+# Load rows from the snapshot when it is still valid, otherwise from MongoDB.
+# Returns the function that keeps the rows current afterwards. Raises
+# PyMongoError when MongoDB cannot be read completely, ready is then not set.
+    def _load(self):
+        from_snapshot = self.snapshot_path is not None and self.load_snapshot()
+        resumable = from_snapshot and self.resume_token is not None
+
+        # Open the stream before any bulk load so no change is missed in between.
+        # Replaying a change that is already loaded is harmless.
+        stream = self._open_stream(self.resume_token if resumable else None)
+        if stream is None and resumable:
+            # The snapshot is older than the oldest change the server keeps
+            stream = self._open_stream(None)
+            from_snapshot = False
+        elif stream is not None and not resumable:
+            from_snapshot = False
+
+        if stream is None:
+            self.mode = 'polling'
+            if from_snapshot and not self._snapshot_is_current():
+                from_snapshot = False
+        else:
+            self.mode = 'change_stream'
+
+        if not from_snapshot:
+            self.reload()
+        # The rows are usable whether or not they can be saved
+        self.ready.set()
+        if not from_snapshot and self.snapshot_path is not None:
+            self.save_snapshot()
+
+        if stream is not None:
+            return lambda: self._follow_stream(stream)
+        return self._poll
+
+    # Any failure falls back to polling, not only server errors. A standalone
+    # server refuses change streams, and some drivers and test doubles raise
+    # other errors, e.g. mongomock's TypeError.
+    def _open_stream(self, resume_token):
+        try:
+            stream = self.shelter.collection.watch(full_document='updateLookup', resume_after=resume_token)
+            self.resume_token = stream.resume_token
+            return stream
+        except Exception as e:
+            print(f"Change stream unavailable: {e}")
+            return None
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+# Replace the in-memory rows with a fresh bulk load. A load that fails part way
+# is retried from the start, and the rows are only replaced by a complete one.
+    def reload(self):
+        for attempt in range(RELOAD_ATTEMPTS):
+            try:
+                frame = self._read_all()
+                break
+            except PyMongoError as e:
+                if attempt + 1 == RELOAD_ATTEMPTS:
+                    raise
+                print(f"Error loading rows, retrying: {e}")
+                time.sleep(RELOAD_RETRY_DELAY * 2 ** attempt)
+
+        with self.lock:
+            self._set_frame(frame)
+            self.watermark = _frame_watermark(frame)
+            self.version += 1
+            self._clear_log()
+
+    def _read_all(self):
+        return self.shelter.read_typed_dataframe({}, self.schema, batch_size=LOAD_BATCH_SIZE, include_id=True,
+                                                 raise_errors=True)
+
+    def _set_frame(self, frame):
+        self.frame = frame
+        self.positions = {document_id: row for row, document_id in enumerate(frame['_id'])}
+        self.changes = {}
+        self.size = len(frame)
+
+# Called with the lock held after the rows were replaced as a whole
+    def _clear_log(self):
+        self.log_versions, self.log_ids = [], []
+        self.log_start = self.version
+
+# The current rows by _id. Built from the frame on every call, so meant for tests and tools.
+    @property
+    def rows(self):
+        return {document['_id']: document for document in self.snapshot()}
+
+    def _follow_stream(self, stream):
+        with stream:
+            while not self._stop.is_set():
+                try:
+                    change = stream.try_next()
+                    self.resume_token = stream.resume_token
+                    if change is not None:
+                        self.apply_change(change)
+                except PyMongoError as e:
+                    print(f"Change stream failed, polling instead: {e}")
+                    self.mode = 'polling'
+                    self._poll()
+                    return
+
+# Apply one change stream event to the in-memory rows
+    def apply_change(self, change):
+        operation = change['operationType']
+        if operation in ('insert', 'update', 'replace'):
+            document = change.get('fullDocument')
+            if document is None:
+                # The document was deleted before the update could be looked up
+                self._remove(change['documentKey']['_id'])
+            else:
+                self._upsert({field: document.get(field) for field in ['_id'] + self.fields if field in document})
+        elif operation == 'delete':
+            self._remove(change['documentKey']['_id'])
+        elif operation in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+            self.reload()
+
+    def _upsert(self, document):
+        self._apply([self._normalize(document)])
+
+    def _remove(self, document_id):
+        self._apply([], [document_id])
+
+# A document as the typed frame gives it back, every field present
+    def _normalize(self, document):
+        return {'_id': document['_id'],
+                **{field: typed_value(document.get(field), dtype) for field, dtype in self.schema.items()}}
+
+# Record changed documents and removed _ids. Documents equal to the current row
+# and _ids already gone are skipped, so the version only moves on real changes.
+    def _apply(self, documents, removed_ids=()):
+        with self.lock:
+            current = self._lookup([document['_id'] for document in documents] + list(removed_ids))
+            for document in documents:
+                document_id = document['_id']
+                if current.get(document_id) == document:
+                    continue
+                if document_id not in current:
+                    self.size += 1
+                self.changes[document_id] = current[document_id] = document
+                self.watermark = _max_rec_num(self.watermark, document.get('rec_num'))
+                self._log(document_id)
+            for document_id in removed_ids:
+                if current.pop(document_id, None) is None:
+                    continue
+                if document_id in self.positions:
+                    self.changes[document_id] = None
+                else:
+                    del self.changes[document_id]
+                self.size -= 1
+                self._log(document_id)
+            if len(self.changes) > max(COMPACT_MIN_CHANGES, self.size * COMPACT_SHARE):
+                self._compact()
+
+# Count one change. Called with the lock held.
+    def _log(self, document_id):
+        self.version += 1
+        self.log_versions.append(self.version)
+        self.log_ids.append(document_id)
+        if len(self.log_ids) > CHANGE_LOG_LIMIT:
+            drop = len(self.log_ids) // 2
+            self.log_start = self.log_versions[drop - 1]
+            del self.log_versions[:drop], self.log_ids[:drop]
+
+# Current documents of the given _ids, missing ones left out. Called with the lock held.
+    def _lookup(self, ids):
+        found, rows = {}, []
+        for document_id in ids:
+            if document_id in self.changes:
+                if self.changes[document_id] is not None:
+                    found[document_id] = self.changes[document_id]
+            elif document_id in self.positions:
+                rows.append(self.positions[document_id])
+        if rows:
+            found.update((document['_id'], document) for document in frame_records(self.frame.take(rows)))
+        return found
+
+# _ids of the current rows. Called with the lock held.
+    def _current_ids(self):
+        ids = [document_id for document_id in self.positions if self.changes.get(document_id, True) is not None]
+        return ids + [document_id for document_id, document in self.changes.items()
+                      if document is not None and document_id not in self.positions]
+
+# Fold the changes into a new frame. Updated rows move to the end. Called with the lock held.
+    def _compact(self):
+        if not self.changes:
+            return
+        keep = np.ones(len(self.frame), dtype=bool)
+        keep[[self.positions[document_id] for document_id in self.changes if document_id in self.positions]] = False
+        changed = typed_frame([document for document in self.changes.values() if document is not None],
+                              {'_id': 'object', **self.schema})
+        self._set_frame(concat_frames([self.frame[keep], changed]))
+
+# Write listener. While polling, rows written through the shelter are
+# refetched right away instead of waiting for the next reconciliation. A write
+# that does not report its _ids brings the reconciliation forward.
+    def refresh_ids(self, ids):
+        if self.mode != 'polling':
+            return
+        with self.lock:
+            if ids is None:
+                self._reconcile_due = True
+            else:
+                self._pending_ids.update(ids)
+        self._wake.set()
+
+# Fallback for servers without change streams. Rows written through the shelter
+# are refetched as soon as the write is reported, new rows are found by the
+# rec_num watermark every poll_interval, and every reconcile_interval all rows
+# are compared with MongoDB for the updates and deletes of other processes.
+    def _poll(self):
+        now = time.monotonic()
+        next_poll, next_reconcile = now + self.poll_interval, now + self.reconcile_interval
+        while True:
+            self._wake.wait(max(0.0, min(next_poll, next_reconcile) - time.monotonic()))
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                if self._refetch_pending():
+                    next_reconcile = time.monotonic() + self.reconcile_interval
+                now = time.monotonic()
+                if now >= next_reconcile:
+                    self.reconcile()
+                    next_poll, next_reconcile = now + self.poll_interval, now + self.reconcile_interval
+                elif now >= next_poll:
+                    self.poll_once()
+                    next_poll = now + self.poll_interval
+            except PyMongoError as e:
+                print(f"Error polling for changes: {e}")
+                retry = time.monotonic() + self.poll_interval
+                next_poll, next_reconcile = max(next_poll, retry), max(next_reconcile, retry)
+
+# Rows newer than the watermark, and deletes found by reconciling ids when the counts differ
+    def poll_once(self):
+        query = {'rec_num': {'$gt': self.watermark}} if self.watermark is not None else {}
+        self._apply([self._normalize(document) for document in
+                     self.shelter.read_iter(query, self.projection, sort=[('rec_num', 1)], raise_errors=True)])
+
+        if self.shelter.collection.estimated_document_count() != self.size:
+            # A partial id list would remove live rows, so the read must fail instead
+            live_ids = {document['_id'] for document in self.shelter.read_iter({}, {'_id': 1}, raise_errors=True)}
+            with self.lock:
+                stale_ids = [document_id for document_id in self._current_ids() if document_id not in live_ids]
+            self._apply([], stale_ids)
+
+# Compare every row with MongoDB and apply only the differences, so the version
+# only changes when something did. The rows are untouched if the read fails.
+    def reconcile(self):
+        documents = frame_records(self._read_all())
+        live_ids = {document['_id'] for document in documents}
+        with self.lock:
+            stale_ids = [document_id for document_id in self._current_ids() if document_id not in live_ids]
+        self._apply(documents, stale_ids)
+
+# Refetch what was written through the shelter since the last poll. Returns
+# whether that was a full reconciliation. Failed refetches are kept for the next poll.
+    def _refetch_pending(self):
+        with self.lock:
+            ids, self._pending_ids = self._pending_ids, set()
+            reconcile, self._reconcile_due = self._reconcile_due, False
+        try:
+            if reconcile:
+                self.reconcile()
+            elif ids:
+                self.refetch(ids)
+        except PyMongoError:
+            with self.lock:
+                self._pending_ids |= ids
+                self._reconcile_due |= reconcile
+            raise
+        return reconcile
+
+# Bring the given rows up to date, removing those no longer in MongoDB
+    def refetch(self, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), REFETCH_BATCH_SIZE):
+            chunk = ids[start:start + REFETCH_BATCH_SIZE]
+            found = [self._normalize(document) for document in
+                     self.shelter.read_iter({'_id': {'$in': chunk}}, self.projection, raise_errors=True)]
+            found_ids = {document['_id'] for document in found}
+            self._apply(found, [document_id for document_id in chunk if document_id not in found_ids])
+
+# Write the typed rows to a Parquet file with a JSON marker describing how current they are
+    def save_snapshot(self):
+        with self.lock:
+            self._compact()
+            frame = self.frame
+            marker = {'fields': self.fields, 'schema': self.schema, 'count': len(frame), 'watermark': self.watermark,
+                      'resume_token': self.resume_token}
+        try:
+            # The frame is replaced rather than modified, so it can be written outside the lock
+            frame = frame.assign(_id=frame['_id'].astype(str))
+            frame.to_parquet(self.snapshot_path + '.tmp', index=False)
+            with open(self.snapshot_path + '.json.tmp', 'w') as marker_file:
+                marker_file.write(json_util.dumps(marker))
+            os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+            os.replace(self.snapshot_path + '.json.tmp', self.snapshot_path + '.json')
+            return True
+        except SNAPSHOT_ERRORS as e:
+            print(f"Error saving snapshot: {e}")
+            return False
+
+# Load rows from the snapshot, returns False when it is missing or for other fields or types
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path + '.json') as marker_file:
+                marker = json_util.loads(marker_file.read())
+            if marker.get('fields') != self.fields or marker.get('schema') != self.schema:
+                return False
+            frame = pd.read_parquet(self.snapshot_path)
+        except SNAPSHOT_ERRORS as e:
+            print(f"Snapshot not used: {e}")
+            return False
+
+        frame['_id'] = pd.Series([ObjectId(document_id) if len(document_id) == 24 and ObjectId.is_valid(document_id)
+                                  else document_id for document_id in frame['_id']], dtype=object)
+        with self.lock:
+            self._set_frame(frame)
+            self.watermark = marker.get('watermark')
+            self.resume_token = marker.get('resume_token')
+            self.version += 1
+            self._clear_log()
+        return True
+
+# Without a change stream a snapshot is only trusted while the collection still
+# reaches its rec_num watermark; polling then fetches anything newer.
+    def _snapshot_is_current(self):
+        if self.watermark is None:
+            return False
+        try:
+            newest = self.shelter.collection.find_one({}, {'rec_num': 1}, sort=[('rec_num', -1)])
+        except PyMongoError as e:
+            print(f"Error checking snapshot: {e}")
+            return False
+        rec_num = newest.get('rec_num') if newest else None
+        return isinstance(rec_num, (int, float)) and rec_num >= self.watermark
+
+# Snapshot of the current rows as documents that later changes will not modify
+    def snapshot(self):
+        with self.lock:
+            frame, positions, changes = self.frame, self.positions, dict(self.changes)
+        documents = []
+        for document in frame_records(frame):
+            document = changes.get(document['_id'], document)
+            if document is not None:
+                documents.append(document)
+        return documents + [document for document_id, document in changes.items()
+                            if document is not None and document_id not in positions]
+
+# Current version with the documents changed since known_version and the _ids
+# removed since. The documents and _ids are None when the log does not reach
+# back that far, or when more than limit rows changed.
+    def changes_since(self, known_version, limit=None):
+        with self.lock:
+            if known_version is None or known_version < self.log_start:
+                return self.version, None, None
+            ids = list(dict.fromkeys(self.log_ids[bisect_right(self.log_versions, known_version):]))
+            if limit is not None and len(ids) > limit:
+                return self.version, None, None
+            found = self._lookup(ids)
+            return (self.version, [found[document_id] for document_id in ids if document_id in found],
+                    [document_id for document_id in ids if document_id not in found])
+
+# Current version with the typed frame of the rows, or None for the frame when
+# they are still at known_version
+    def versioned_frame(self, known_version=None):
+        with self.lock:
+            if self.version == known_version:
+                return self.version, None
+            self._compact()
+            return self.version, self.frame
+
+# Same signature as AnimalShelter.read_dataframe so callbacks can use either
+    def read_dataframe(self, query, projection=None, columns=None, sort=None, skip=0, limit=0, **options):
+        documents = [document for document in self.snapshot() if matches(document, query)]
+        if sort:
+            # Stable sorts applied from the last key to the first give a multi-key sort
+            for field, direction in reversed(sort):
+                documents.sort(key=lambda document: sort_key(document.get(field)), reverse=direction < 0)
+        if skip:
+            documents = documents[skip:]
+        if limit:
+            documents = documents[:limit]
+
+        if columns is None:
+            columns = [field for field in self.fields if not projection or projection.get(field)]
+        return pd.DataFrame.from_records(documents, columns=columns)
+
+    def read(self, query, projection=None, **options):
+        return self.read_dataframe(query, projection, **options).to_dict('records')
+
+    def count(self, query, **options):
+        if not query:
+            return self.size
+        return sum(1 for document in self.snapshot() if matches(document, query))
+
+    def count_by(self, field, query=None, top_n=20, **options):
+        counts = Counter(document.get(field) for document in self.snapshot() if matches(document, query or {}))
+        total = sum(counts.values())
+        return with_other_bucket(counts.most_common(top_n), total), total
+
+# Evaluate the subset of the MongoDB query language used by the dashboard
+def matches(document, query):
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(document, part) for part in condition):
+                return False
+        elif not matches_field(document.get(key), condition):
+            return False
+    return True
+
+# Whether a single value satisfies a field condition such as {'$gt': 5}
+def matches_field(value, condition):
+    if not (isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)):
+        return value == condition
+
+    for operator, operand in condition.items():
+        if operator == '$eq':
+            result = value == operand
+        elif operator == '$ne':
+            result = value != operand
+        elif operator == '$in':
+            result = value in operand
+        elif operator == '$nin':
+            result = value not in operand
+        elif operator == '$exists':
+            result = (value is not None) == bool(operand)
+        elif operator == '$regex':
+            flags = re.IGNORECASE if 'i' in condition.get('$options', '') else 0
+            result = isinstance(value, str) and re.search(operand, value, flags) is not None
+        elif operator == '$options':
+            continue
+        elif operator == '$not':
+            result = not matches_field(value, operand)
+        elif operator in COMPARISONS:
+            try:
+                result = value is not None and COMPARISONS[operator](value, operand)
+            except TypeError:
+                # MongoDB never matches comparisons across types
+                result = False
+        else:
+            raise ValueError(f"Unsupported query operator: {operator}")
+        if not result:
+            return False
+    return True
+
+COMPARISONS = {
+    '$gt': lambda value, operand: value > operand,
+    '$gte': lambda value, operand: value >= operand,
+    '$lt': lambda value, operand: value < operand,
+    '$lte': lambda value, operand: value <= operand,
+}
+
+# Order values like MongoDB does across types: null, numbers, strings, others
+def sort_key(value):
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, str(value))
+
+def _frame_watermark(frame):
+    watermark = None
+    for value in column_values(frame['rec_num']) if 'rec_num' in frame else []:
+        watermark = _max_rec_num(watermark, value)
+    return watermark
+
+def _max_rec_num(current, value):
+    if not isinstance(value, (int, float)):
+        return current
+    return value if current is None or value > current else current
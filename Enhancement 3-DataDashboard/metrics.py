@@ -0,0 +1,277 @@
+# Prometheus-style metrics for the dashboard callbacks and MongoDB commands.
+# Values are kept per process. With several gunicorn workers set METRICS_DIR,
+# then every worker writes its values there and /metrics reports their sum.
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import glob
+import json
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+TIME_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_BUCKETS = [1000, 10000, 100000, 1000000, 10000000]
+COUNT_BUCKETS = [1, 10, 100, 1000, 10000, 100000]
+
+# Callbacks slower than this many seconds are logged with their MongoDB commands, 0 disables
+SLOW_CALLBACK_SECONDS = float(os.getenv('SLOW_CALLBACK_SECONDS', 1.0))
+
+# Directory shared by the worker processes of one server, empty to report this
+# process only. Files of exited workers are kept, so the summed counters never
+# go backwards; the directory is cleared when the server starts.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+
+# Seconds between writes of this process's values to METRICS_DIR. A scrape
+# sees the other workers' values as of their last write.
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
+
+class Counter(object):
+    """ Monotonic counter with labels """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, '') for label in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def state(self):
+        with self.lock:
+            return dict(self.values)
+
+    @staticmethod
+    def merge(values, key, value):
+        values[key] = values.get(key, 0) + value
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted((values if values is not None else self.state()).items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(object):
+    """ Cumulative bucket histogram with labels """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = list(buckets)
+        self.values = {}  # label values -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labelnames)
+        with self.lock:
+            series = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def state(self):
+        with self.lock:
+            return {key: [list(bucket_counts), total, count] for key, (bucket_counts, total, count) in self.values.items()}
+
+    @staticmethod
+    def merge(values, key, value):
+        bucket_counts, total, count = value
+        series = values.setdefault(key, [[0] * len(bucket_counts), 0.0, 0])
+        series[0] = [mine + theirs for mine, theirs in zip(series[0], bucket_counts)]
+        series[1] += total
+        series[2] += count
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ('le',)
+        for key, (bucket_counts, total, count) in sorted((values if values is not None else self.state()).items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{_labels(names, key + (repr(float(bound)),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry(object):
+    """ Collection of metrics rendered together on /metrics, summed over the processes sharing its directory """
+
+    def __init__(self, directory=None, pid=None):
+        self.metrics = []
+        self.directory = directory
+        self.pid = pid or os.getpid()
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        if not self.directory:
+            return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+        self.flush()
+        values = self.combined()
+        return '\n'.join(line for metric in self.metrics for line in metric.render(values[metric.name])) + '\n'
+
+# Write this process's values to its file in the directory, replacing the previous ones
+    def flush(self):
+        state = {metric.name: [[list(key), value] for key, value in metric.state().items()] for metric in self.metrics}
+        path = os.path.join(self.directory, f'metrics_{self.pid}.json')
+        try:
+            with open(path + '.tmp', 'w') as metrics_file:
+                json.dump(state, metrics_file)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+# Values of every process that wrote to the directory, summed per metric and labels
+    def combined(self):
+        values = {metric.name: {} for metric in self.metrics}
+        by_name = {metric.name: metric for metric in self.metrics}
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                with open(path) as metrics_file:
+                    state = json.load(metrics_file)
+            except (OSError, ValueError) as e:
+                print(f"Error reading metrics {path}: {e}")
+                continue
+            for name, series in state.items():
+                if name in by_name:
+                    for key, value in series:
+                        by_name[name].merge(values[name], tuple(key), value)
+        return values
+
+    def _flush_periodically(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+# Keep this process's file current, and write it a last time on exit
+    def start_flushing(self, interval=METRICS_FLUSH_SECONDS):
+        os.makedirs(self.directory, exist_ok=True)
+        atexit.register(self.flush)
+        threading.Thread(target=self._flush_periodically, args=(interval,), daemon=True).start()
+
+
+REGISTRY = MetricsRegistry(METRICS_DIR or None)
+
+CALLBACK_SECONDS = REGISTRY.histogram('dashboard_callback_seconds', 'Time spent in each Dash callback.', ['callback'])
+CALLBACK_ERRORS = REGISTRY.counter('dashboard_callback_errors_total', 'Callbacks that raised an exception.', ['callback'])
+CALLBACK_PAYLOAD_BYTES = REGISTRY.histogram('dashboard_callback_payload_bytes', 'Serialized size of each callback response.',
+                                            ['callback'], SIZE_BUCKETS)
+CALLBACK_RESULT_ITEMS = REGISTRY.histogram('dashboard_callback_result_items', 'Rows or components returned by each callback.',
+                                           ['callback'], COUNT_BUCKETS)
+MONGO_COMMAND_SECONDS = REGISTRY.histogram('mongo_command_seconds', 'Time spent in each MongoDB command.', ['command'])
+MONGO_COMMAND_FAILURES = REGISTRY.counter('mongo_command_failures_total', 'MongoDB commands that failed.', ['command'])
+MONGO_COMMAND_DOCUMENTS = REGISTRY.histogram('mongo_command_documents', 'Documents returned per MongoDB command batch.',
+                                             ['command'], COUNT_BUCKETS)
+
+# MongoDB commands issued for the callback being served. A context variable
+# rather than a thread-local, so tasks the callback hands to ContextThreadPoolExecutor
+# threads are captured too.
+_commands = contextvars.ContextVar('mongo_commands', default=None)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ ThreadPoolExecutor running each task in a copy of the submitting thread's context """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """ pymongo command listener feeding the mongo_command_* metrics """
+
+    def started(self, event):
+        commands = _commands.get()
+        if commands is not None:
+            commands.append(_summarize(event.command_name, event.command))
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        cursor = event.reply.get('cursor') if hasattr(event.reply, 'get') else None
+        if cursor:
+            batch = cursor.get('firstBatch', cursor.get('nextBatch', []))
+            MONGO_COMMAND_DOCUMENTS.observe(len(batch), command=event.command_name)
+
+    def failed(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_COMMAND_FAILURES.inc(command=event.command_name)
+
+COMMAND_METRICS = CommandMetrics()
+
+if REGISTRY.directory:
+    REGISTRY.start_flushing()
+
+# Wrap a Dash callback to record its time, response size and slow calls
+def instrumented(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            token = _commands.set([])
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                CALLBACK_ERRORS.inc(callback=name)
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                commands = _commands.get()
+                _commands.reset(token)
+                CALLBACK_SECONDS.observe(duration, callback=name)
+
+            CALLBACK_PAYLOAD_BYTES.observe(payload_size(result), callback=name)
+            CALLBACK_RESULT_ITEMS.observe(result_items(result), callback=name)
+            if SLOW_CALLBACK_SECONDS and duration > SLOW_CALLBACK_SECONDS:
+                print(f"Slow callback {name}: {duration:.3f}s args={args!r} mongo={commands}")
+            return result
+        return wrapper
+    return decorator
+
+# Size of the JSON Dash sends back for a callback result
+def payload_size(result):
+    from plotly.utils import PlotlyJSONEncoder
+    try:
+        return len(json.dumps(result, cls=PlotlyJSONEncoder))
+    except (TypeError, ValueError):
+        return 0
+
+# Rows for table data, components for layout children
+def result_items(result):
+    first = result[0] if isinstance(result, tuple) and result else result
+    return len(first) if isinstance(first, list) else 0
+
+def render():
+    return REGISTRY.render()
+
+def _summarize(command_name, command):
+    detail = command.get('filter', command.get('query', command.get('pipeline', '')))
+    summary = f"{command_name} {detail}"
+    return summary if len(summary) <= 500 else summary[:500] + '...'
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
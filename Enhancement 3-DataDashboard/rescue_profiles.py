@@ -0,0 +1,187 @@
+import re
+import threading
+
+# Rescue profiles used by the dashboard filters. Adding a new profile only
+# requires an entry here and a matching radio button value.
+#   breeds    - breed names matched anywhere in the breed field
+#   sex       - exact sex_upon_outcome value
+#   min_weeks - lower (exclusive) bound on age_upon_outcome_in_weeks
+#   max_weeks - upper (exclusive) bound on age_upon_outcome_in_weeks
+RESCUE_PROFILES = {
+    'Water': {
+        'breeds': ['Labrador Retriever Mix', 'Chesapeake Bay Retriever', 'Newfoundland'],
+        'sex': 'Intact Female',
+        'min_weeks': 26,
+        'max_weeks': 156,
+    },
+    'Mountain': {
+        'breeds': ['German Shepherd', 'Alaskan Malamute', 'Old English Sheepdog', 'Siberian Husky', 'Rottweiler'],
+        'sex': 'Intact Male',
+        'min_weeks': 26,
+        'max_weeks': 156,
+    },
+    'Disaster': {
+        'breeds': ['Doberman Pinscher', 'German Shepherd', 'Golden Retriever', 'Bloodhound', 'Rottweiler'],
+        'sex': 'Intact Male',
+        'min_weeks': 20,
+        'max_weeks': 300,
+    },
+    'Service': {
+        'breeds': ['Labrador Retriever', 'Golden Retriever', 'German Shepherd'],
+        'min_weeks': 52,
+        'max_weeks': 520,
+    },
+    'Cats': {'animal_type': 'Cat'},
+    'Dogs': {'animal_type': 'Dog'},
+}
+
+
+class CompiledProfile(object):
+    """ A rescue profile compiled into a MongoDB query and optional index hint """
+
+    def __init__(self, name, query, hint=None):
+        self.name = name
+        self.query = query
+        self.hint = hint
+
+
+class RescueRegistry(object):
+    """ Compiles the rescue profiles against the current breed list and keeps them current """
+
+    def __init__(self, shelter, profiles=None, refresh=True):
+        self.shelter = shelter
+        self.profiles = profiles if profiles is not None else RESCUE_PROFILES
+
+        # Until refresh() runs the profiles use the breed regex and no hint
+        self.compiled = {name: compile_profile(name, profile) for name, profile in self.profiles.items()}
+        self.breeds = None  # Breeds the profiles were compiled against, None for the regex form
+        self._stop = threading.Event()
+        if refresh:
+            self.refresh()
+
+# Keep the breed lists current. A write through the shelter storing a breed the
+# profiles have not seen recompiles them at once, and a schedule picks up breeds
+# written elsewhere, e.g. by import_outcomes.py or another worker process.
+    def start(self, interval=300):
+        self.shelter.write_listeners.append(self.breeds_written)
+        if interval:
+            threading.Thread(target=self._schedule, args=(interval,), daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _schedule(self, interval):
+        while not self._stop.wait(interval):
+            self.refresh()
+
+# Write listener. Recompiles when the written documents hold a breed missing
+# from the lists, or when the written _ids are not known.
+    def breeds_written(self, ids):
+        if self.breeds is None:
+            # The regex form already matches every breed
+            return
+        if ids is not None:
+            if not ids:
+                return
+            try:
+                written = self.shelter.collection.distinct('breed', {'_id': {'$in': list(ids)}})
+            except Exception as e:
+                print(f"Error reading written breeds: {e}")
+                written = None
+            if written is not None and all(breed in self.breeds for breed in written if isinstance(breed, str)):
+                return
+        self.refresh()
+
+# Recompile every profile, e.g. after new breeds are added to the collection
+    def refresh(self):
+        try:
+            breeds = self.shelter.collection.distinct('breed')
+        except Exception as e:
+            print(f"Error reading breed list: {e}")
+            breeds = None
+
+        try:
+            indexes = self.shelter.collection.index_information()
+        except Exception as e:
+            print(f"Error reading indexes: {e}")
+            indexes = {}
+
+        self.compiled = {name: compile_profile(name, profile, breeds, indexes)
+                         for name, profile in self.profiles.items()}
+        self.breeds = {breed for breed in breeds if isinstance(breed, str)} if breeds is not None else None
+
+# Look up the compiled profile for a filter value, None for unknown values
+    def get(self, name):
+        return self.compiled.get(name)
+
+    def query(self, name):
+        profile = self.get(name)
+        return profile.query if profile else {}
+
+# Check with explain() that a profile is answered from an index
+    def uses_index(self, name):
+        profile = self.get(name)
+        if profile is None:
+            return False
+        report = self.shelter.explain(profile.query, hint=profile.hint)
+        return report is not None and not report['collection_scan']
+
+# Explain every profile so COLLSCAN regressions show up in one report
+    def explain_all(self):
+        return {name: self.shelter.explain(profile.query, hint=profile.hint)
+                for name, profile in self.compiled.items()}
+
+# Log every profile MongoDB would answer by reading the whole collection, e.g.
+# after an index was dropped. Returns their names, profiles that could not be
+# explained are left out.
+    def report_collection_scans(self):
+        scans = []
+        for name, report in self.explain_all().items():
+            if report is not None and report['collection_scan']:
+                print(f"Rescue filter {name} is not using an index, its plan is {', '.join(report['stages'])}")
+                scans.append(name)
+        return scans
+
+# Compile a single profile into the cheapest equivalent query
+def compile_profile(name, profile, breeds=None, indexes=None):
+    conditions = {}
+
+    if 'animal_type' in profile:
+        conditions['animal_type'] = profile['animal_type']
+
+    if profile.get('breeds'):
+        pattern = re.compile('|'.join(re.escape(breed) for breed in profile['breeds']))
+        if breeds is not None:
+            # Resolve the substring match against the known breeds once so the
+            # query becomes an $in that can walk the breed index
+            conditions['breed'] = {'$in': sorted(breed for breed in breeds
+                                                 if isinstance(breed, str) and pattern.search(breed))}
+        else:
+            # Without a breed list keep the original semantics in a single regex
+            conditions['breed'] = {'$regex': pattern.pattern}
+
+    if 'sex' in profile:
+        conditions['sex_upon_outcome'] = profile['sex']
+
+    age_range = {}
+    if 'min_weeks' in profile:
+        age_range['$gt'] = profile['min_weeks']
+    if 'max_weeks' in profile:
+        age_range['$lt'] = profile['max_weeks']
+    if age_range:
+        conditions['age_upon_outcome_in_weeks'] = age_range
+
+    return CompiledProfile(name, conditions, choose_hint(conditions, indexes or {}))
+
+# Pick the existing index whose leading keys cover the most query fields
+def choose_hint(conditions, indexes):
+    best_name, best_length = None, 0
+    for index_name, index in indexes.items():
+        length = 0
+        for field, _direction in index.get('key', []):
+            if field not in conditions:
+                break
+            length += 1
+        if length > best_length:
+            best_name, best_length = index_name, length
+    return best_name
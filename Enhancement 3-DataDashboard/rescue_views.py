@@ -0,0 +1,159 @@
+# Pre-filtered rescue category collections
+#
+#   python rescue_views.py --interval 300
+#
+# keeps the views current for dashboards started with RESCUE_VIEWS=read, so a
+# multi-worker server rebuilds them in one process instead of in every worker.
+#
+import argparse
+import os
+import threading
+
+from pymongo import GEOSPHERE
+
+from crud_module import AAC_FIELDS, AnimalShelter
+from rescue_profiles import RescueRegistry, compile_profile
+
+# Rescue categories kept as materialized views. Cats and Dogs are a single
+# equality on the animal_type index and would copy most of the collection.
+MATERIALIZED_PROFILES = ('Water', 'Mountain', 'Disaster', 'Service')
+
+# Larger incremental refreshes fall back to rebuilding every view
+MAX_INCREMENTAL_IDS = 10000
+
+
+class RescueViews(object):
+    """ One pre-filtered, pre-projected collection per rescue category """
+
+    def __init__(self, shelter, registry, fields, names=MATERIALIZED_PROFILES, prefix='rescue_'):
+        self.shelter = shelter
+        self.registry = registry
+        self.names = [name for name in names if name in registry.profiles]
+        self.projection = {'_id': 1, 'location_point': 1, **{field: 1 for field in fields}}
+        self.collections = {name: shelter.database[prefix + name.lower()] for name in self.names}
+
+        # Readers for each view, sharing the connection pool and result cache of the shelter
+        self.views = {name: AnimalShelter(None, None, client=shelter.client, cache=shelter.cache,
+                                          collection=collection.name)
+                      for name, collection in self.collections.items()}
+
+        # Set after the first full build, until then the dashboard reads the animals collection
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+
+# Reader for a filter value, None when the category is not materialized or not built yet
+    def get(self, name):
+        return self.views.get(name) if self.ready.is_set() else None
+
+# Rebuild every view from the animals collection and keep it current after writes
+# made through the shelter. A schedule also picks up writes made elsewhere,
+# e.g. by import_outcomes.py or another worker process.
+    def start(self, interval=300):
+        self.refresh()
+        self.shelter.write_listeners.append(self.refresh_ids)
+        if interval:
+            threading.Thread(target=self._schedule, args=(interval,), daemon=True).start()
+
+# Only read views kept by a separate refresher. They are used once every one of
+# them exists, checked again every interval until then.
+    def attach(self, interval=60):
+        if self._views_exist():
+            self.ready.set()
+        else:
+            threading.Thread(target=self._wait_for_views, args=(interval,), daemon=True).start()
+
+    def _views_exist(self):
+        try:
+            existing = set(self.shelter.database.list_collection_names())
+        except Exception as e:
+            print(f"Error listing views: {e}")
+            return False
+        return all(collection.name in existing for collection in self.collections.values())
+
+    def _wait_for_views(self, interval):
+        while not self._stop.wait(interval):
+            if self._views_exist():
+                self._clear_cache()
+                self.ready.set()
+                return
+
+    def stop(self):
+        self._stop.set()
+
+    def _schedule(self, interval):
+        while not self._stop.wait(interval):
+            self.refresh()
+
+# Rebuild the views with $out, which swaps in the new contents atomically and
+# keeps the existing indexes, so readers never see a half-built view
+    def refresh(self):
+        # Recompile first so breeds added since the last build are included
+        self.registry.refresh()
+        with self.lock:
+            for name in self.names:
+                try:
+                    self.shelter.collection.aggregate([
+                        {'$match': self.registry.query(name)},
+                        {'$project': self.projection},
+                        {'$out': self.collections[name].name},
+                    ])
+                    self.collections[name].create_index([('location_point', GEOSPHERE)], name='location_point')
+                except Exception as e:
+                    print(f"Error building {name} view: {e}")
+                    return False
+        self.ready.set()
+        self._clear_cache()
+        return True
+
+# Bring the views up to date for the given animal _ids after a write. Documents
+# are dropped from every view and the ones still matching are merged back in.
+# None means the changed documents are unknown and every view is rebuilt.
+    def refresh_ids(self, ids):
+        if ids is None or len(ids) > MAX_INCREMENTAL_IDS:
+            return self.refresh()
+        if not ids:
+            return True
+
+        with self.lock:
+            for name in self.names:
+                # The regex form of the profile also matches breeds the compiled $in has not seen yet
+                query = compile_profile(name, self.registry.profiles[name]).query
+                try:
+                    self.collections[name].delete_many({'_id': {'$in': ids}})
+                    self.shelter.collection.aggregate([
+                        {'$match': {'$and': [{'_id': {'$in': ids}}, query]}},
+                        {'$project': self.projection},
+                        {'$merge': {'into': self.collections[name].name, 'on': '_id',
+                                    'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+                    ])
+                except Exception as e:
+                    print(f"Error refreshing {name} view: {e}")
+                    return False
+        return True
+
+    def _clear_cache(self):
+        if self.shelter.cache is not None:
+            self.shelter.cache.clear()
+
+    def counts(self):
+        return {name: view.count({}) for name, view in self.views.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the rescue category views on a schedule.')
+    parser.add_argument('--interval', type=int, default=int(os.getenv('RESCUE_VIEWS_INTERVAL', 300)),
+                        help='seconds between rebuilds, 0 builds once and exits')
+    parser.add_argument('--user', default=os.getenv('AAC_USER', 'aacuser'))
+    parser.add_argument('--password', default=os.getenv('AAC_PASSWORD'))
+    args = parser.parse_args()
+
+    shelter = AnimalShelter(args.user, args.password)
+    shelter.ensure_indexes()
+    views = RescueViews(shelter, RescueRegistry(shelter, refresh=False), AAC_FIELDS)
+    views.refresh()
+    print(f"Built rescue views: {views.counts()}")
+    if args.interval:
+        views._schedule(args.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import time
+
+from crud_module import QueryCache
+
+# redis is only needed when CACHE_BACKEND=redis
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# Per-user default for the file cache, so another user's directory is never picked up
+def default_cache_dir():
+    user = os.getuid() if hasattr(os, 'getuid') else os.getenv('USERNAME', 'user')
+    return os.path.join(tempfile.gettempdir(), f'aac-cache-{user}')
+
+# Entries are unpickled, which can run code, so only a directory no one else can
+# write to is used
+def ensure_private_dir(directory):
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    status = os.stat(directory)
+    if not stat.S_ISDIR(status.st_mode):
+        raise RuntimeError(f"Cache directory {directory} is not a directory")
+    if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+        raise RuntimeError(f"Cache directory {directory} is owned by another user")
+    if status.st_mode & 0o077:
+        raise RuntimeError(f"Cache directory {directory} must not be accessible to other users (mode 0700)")
+
+
+class FileQueryCache(object):
+    """ Query cache shared by every worker process through a private directory of pickles """
+
+    def __init__(self, directory=None, max_entries=1024, ttl=60):
+        self.directory = directory or default_cache_dir()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        ensure_private_dir(self.directory)
+
+        # Counters are per process
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._puts = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                expires, value = pickle.load(entry)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+
+        if expires <= time.time():
+            _remove(path)
+            self.misses += 1
+            return False, None
+
+        # The modification time doubles as the last-used time for LRU eviction
+        _touch(path)
+        self.hits += 1
+        return True, value
+
+    def put(self, key, value):
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, 'wb') as entry:
+                pickle.dump((time.time() + self.ttl, value), entry, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"Error writing cache entry: {e}")
+            _remove(temporary)
+            return
+
+        # Listing the directory is the expensive part, so evict in batches
+        self._puts += 1
+        if self._puts % 32 == 0:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        entries.sort()
+        for _mtime, path in entries[:max(0, len(entries) - self.max_entries)]:
+            _remove(path)
+            self.evictions += 1
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                _remove(os.path.join(self.directory, name))
+        self.invalidations += 1
+
+    def stats(self):
+        return {
+            'entries': sum(1 for name in os.listdir(self.directory) if name.endswith('.pkl')),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+class RedisQueryCache(object):
+    """ Query cache shared by every worker process through Redis """
+
+    def __init__(self, url, ttl=60, prefix='aac:cache:'):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+        # Memory is bounded by the server's maxmemory with an allkeys-lru policy.
+        # Counters are per process.
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+# Keys include a generation number, so clear() is a single INCR and the old
+# entries simply expire instead of being deleted one by one
+    def _key(self, key):
+        generation = int(self.client.get(self.prefix + 'generation') or 0)
+        return f"{self.prefix}{generation}:{hashlib.sha1(key.encode()).hexdigest()}"
+
+    def get(self, key):
+        try:
+            payload = self.client.get(self._key(key))
+        except redis.RedisError as e:
+            print(f"Error reading cache entry: {e}")
+            payload = None
+        if payload is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, pickle.loads(payload)
+
+    def put(self, key, value):
+        try:
+            self.client.set(self._key(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=self.ttl)
+        except redis.RedisError as e:
+            print(f"Error writing cache entry: {e}")
+
+    def clear(self):
+        try:
+            self.client.incr(self.prefix + 'generation')
+            self.invalidations += 1
+        except redis.RedisError as e:
+            print(f"Error clearing cache: {e}")
+
+    def stats(self):
+        return {
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+# Build the cache selected by CACHE_BACKEND: memory (per process), file or redis
+def cache_from_env(max_entries=256, ttl=300):
+    backend = os.getenv('CACHE_BACKEND', 'memory')
+    ttl = int(os.getenv('CACHE_TTL', ttl))
+    if backend == 'file':
+        return FileQueryCache(os.getenv('CACHE_DIR'), max_entries, ttl)
+    if backend == 'redis':
+        return RedisQueryCache(os.getenv('REDIS_URL', 'redis://localhost:6379/0'), ttl)
+    return QueryCache(max_entries, ttl)
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,82 @@
+# Synthetic Austin Animal Center outcome documents for benchmarks
+import random
+from datetime import datetime, timedelta
+
+ANIMAL_TYPES = [('Dog', 0.56), ('Cat', 0.38), ('Other', 0.05), ('Bird', 0.01)]
+
+# Breed frequencies roughly follow the AAC data: a few mixes dominate and
+# there is a long tail of pure and crossed breeds
+BREEDS = {
+    'Dog': [
+        ('Pit Bull Mix', 0.14), ('Labrador Retriever Mix', 0.12), ('Chihuahua Shorthair Mix', 0.11),
+        ('German Shepherd Mix', 0.05), ('Australian Cattle Dog Mix', 0.03), ('Dachshund Mix', 0.025),
+        ('Boxer Mix', 0.02), ('Border Collie Mix', 0.02), ('Miniature Poodle Mix', 0.015),
+        ('Siberian Husky Mix', 0.015), ('Labrador Retriever', 0.012), ('German Shepherd', 0.012),
+        ('Rottweiler Mix', 0.01), ('Golden Retriever Mix', 0.008), ('Beagle Mix', 0.008),
+        ('Labrador Retriever/Pit Bull', 0.008), ('German Shepherd/Labrador Retriever', 0.006),
+        ('Chesapeake Bay Retriever Mix', 0.003), ('Newfoundland Mix', 0.002), ('Alaskan Malamute Mix', 0.002),
+        ('Doberman Pinsch Mix', 0.003), ('Doberman Pinscher', 0.001), ('Bloodhound Mix', 0.001),
+        ('Old English Sheepdog Mix', 0.001), ('Golden Retriever', 0.002), ('Rottweiler', 0.002),
+    ],
+    'Cat': [
+        ('Domestic Shorthair Mix', 0.72), ('Domestic Medium Hair Mix', 0.1), ('Domestic Longhair Mix', 0.05),
+        ('Siamese Mix', 0.04), ('Domestic Shorthair', 0.03), ('American Shorthair Mix', 0.01),
+        ('Snowshoe Mix', 0.005), ('Maine Coon Mix', 0.003),
+    ],
+    'Other': [('Bat Mix', 0.3), ('Raccoon Mix', 0.2), ('Rabbit Sh Mix', 0.2), ('Opossum Mix', 0.15), ('Skunk Mix', 0.15)],
+    'Bird': [('Chicken Mix', 0.4), ('Parakeet Mix', 0.3), ('Pigeon Mix', 0.3)],
+}
+
+SEXES = [('Neutered Male', 0.36), ('Spayed Female', 0.33), ('Intact Male', 0.12), ('Intact Female', 0.11), ('Unknown', 0.08)]
+OUTCOMES = [('Adoption', 0.42), ('Transfer', 0.3), ('Return to Owner', 0.18), ('Euthanasia', 0.08), ('Died', 0.02)]
+OUTCOME_SUBTYPES = {'Transfer': ['Partner', 'SCRP'], 'Euthanasia': ['Suffering', 'Rabies Risk'], 'Adoption': ['', 'Foster']}
+COLORS = ['Black', 'White', 'Brown', 'Black/White', 'Brown Tabby', 'Tan', 'Orange Tabby', 'Blue', 'Tricolor', 'Brown/White']
+NAMES = ['Max', 'Bella', 'Luna', 'Charlie', 'Lucy', 'Daisy', 'Rocky', 'Buddy', 'Milo', 'Coco', 'Bear', 'Lola', 'Duke', '']
+
+# Outcomes cluster around Austin, TX
+AUSTIN_LAT, AUSTIN_LONG = 30.75, -97.48
+
+def _choose(rnd, weighted):
+    values, weights = zip(*weighted)
+    return rnd.choices(values, weights)[0]
+
+def _age_label(weeks):
+    if weeks < 8:
+        return f"{max(1, int(weeks))} weeks"
+    if weeks < 52:
+        months = int(weeks / 4.345)
+        return f"{months} month" + ('s' if months != 1 else '')
+    years = int(weeks / 52.143)
+    return f"{years} year" + ('s' if years != 1 else '')
+
+# Yield count AAC-shaped outcome documents, the same seed gives the same data
+def generate_outcomes(count, seed=0, start_rec_num=1):
+    rnd = random.Random(seed)
+    start = datetime(2013, 10, 1)
+    for number in range(count):
+        animal_type = _choose(rnd, ANIMAL_TYPES)
+        outcome_type = _choose(rnd, OUTCOMES)
+
+        # Most outcomes are young animals with a long tail of older ones
+        weeks = min(rnd.lognormvariate(3.6, 1.1), 1040.0)
+        outcome_time = start + timedelta(minutes=rnd.randrange(60 * 24 * 365 * 5))
+        birth = outcome_time - timedelta(weeks=weeks)
+
+        yield {
+            'rec_num': start_rec_num + number,
+            'age_upon_outcome': _age_label(weeks),
+            'animal_id': f"A{rnd.randrange(10 ** 6):06d}",
+            'animal_type': animal_type,
+            'breed': _choose(rnd, BREEDS[animal_type]),
+            'color': rnd.choice(COLORS),
+            'date_of_birth': birth.strftime('%Y-%m-%d'),
+            'datetime': outcome_time.strftime('%Y-%m-%d %H:%M:%S'),
+            'monthyear': outcome_time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'name': rnd.choice(NAMES),
+            'outcome_subtype': rnd.choice(OUTCOME_SUBTYPES.get(outcome_type, [''])),
+            'outcome_type': outcome_type,
+            'sex_upon_outcome': _choose(rnd, SEXES),
+            'location_lat': rnd.gauss(AUSTIN_LAT, 0.12),
+            'location_long': rnd.gauss(AUSTIN_LONG, 0.12),
+            'age_upon_outcome_in_weeks': round(weeks, 4),
+        }
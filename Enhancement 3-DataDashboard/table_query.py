@@ -0,0 +1,98 @@
+import re
+
+# DataTable filter operators mapped to their MongoDB equivalents
+OPERATORS = {
+    'ge': '$gte', '>=': '$gte',
+    'le': '$lte', '<=': '$lte',
+    'lt': '$lt', '<': '$lt',
+    'gt': '$gt', '>': '$gt',
+    'ne': '$ne', '!=': '$ne',
+    'eq': '$eq', '=': '$eq',
+    'contains': 'contains',
+    'datestartswith': 'datestartswith',
+}
+
+# "{column} op value", where op may carry an s (case-sensitive) or i
+# (case-insensitive) prefix. The operator is only looked for right after the
+# column name, so a value containing an operator word is left alone. Longer
+# symbols come first so '>=' is not matched as '>'.
+FILTER_PART = re.compile(
+    r"^\s*\{(?P<name>[^}]*)\}\s*(?P<case>[si])?"
+    r"(?:(?P<word>datestartswith|contains|ge|le|lt|gt|ne|eq)(?:\s+|$)|(?P<symbol>>=|<=|!=|<|>|=)\s*)"
+    r"(?P<value>.*?)\s*$",
+    re.DOTALL)
+
+# Split a single "{column} op value" expression into its parts. case is 's',
+# 'i' or None when the operator had no prefix.
+def split_filter_part(filter_part):
+    match = FILTER_PART.match(filter_part)
+    if match is None:
+        return None, None, None, None
+
+    operator = OPERATORS[match.group('word') or match.group('symbol')]
+    value_part = match.group('value')
+    if len(value_part) > 1 and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', '`'):
+        value = value_part[1: -1].replace('\\' + value_part[0], value_part[0])
+    else:
+        value = _to_number(value_part)
+
+    return match.group('name'), operator, value, match.group('case')
+
+def _to_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+# Translate the DataTable filter_query syntax into a MongoDB match document
+def translate_filter(filter_query):
+    conditions = []
+    for filter_part in (filter_query or '').split(' && '):
+        name, operator, value, case = split_filter_part(filter_part)
+        if name is None:
+            continue
+
+        if operator == 'contains':
+            # Case-insensitive unless the table asked for scontains
+            condition = {'$regex': re.escape(str(value))}
+            if case != 's':
+                condition['$options'] = 'i'
+            conditions.append({name: condition})
+        elif operator == 'datestartswith':
+            # Anchored prefix so an index on the field can still be used
+            conditions.append({name: {'$regex': '^' + re.escape(str(value))}})
+        elif operator in ('$eq', '$ne') and isinstance(value, str) and case == 'i':
+            match = {'$regex': '^' + re.escape(value) + '$', '$options': 'i'}
+            conditions.append({name: match if operator == '$eq' else {'$not': match}})
+        elif operator in ('$eq', '$ne') and not isinstance(value, str):
+            # The table shows numbers as text, so match either representation
+            match = {'$in': [value, str(value)]}
+            conditions.append({name: match if operator == '$eq' else {'$not': match}})
+        else:
+            conditions.append({name: {operator: value}})
+
+    if not conditions:
+        return {}
+    if len(conditions) == 1:
+        return conditions[0]
+    return {'$and': conditions}
+
+# Translate the DataTable sort_by list into a MongoDB sort specification
+def translate_sort(sort_by):
+    sort = [(column['column_id'], 1 if column['direction'] == 'asc' else -1) for column in (sort_by or [])]
+
+    # Break ties on _id so skip/limit paging is deterministic
+    sort.append(('_id', 1))
+    return sort
+
+# Combine two match documents without nesting empty queries
+def combine_queries(*queries):
+    queries = [query for query in queries if query]
+    if not queries:
+        return {}
+    if len(queries) == 1:
+        return queries[0]
+    return {'$and': queries}
@@ -0,0 +1,42 @@
+import os
+import sys
+
+# The dashboard modules live next to this directory rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock
+from pymongo import MongoClient
+import pytest
+
+from crud_module import AnimalShelter
+
+ANIMAL_FIELDS = ['animal_type', 'animal_id', 'breed', 'name', 'sex_upon_outcome', 'rec_num',
+                 'location_lat', 'location_long', 'age_upon_outcome_in_weeks']
+
+
+def make_animal(rec_num, **fields):
+    return {'animal_type': 'Dog', 'animal_id': f'A{rec_num:06d}', 'breed': 'Labrador Retriever Mix',
+            'name': f'Dog {rec_num}', 'sex_upon_outcome': 'Intact Female', 'rec_num': rec_num,
+            'location_lat': 30.5 + rec_num / 1000, 'location_long': -97.5, 'age_upon_outcome_in_weeks': 30.0 + rec_num,
+            **fields}
+
+
+# AnimalShelter over an in-memory mongomock collection
+@pytest.fixture
+def shelter():
+    return AnimalShelter(None, None, client=mongomock.MongoClient())
+
+
+# AnimalShelter over a scratch collection on a real server, for the queries
+# mongomock cannot run. Skipped unless MONGO_TEST_URI names a server.
+@pytest.fixture
+def server_shelter(request):
+    uri = os.getenv('MONGO_TEST_URI')
+    if not uri:
+        pytest.skip('MONGO_TEST_URI is not set')
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    shelter = AnimalShelter(None, None, client=client, collection=f'test_{request.node.name}'[:100])
+    shelter.collection.drop()
+    yield shelter
+    shelter.collection.drop()
+    client.close()
@@ -0,0 +1,77 @@
+import asyncio
+
+from conftest import make_animal
+from crud_module import AsyncAnimalShelter, QueryCache, update_document
+
+
+class AsyncCursor(object):
+    def __init__(self, cursor):
+        self.cursor = iter(cursor)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncCollection(object):
+    """ The async collection methods the writes use, over a mongomock collection """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.updates = []
+
+    async def insert_one(self, document):
+        return self.collection.insert_one(document)
+
+    async def update_many(self, query, update):
+        self.updates.append(update)
+        return self.collection.update_many(query, update)
+
+    async def delete_many(self, query):
+        return self.collection.delete_many(query)
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+
+def make_async_shelter(shelter):
+    async_shelter = AsyncAnimalShelter.__new__(AsyncAnimalShelter)
+    async_shelter.collection = AsyncCollection(shelter.collection)
+    async_shelter._init_writes(QueryCache())
+    return async_shelter
+
+
+def test_async_writes_match_sync_writes(shelter):
+    async_shelter = make_async_shelter(shelter)
+    changes = []
+    async_shelter.write_listeners.append(changes.append)
+    async_shelter.cache.put('key', 'value')
+
+    assert asyncio.run(async_shelter.create(make_animal(1)))
+    document = shelter.collection.find_one({'rec_num': 1})
+    assert document['location_point'] == {'type': 'Point', 'coordinates': [-97.5, 30.501]}
+    assert changes == [[document['_id']]]
+    assert async_shelter.cache.get('key') == (False, None)
+
+    # mongomock does not evaluate field paths inside a pipeline $set, MongoDB does
+    update = {'location_lat': 30.0, 'location_long': -97.0}
+    assert asyncio.run(async_shelter.update({'rec_num': 1}, update)) == 1
+    assert async_shelter.collection.updates == [update_document(update)]
+    assert changes[-1] == [document['_id']]
+
+    assert asyncio.run(async_shelter.delete({'rec_num': 1})) == 1
+    assert changes[-1] == [document['_id']]
+    assert shelter.collection.count_documents({}) == 0
+
+
+def test_update_document_recomputes_location_point():
+    assert update_document({'name': 'Max'}) == {'$set': {'name': 'Max'}}
+    assert update_document({'location_long': -97.25}) == [
+        {'$set': {'location_long': {'$literal': -97.25}}},
+        {'$set': {'location_point': {'type': 'Point', 'coordinates': ['$location_long', '$location_lat']}}},
+    ]
@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ServerSelectionTimeoutError
+import pytest
+
+from conftest import make_animal
+from crud_module import INDEX_SPEC, concat_column, frame_records, typed_column, typed_value
+from synthetic_data import generate_outcomes
+
+
+# mongomock does not accept the bulk replaces this pymongo sends, so the bulk
+# write is replayed one replace at a time with the counts MongoDB reports
+def replay_bulk_write(collection):
+    def bulk_write(requests, ordered=True):
+        details = {'nInserted': 0, 'nMatched': 0, 'nModified': 0, 'nUpserted': 0, 'writeErrors': []}
+        for index, request in enumerate(requests):
+            try:
+                result = collection.replace_one(request._filter, request._doc, upsert=request._upsert)
+            except DuplicateKeyError as e:
+                details['writeErrors'].append({'index': index, 'code': 11000, 'errmsg': str(e)})
+                continue
+            details['nMatched'] += result.matched_count
+            details['nModified'] += result.modified_count
+            details['nUpserted'] += result.upserted_id is not None
+        if details['writeErrors']:
+            raise BulkWriteError(details)
+        return type('BulkWriteResult', (), {'bulk_api_result': details})()
+    collection.bulk_write = bulk_write
+    return collection
+
+
+@pytest.fixture
+def upsert_shelter(shelter):
+    replay_bulk_write(shelter.collection)
+    return shelter
+
+
+def test_upsert_many_creates_the_key_index_first(upsert_shelter):
+    assert 'animal_id_rec_num' not in upsert_shelter.collection.index_information()
+    upsert_shelter.upsert_many([make_animal(rec_num) for rec_num in range(1, 6)])
+    index = upsert_shelter.collection.index_information()['animal_id_rec_num']
+    assert list(index['key']) == [('animal_id', 1), ('rec_num', 1)]
+    assert index['unique']
+
+
+def test_upsert_many_inserts_then_replaces_on_the_key(upsert_shelter):
+    results = upsert_shelter.upsert_many([make_animal(rec_num) for rec_num in range(1, 6)], batch_size=2)
+    assert [result['upserted'] for result in results] == [2, 2, 1]
+
+    results = upsert_shelter.upsert_many([make_animal(2, name='Renamed'), make_animal(6)])
+    assert results == [{'inserted': 0, 'matched': 1, 'modified': 1, 'upserted': 1, 'errors': 0, 'skipped': 0}]
+    assert upsert_shelter.collection.count_documents({}) == 6
+    assert upsert_shelter.collection.find_one({'rec_num': 2})['name'] == 'Renamed'
+    assert upsert_shelter.collection.find_one({'rec_num': 6})['location_point']['type'] == 'Point'
+
+
+# Without the skip every keyless row would be replaced into one document
+def test_upsert_many_skips_documents_missing_a_key_field(upsert_shelter):
+    results = upsert_shelter.upsert_many([{'name': 'a'}, {'name': 'b', 'animal_id': 'A1'},
+                                          make_animal(1), {'name': 'c', 'rec_num': None}])
+    assert results[0]['skipped'] == 3
+    assert results[0]['upserted'] == 1
+    assert upsert_shelter.collection.count_documents({}) == 1
+
+
+def test_upsert_many_reports_a_failed_batch(shelter):
+    def bulk_write(requests, ordered=True):
+        raise ServerSelectionTimeoutError('no servers')
+    shelter.collection.bulk_write = bulk_write
+    results = shelter.upsert_many([make_animal(1), make_animal(2), {'name': 'a'}])
+    assert results == [{'inserted': 0, 'matched': 0, 'modified': 0, 'upserted': 0, 'errors': 2, 'skipped': 1}]
+
+
+# The key index only covers outcomes, other documents may lack the key fields
+def test_unique_key_allows_documents_without_the_key_fields(shelter):
+    shelter.ensure_indexes()
+    assert shelter.create({'name': 'a'})
+    assert shelter.create({'name': 'b'})
+    assert shelter.create({'name': 'c', 'animal_id': 'A1'})
+    assert shelter.create({'name': 'd', 'animal_id': 'A1'})
+
+
+# A unique index over duplicate outcomes cannot be built, the others still are
+def test_ensure_indexes_creates_each_index_separately(shelter):
+    shelter.collection.insert_many([make_animal(1), make_animal(1)])
+    shelter.ensure_indexes([entry for entry in INDEX_SPEC if entry[0] in ('animal_id_rec_num', 'rec_num', 'age')])
+    indexes = shelter.collection.index_information()
+    assert 'animal_id_rec_num' not in indexes
+    assert {'rec_num', 'age'} <= set(indexes)
+
+
+def test_unique_key_rejects_duplicate_outcomes(shelter):
+    shelter.ensure_indexes()
+    assert shelter.create(make_animal(1))
+    assert not shelter.create(make_animal(1))
+    assert shelter.create(make_animal(2))
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 4, 10])
+def test_read_batches_splits_the_sorted_result_at_batch_size(shelter, batch_size):
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in (5, 2, 8, 1, 7, 3, 9, 4, 6)])
+    batches = list(shelter.read_batches({}, {'_id': 0, 'rec_num': 1}, sort=[('rec_num', 1)], batch_size=batch_size))
+    assert [len(batch) for batch in batches[:-1]] == [batch_size] * (len(batches) - 1)
+    assert 0 < len(batches[-1]) <= batch_size
+    assert [document for batch in batches for document in batch] == [{'rec_num': rec_num} for rec_num in range(1, 10)]
+
+
+def test_read_batches_applies_skip_limit_and_query(shelter):
+    shelter.collection.insert_many([make_animal(rec_num, animal_type='Cat' if rec_num % 2 else 'Dog')
+                                    for rec_num in range(1, 21)])
+    documents = list(shelter.read_iter({'animal_type': 'Cat'}, {'_id': 0, 'rec_num': 1},
+                                       sort=[('rec_num', -1)], skip=2, limit=5, batch_size=2))
+    assert [document['rec_num'] for document in documents] == [15, 13, 11, 9, 7]
+
+
+def test_read_dataframe_keeps_the_projected_columns_in_order(shelter):
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 8)])
+    columns = ['rec_num', 'name', 'breed']
+    frame = shelter.read_dataframe({}, {'_id': 0, **{column: 1 for column in columns}}, columns=columns,
+                                   sort=[('rec_num', 1)], batch_size=3)
+    assert list(frame.columns) == columns
+    assert frame['rec_num'].tolist() == list(range(1, 8))
+    assert frame['name'].tolist() == [f'Dog {rec_num}' for rec_num in range(1, 8)]
+    assert frame.index.tolist() == list(range(7))
+
+
+def test_read_dataframe_of_no_rows_has_the_columns(shelter):
+    frame = shelter.read_dataframe({'rec_num': 1}, {'_id': 0, 'rec_num': 1}, columns=['rec_num'], batch_size=2)
+    assert frame.empty
+    assert list(frame.columns) == ['rec_num']
+
+
+# Typed columns come back with the values MongoDB holds, only float32 rounds
+def test_read_typed_dataframe_types_each_column(shelter):
+    documents = list(generate_outcomes(30, seed=5))
+    shelter.collection.insert_many([dict(document) for document in documents])
+    frame = shelter.read_typed_dataframe({}, batch_size=7)
+    assert isinstance(frame['breed'].dtype, pd.CategoricalDtype)
+    assert str(frame['rec_num'].dtype) == 'Int32'
+    assert frame['location_lat'].dtype == np.float32
+    assert frame['age_upon_outcome_in_weeks'].dtype == np.float64
+    assert pd.api.types.is_datetime64_any_dtype(frame['monthyear'])
+
+    records = frame_records(frame)
+    assert [record['datetime'] for record in records] == [document['datetime'] for document in documents]
+    assert [record['breed'] for record in records] == [document['breed'] for document in documents]
+    assert [record['location_long'] for record in records] == [typed_value(document['location_long'], 'float32')
+                                                                for document in documents]
+
+
+# A value the type cannot hold exactly keeps the whole column as stored
+def test_typed_column_keeps_values_that_do_not_fit():
+    assert typed_column(['2015-01-02', '2015-1-2'], 'datetime', '%Y-%m-%d').tolist() == ['2015-01-02', '2015-1-2']
+    assert typed_column([1, '2', None], 'Int32').tolist() == [1, '2', None]
+    assert typed_column([2 ** 40], 'Int32').tolist() == [2 ** 40]
+    chunks = [typed_column(['Dog', None], 'category'), typed_column([5], 'category')]
+    assert concat_column(chunks).tolist() == ['Dog', None, 5]
+
+
+def test_read_matches_the_streamed_batches(shelter):
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 12)])
+    projection = {'_id': 0, 'rec_num': 1, 'name': 1}
+    assert shelter.read({}, projection, sort=[('rec_num', 1)], batch_size=4) == \
+        list(shelter.read_iter({}, projection, sort=[('rec_num', 1)], batch_size=4))
+
+
+@pytest.fixture
+def breeds(shelter):
+    counts = {'Beagle': 4, 'Boxer': 2, 'Collie': 2, 'Pug': 1, 'Husky': 3}
+    rec_num = 0
+    for breed, count in counts.items():
+        for _ in range(count):
+            rec_num += 1
+            shelter.collection.insert_one(make_animal(rec_num, breed=breed, animal_type='Cat' if breed == 'Pug' else 'Dog'))
+    return shelter
+
+
+def test_count_by_folds_the_rest_into_other(breeds):
+    # Equal counts are ordered by value, so Boxer is kept over Collie
+    assert breeds.count_by('breed', top_n=3) == ([('Beagle', 4), ('Husky', 3), ('Boxer', 2), ('Other', 3)], 12)
+
+
+def test_count_by_without_other_when_every_value_fits(breeds):
+    rows, total = breeds.count_by('breed', top_n=5)
+    assert total == 12
+    assert [breed for breed, _count in rows] == ['Beagle', 'Husky', 'Boxer', 'Collie', 'Pug']
+
+
+def test_count_by_filters_before_grouping(breeds):
+    assert breeds.count_by('breed', {'animal_type': 'Dog'}, top_n=1) == ([('Beagle', 4), ('Other', 7)], 11)
+    assert breeds.count_by('breed', {'animal_type': 'Bird'}) == ([], 0)
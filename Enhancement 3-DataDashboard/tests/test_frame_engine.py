@@ -0,0 +1,177 @@
+from bson import ObjectId
+import numpy as np
+import pytest
+
+from conftest import ANIMAL_FIELDS, make_animal
+from crud_module import AAC_FIELDS, schema_for, typed_frame
+import frame_engine
+from frame_engine import FrameQueryEngine, LiveFrameEngine
+from live_dataset import LiveDataset
+from rescue_profiles import RESCUE_PROFILES, compile_profile
+from synthetic_data import BREEDS, generate_outcomes
+from table_query import combine_queries, translate_filter
+
+FIELDS = AAC_FIELDS
+
+
+# Clean documents load into typed columns. Values of the wrong type and missing
+# fields, as found in the real collection, keep their columns as raw values.
+@pytest.fixture(scope='module', params=['typed', 'mixed'])
+def documents(request):
+    documents = list(generate_outcomes(1500, seed=7))
+    if request.param == 'mixed':
+        documents += [make_animal(2000, breed=None), {**make_animal(2001), 'rec_num': '2001'},
+                      make_animal(2002, age_upon_outcome_in_weeks='unknown'), {'rec_num': 2003, 'animal_type': 'Dog'}]
+    return documents
+
+
+@pytest.fixture
+def filled_shelter(shelter, documents):
+    shelter.collection.insert_many([dict(document) for document in documents])
+    return shelter
+
+
+@pytest.fixture
+def engine(filled_shelter):
+    return FrameQueryEngine.from_shelter(filled_shelter, FIELDS)
+
+
+QUERIES = [
+    {},
+    translate_filter('{rec_num} contains 5'),
+    translate_filter('{rec_num} = 15'),
+    translate_filter('{rec_num} >= 1400'),
+    translate_filter('{age_upon_outcome_in_weeks} < 20 && {animal_type} = Cat'),
+    translate_filter('{breed} contains retriever'),
+    translate_filter('{breed} scontains retriever'),
+    translate_filter('{name} icontains max'),
+    translate_filter('{name} ieq max'),
+    translate_filter('{date_of_birth} datestartswith 2015'),
+    translate_filter('{outcome_type} != Adoption'),
+    {'name': {'$exists': False}},
+    {'$or': [{'animal_type': 'Bird'}, {'name': {'$in': ['Max', 'Luna']}}]},
+    {'$nor': [{'animal_type': 'Dog'}, {'animal_type': 'Cat'}]},
+] + [compile_profile(name, profile, breeds).query for name, profile in RESCUE_PROFILES.items()
+     for breeds in (None, [breed for weighted in BREEDS.values() for breed, _weight in weighted])]
+
+
+# The engine must answer every dashboard query like MongoDB does
+@pytest.mark.parametrize('query', QUERIES, ids=str)
+def test_engine_matches_mongo(engine, filled_shelter, query):
+    expected = [document['rec_num'] for document in filled_shelter.read(query, {'rec_num': 1}, sort=[('_id', 1)])]
+    assert engine.read_dataframe(query, columns=['rec_num'])['rec_num'].tolist() == expected
+    assert engine.count(query) == len(expected)
+
+
+def test_numeric_contains_matches_nothing(engine):
+    assert engine.count(translate_filter('{rec_num} contains 5')) == 0
+    if engine.kinds['rec_num'] == 'object':
+        assert engine.count(translate_filter('{rec_num} scontains 2001')) == 1  # The one stored as text
+
+
+def test_typed_columns(shelter):
+    shelter.collection.insert_many(list(generate_outcomes(50, seed=3)))
+    engine = FrameQueryEngine.from_shelter(shelter, FIELDS)
+    assert engine.kinds['breed'] == engine.kinds['color'] == 'codes'
+    assert engine.kinds['rec_num'] == engine.kinds['location_lat'] == 'number'
+    assert engine.kinds['datetime'] == 'datetime'
+    # Values come back as stored, coordinates as the float32 they were rounded to
+    expected = shelter.read({}, {'_id': 0, 'datetime': 1, 'rec_num': 1, 'location_lat': 1}, sort=[('_id', 1)])
+    found = engine.read({}, columns=['datetime', 'rec_num', 'location_lat'], sort=[('_id', 1)])
+    assert [row['datetime'] for row in found] == [document['datetime'] for document in expected]
+    assert [row['rec_num'] for row in found] == [document['rec_num'] for document in expected]
+    assert [row['location_lat'] for row in found] == [float(str(np.float32(document['location_lat'])))
+                                                      for document in expected]
+
+
+# A column holding only numbers used to fail in pandas' .str accessor
+def test_contains_on_numbers_only(shelter):
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 30)])
+    numbers_only = FrameQueryEngine.from_shelter(shelter, FIELDS)
+    query = translate_filter('{rec_num} contains 5 && {age_upon_outcome_in_weeks} contains 3')
+    assert numbers_only.count(query) == shelter.count(query) == 0
+
+
+# mongomock cannot evaluate $options inside $not, so ine is checked against ieq
+def test_case_insensitive_not_equal(engine):
+    assert engine.count(translate_filter('{name} ine max')) == engine.size - engine.count(translate_filter('{name} ieq max'))
+
+
+def test_sort_skip_limit(engine, filled_shelter):
+    query = combine_queries({'animal_type': 'Dog'}, translate_filter('{age_upon_outcome_in_weeks} > 10'))
+    sort = [('breed', 1), ('age_upon_outcome_in_weeks', -1), ('rec_num', 1)]
+    expected = [document['rec_num'] for document in filled_shelter.read(query, {'rec_num': 1}, sort=sort, skip=20, limit=30)]
+    assert engine.read_dataframe(query, columns=['rec_num'], sort=sort, skip=20, limit=30)['rec_num'].tolist() == expected
+
+
+def test_count_by(engine, filled_shelter):
+    query = {'animal_type': 'Dog'}
+    assert engine.count_by('breed', query, top_n=5) == filled_shelter.count_by('breed', query, top_n=5)
+
+
+@pytest.fixture
+def live_engine(shelter):
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 11)])
+    dataset = LiveDataset(shelter, ANIMAL_FIELDS)
+    dataset.reload()
+    return LiveFrameEngine(dataset)
+
+
+# Changed rows are applied to a copy, readers of the previous engine still see the old rows
+def test_live_engine_applies_changed_rows(live_engine):
+    dataset = live_engine.live_dataset
+    first = live_engine.current()
+    assert live_engine.count({}) == 10
+    assert live_engine.current() is first
+
+    dataset.apply_change({'operationType': 'insert', 'fullDocument': {'_id': 'new', **make_animal(11)}})
+    assert live_engine.count({'rec_num': 11}) == 1
+    assert live_engine._builder is None
+    assert live_engine.built[0] == dataset.version
+    assert first.count({}) == 10 and live_engine.count({}) == 11
+
+
+# Too many changed rows, or a value its column cannot hold, rebuild in the background
+@pytest.mark.parametrize('change', ['many rows', 'wrong type'])
+def test_live_engine_rebuilds_in_background(monkeypatch, live_engine, change):
+    dataset = live_engine.live_dataset
+    first = live_engine.current()
+    if change == 'many rows':
+        monkeypatch.setattr(frame_engine, 'DELTA_MIN_ROWS', 1)
+        for rec_num in (11, 12):
+            dataset.apply_change({'operationType': 'insert', 'fullDocument': {'_id': rec_num, **make_animal(rec_num)}})
+    else:
+        dataset.apply_change({'operationType': 'insert', 'fullDocument': {'_id': 11, **make_animal(11), 'rec_num': '11'}})
+
+    assert live_engine.current() is first
+    live_engine._builder.join()
+    assert live_engine.built[0] == dataset.version
+    assert live_engine.count({}) == dataset.count({})
+    assert live_engine.count({'rec_num': {'$in': [11, '11']}}) == 1
+
+
+# An engine brought up to date by deltas answers like one built from the same rows
+def test_changed_rows_match_a_rebuilt_engine(shelter, documents):
+    shelter.collection.insert_many([dict(document) for document in documents[:300]])
+    dataset = LiveDataset(shelter, FIELDS)
+    dataset.reload()
+    live_engine = LiveFrameEngine(dataset)
+    live_engine.current()
+
+    rows = list(shelter.collection.find({}, sort=[('_id', 1)]))
+    for document in rows[:40]:
+        dataset.apply_change({'operationType': 'delete', 'documentKey': {'_id': document['_id']}})
+    for index, document in enumerate(rows[40:120]):
+        changed = {**document, 'breed': f'New Breed {index % 3}', 'age_upon_outcome_in_weeks': index / 3,
+                   'datetime': '2020-02-0%d 10:00:00' % (index % 9 + 1), 'name': None}
+        dataset.apply_change({'operationType': 'replace', 'fullDocument': changed})
+    for document in documents[300:360]:
+        dataset.apply_change({'operationType': 'insert', 'fullDocument': {**document, '_id': ObjectId()}})
+
+    updated = live_engine.current()
+    assert live_engine.built[0] == dataset.version and live_engine._builder is None
+    rebuilt = FrameQueryEngine(typed_frame(dataset.snapshot(), {'_id': 'object', **schema_for(FIELDS)}), FIELDS)
+    sort = [('datetime', -1), ('breed', 1), ('_id', 1)]
+    for query in QUERIES + [{'breed': 'New Breed 1'}, {'datetime': {'$regex': '^2020-02'}}]:
+        assert updated.read_dataframe(query, sort=sort).equals(rebuilt.read_dataframe(query, sort=sort))
+    assert updated.count_by('breed', top_n=5) == rebuilt.count_by('breed', top_n=5)
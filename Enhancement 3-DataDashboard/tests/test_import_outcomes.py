@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from conftest import make_animal
+from import_outcomes import read_documents
+
+
+def test_json_export_is_read_as_an_array(tmp_path):
+    path = tmp_path / 'outcomes.json'
+    path.write_text(json.dumps([make_animal(1), make_animal(2)], indent=2))
+    assert list(read_documents(str(path))) == [make_animal(1), make_animal(2)]
+
+
+@pytest.mark.parametrize('extension', ['.jsonl', '.ndjson'])
+def test_json_lines_are_read_line_by_line(tmp_path, extension):
+    path = tmp_path / f'outcomes{extension}'
+    path.write_text(json.dumps(make_animal(1)) + '\n\n' + json.dumps(make_animal(2)) + '\n')
+    assert list(read_documents(str(path))) == [make_animal(1), make_animal(2)]
+
+
+def test_json_export_must_be_an_array(tmp_path):
+    path = tmp_path / 'outcomes.json'
+    path.write_text(json.dumps(make_animal(1)))
+    with pytest.raises(ValueError):
+        list(read_documents(str(path)))
+
+
+def test_csv_numeric_fields_are_converted(tmp_path):
+    path = tmp_path / 'outcomes.csv'
+    path.write_text('animal_id,rec_num,location_lat,name\nA1,7,30.25,\n')
+    assert list(read_documents(str(path))) == [{'animal_id': 'A1', 'rec_num': 7, 'location_lat': 30.25, 'name': ''}]
@@ -0,0 +1,255 @@
+import time
+
+import numpy as np
+import pytest
+from pymongo.errors import AutoReconnect
+
+import live_dataset
+from conftest import ANIMAL_FIELDS, make_animal
+from live_dataset import LiveDataset
+
+
+# Make the next failures reads through _find_batches lose the connection while
+# fetching their second batch, reads fitting in one batch are not affected
+def fail_after_first_batch(monkeypatch, shelter, failures):
+    find_batches = shelter._find_batches
+    remaining = [failures]
+
+    def flaky(*args, batch_size=1000, **kwargs):
+        for batch in find_batches(*args, batch_size=batch_size, **kwargs):
+            yield batch
+            if remaining[0] and len(batch) == batch_size:
+                remaining[0] -= 1
+                raise AutoReconnect('connection reset')
+
+    monkeypatch.setattr(shelter, '_find_batches', flaky)
+    monkeypatch.setattr(live_dataset, 'RELOAD_RETRY_DELAY', 0)
+    monkeypatch.setattr(live_dataset, 'LOAD_BATCH_SIZE', 10)
+
+
+@pytest.fixture
+def loaded_shelter(shelter):
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 26)])
+    return shelter
+
+
+def test_reload_retries_a_partial_load(monkeypatch, loaded_shelter):
+    fail_after_first_batch(monkeypatch, loaded_shelter, failures=1)
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS)
+    monkeypatch.setattr(loaded_shelter, 'read_iter', _small_batches(loaded_shelter.read_iter))
+    dataset.reload()
+    assert len(dataset.rows) == 25
+    assert dataset.watermark == 25
+
+
+def test_failed_load_keeps_rows_and_is_not_ready(monkeypatch, tmp_path, loaded_shelter):
+    fail_after_first_batch(monkeypatch, loaded_shelter, failures=2 * live_dataset.RELOAD_ATTEMPTS)
+    monkeypatch.setattr(loaded_shelter, 'read_iter', _small_batches(loaded_shelter.read_iter))
+    snapshot_path = str(tmp_path / 'animals.parquet')
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS, snapshot_path=snapshot_path)
+    monkeypatch.setattr(dataset, '_open_stream', lambda resume_token: None)
+
+    with pytest.raises(AutoReconnect):
+        dataset._load()
+    assert dataset.rows == {}
+    assert dataset.version == 0
+    assert not dataset.ready.is_set()
+    assert not (tmp_path / 'animals.parquet').exists()
+
+    dataset._run()  # Reported instead of raised in the background thread
+    assert not dataset.ready.is_set()
+
+
+def test_poll_does_not_remove_rows_after_a_failed_id_read(monkeypatch, loaded_shelter):
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS)
+    dataset.reload()
+    loaded_shelter.collection.insert_one(make_animal(26))
+    loaded_shelter.collection.delete_one({'rec_num': 1})
+
+    # The id read fails after its first batch; the rows must not be reconciled against it
+    fail_after_first_batch(monkeypatch, loaded_shelter, failures=1)
+    monkeypatch.setattr(loaded_shelter, 'read_iter', _small_batches(loaded_shelter.read_iter))
+    with pytest.raises(AutoReconnect):
+        dataset.poll_once()
+    assert len(dataset.rows) == 26
+
+    dataset.poll_once()
+    assert sorted(document['rec_num'] for document in dataset.rows.values()) == list(range(2, 27))
+
+
+# Wait for the background thread to apply something
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def names(dataset):
+    return {document['rec_num']: document['name'] for document in dataset.snapshot()}
+
+
+# mongomock has no change streams, so these run in polling mode
+@pytest.fixture
+def polling(loaded_shelter):
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS, poll_interval=3600, reconcile_interval=3600).start()
+    assert dataset.mode == 'polling'
+    yield dataset
+    dataset.stop()
+    dataset._thread.join(5)
+
+
+def test_writes_through_the_shelter_are_refetched(polling, loaded_shelter):
+    version = polling.version
+    assert loaded_shelter.update({'rec_num': 2}, {'name': 'Renamed'}) == 1
+    wait_for(lambda: names(polling).get(2) == 'Renamed')
+    assert polling.version == version + 1
+
+    assert loaded_shelter.create(make_animal(30))
+    assert loaded_shelter.delete({'rec_num': 3}) == 1
+    wait_for(lambda: 30 in names(polling) and 3 not in names(polling))
+
+
+def test_writes_without_ids_reconcile(polling, loaded_shelter):
+    # Made behind the shelter's back, then reported without _ids
+    loaded_shelter.collection.update_one({'rec_num': 4}, {'$set': {'name': 'Changed'}})
+    loaded_shelter._invalidate(None)
+    wait_for(lambda: names(polling).get(4) == 'Changed')
+
+
+def test_reconcile_finds_updates_and_deletes_of_other_processes(loaded_shelter):
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS)
+    dataset.reload()
+    loaded_shelter.collection.update_one({'rec_num': 2}, {'$set': {'name': 'Renamed'}})
+    # Same count as before and below the watermark, so polling misses both
+    loaded_shelter.collection.delete_one({'rec_num': 5})
+    loaded_shelter.collection.insert_one(make_animal(0))
+
+    dataset.poll_once()
+    assert 5 in names(dataset) and 0 not in names(dataset) and names(dataset)[2] == 'Dog 2'
+
+    version = dataset.version
+    dataset.reconcile()
+    assert dataset.version == version + 3
+    assert names(dataset)[2] == 'Renamed'
+    assert 5 not in names(dataset) and 0 in names(dataset)
+    assert len(dataset.rows) == 25
+
+    # Nothing changed, so the version stays
+    dataset.reconcile()
+    assert dataset.version == version + 3
+
+
+def test_polling_loop_reconciles_on_schedule(loaded_shelter):
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS, poll_interval=0.02, reconcile_interval=0.1).start()
+    try:
+        loaded_shelter.collection.insert_one(make_animal(26))
+        wait_for(lambda: 26 in names(dataset))
+        loaded_shelter.collection.update_one({'rec_num': 2}, {'$set': {'name': 'Renamed'}})
+        wait_for(lambda: names(dataset)[2] == 'Renamed')
+    finally:
+        dataset.stop()
+        dataset._thread.join(5)
+    assert not dataset._thread.is_alive()
+
+
+# Refetches that fail are kept for the next poll
+def test_failed_refetch_is_retried(monkeypatch, loaded_shelter):
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS)
+    dataset.reload()
+    dataset.mode = 'polling'
+    loaded_shelter.collection.update_one({'rec_num': 2}, {'$set': {'name': 'Renamed'}})
+    dataset.refresh_ids([loaded_shelter.collection.find_one({'rec_num': 2})['_id']])
+
+    read_iter = loaded_shelter.read_iter
+    def failing(*args, **kwargs):
+        raise AutoReconnect('connection reset')
+    monkeypatch.setattr(loaded_shelter, 'read_iter', failing)
+    with pytest.raises(AutoReconnect):
+        dataset._refetch_pending()
+    monkeypatch.setattr(loaded_shelter, 'read_iter', read_iter)
+    dataset._refetch_pending()
+    assert names(dataset)[2] == 'Renamed'
+
+
+# Anything watch() raises means polling, e.g. mongomock's TypeError
+def test_stream_errors_fall_back_to_polling(monkeypatch, loaded_shelter):
+    def watch(**kwargs):
+        raise RuntimeError('no change streams here')
+    monkeypatch.setattr(loaded_shelter.collection, 'watch', watch, raising=False)
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS, poll_interval=3600).start()
+    try:
+        assert dataset.mode == 'polling'
+        assert dataset._thread.is_alive()
+    finally:
+        dataset.stop()
+        dataset._thread.join(5)
+
+
+# Read in batches of ten so a failure after the first batch leaves a partial result
+def _small_batches(read_iter):
+    return lambda query, projection=None, **options: read_iter(query, projection, batch_size=10, **options)
+
+
+def test_snapshot_round_trip(tmp_path, loaded_shelter):
+    snapshot_path = str(tmp_path / 'animals.parquet')
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS, snapshot_path=snapshot_path)
+    dataset.reload()
+    assert dataset.save_snapshot()
+
+    restored = LiveDataset(loaded_shelter, ANIMAL_FIELDS, snapshot_path=snapshot_path)
+    assert restored.load_snapshot()
+    assert restored.rows == dataset.rows
+    assert restored.watermark == 25
+    assert restored.frame.dtypes.to_dict() == dataset.frame.dtypes.to_dict()
+
+
+# Changes are kept beside the typed frame until a build of the engine folds them in
+def test_changes_fold_into_the_typed_frame(loaded_shelter):
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS)
+    dataset.reload()
+    first_id = loaded_shelter.collection.find_one({'rec_num': 1})['_id']
+    dataset.apply_change({'operationType': 'insert', 'fullDocument': {'_id': 'new', **make_animal(26, breed='Poodle')}})
+    dataset.apply_change({'operationType': 'delete', 'documentKey': {'_id': first_id}})
+    assert len(dataset.changes) == 2 and dataset.count({}) == 25
+
+    version, frame = dataset.versioned_frame()
+    assert dataset.changes == {} and len(frame) == 25
+    assert 'Poodle' in frame['breed'].cat.categories
+    assert frame['location_lat'].dtype == np.float32
+    assert names(dataset)[26] == 'Dog 26' and 1 not in names(dataset)
+    assert dataset.versioned_frame(version) == (version, None)
+
+
+# pyarrow rejects a column mixing text and numbers with an ArrowTypeError
+def test_unsaveable_rows_are_still_served(monkeypatch, tmp_path, shelter):
+    shelter.collection.insert_one({**make_animal(0), 'rec_num': '0'})
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 26)])
+    dataset = LiveDataset(shelter, ANIMAL_FIELDS, snapshot_path=str(tmp_path / 'animals.parquet'))
+    monkeypatch.setattr(dataset, '_open_stream', lambda resume_token: None)
+    dataset._load()
+    assert dataset.ready.is_set()
+    assert len(dataset.rows) == 26
+    assert not dataset.save_snapshot()
+    assert not (tmp_path / 'animals.parquet').exists()
+
+
+# Readers further behind than the change log get None and reload everything
+def test_changes_since(monkeypatch, loaded_shelter):
+    monkeypatch.setattr(live_dataset, 'CHANGE_LOG_LIMIT', 3)
+    dataset = LiveDataset(loaded_shelter, ANIMAL_FIELDS)
+    dataset.reload()
+    start = dataset.version
+    first_id = loaded_shelter.collection.find_one({'rec_num': 1})['_id']
+    dataset.apply_change({'operationType': 'insert', 'fullDocument': {'_id': 'new', **make_animal(26)}})
+    dataset.apply_change({'operationType': 'delete', 'documentKey': {'_id': first_id}})
+    version, documents, removed_ids = dataset.changes_since(start)
+    assert version == start + 2
+    assert [document['rec_num'] for document in documents] == [26] and removed_ids == [first_id]
+    assert dataset.changes_since(version) == (version, [], [])
+    assert dataset.changes_since(start, limit=1) == (version, None, None)
+
+    for rec_num in (27, 28):
+        dataset.apply_change({'operationType': 'insert', 'fullDocument': {'_id': rec_num, **make_animal(rec_num)}})
+    assert dataset.changes_since(start) == (dataset.version, None, None)
+    assert [document['rec_num'] for document in dataset.changes_since(version)[1]] == [27, 28]
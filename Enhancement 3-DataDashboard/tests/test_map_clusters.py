@@ -0,0 +1,85 @@
+import pytest
+
+from conftest import make_animal
+from crud_module import viewport_query
+
+# At zoom 10 a grid cell is 45 / 1024 degrees, about 0.044, so the first three
+# animals share a cell and the fourth is alone in another
+ANIMALS = [
+    make_animal(1, location_lat=30.24, location_long=-97.75),
+    make_animal(2, location_lat=30.25, location_long=-97.76),
+    make_animal(3, location_lat=30.26, location_long=-97.74, animal_type='Cat'),
+    make_animal(4, location_lat=30.40, location_long=-97.60, name='Solo', breed='Pug'),
+]
+
+# Covers the first cell but not the fourth animal
+DOWNTOWN = [[30.2, -97.8], [30.3, -97.7]]
+
+
+def fill(shelter):
+    for animal in ANIMALS:
+        assert shelter.create(animal)
+    # No coordinates, so no location_point and never on the map
+    assert shelter.create(make_animal(5, location_lat=None, location_long=None))
+    return shelter
+
+
+@pytest.fixture
+def mapped(shelter):
+    return fill(shelter)
+
+
+def test_animals_are_binned_into_grid_cells(mapped):
+    clusters = mapped.map_clusters({}, zoom=10)
+    assert [cluster['count'] for cluster in clusters] == [3, 1]
+    assert clusters[0]['lat'] == pytest.approx(30.25)
+    assert clusters[0]['lng'] == pytest.approx(-97.75)
+
+
+def test_a_lone_animal_comes_back_as_its_own_point(mapped):
+    clusters = mapped.map_clusters({}, zoom=10)
+    assert clusters[1] == {'count': 1, 'lat': 30.40, 'lng': -97.60, 'name': 'Solo', 'breed': 'Pug'}
+    # Larger cells only report a count and position
+    assert 'name' not in clusters[0] and 'breed' not in clusters[0]
+
+
+def test_lower_zoom_merges_cells(mapped):
+    clusters = mapped.map_clusters({}, zoom=3)
+    assert [cluster['count'] for cluster in clusters] == [4]
+    assert 'name' not in clusters[0]
+
+
+def test_query_is_applied_before_binning(mapped):
+    clusters = mapped.map_clusters({'animal_type': 'Cat'}, zoom=10)
+    assert clusters == [{'count': 1, 'lat': 30.26, 'lng': -97.74, 'name': 'Dog 3',
+                         'breed': 'Labrador Retriever Mix'}]
+
+
+def test_max_cells_keeps_the_largest(mapped):
+    assert [cluster['count'] for cluster in mapped.map_clusters({}, zoom=10, max_cells=1)] == [3]
+
+
+def test_viewport_query_is_the_bounds_polygon():
+    assert viewport_query(DOWNTOWN) == {'location_point': {'$geoWithin': {'$geometry': {
+        'type': 'Polygon',
+        'coordinates': [[[-97.8, 30.2], [-97.7, 30.2], [-97.7, 30.3], [-97.8, 30.3], [-97.8, 30.2]]]}}}}
+
+
+def test_viewport_wider_than_a_hemisphere_is_not_filtered():
+    assert viewport_query([[-80, -170], [80, 170]]) == {}
+
+
+def test_viewport_is_combined_with_the_query(mapped):
+    match = mapped._map_cluster_pipeline({'animal_type': 'Dog'}, DOWNTOWN, 10, 2000)[0]['$match']
+    assert match == {'$and': [{'animal_type': 'Dog'}, viewport_query(DOWNTOWN)]}
+    assert mapped._map_cluster_pipeline({}, DOWNTOWN, 10, 2000)[0]['$match'] == viewport_query(DOWNTOWN)
+
+
+# mongomock has no $geoWithin, so the viewport filter itself needs a server
+def test_viewport_leaves_out_animals_outside_the_bounds(server_shelter):
+    server_shelter.ensure_indexes()
+    fill(server_shelter)
+    clusters = server_shelter.map_clusters({}, bounds=DOWNTOWN, zoom=10)
+    assert [cluster['count'] for cluster in clusters] == [3]
+    clusters = server_shelter.map_clusters({'animal_type': 'Cat'}, bounds=DOWNTOWN, zoom=10)
+    assert [(cluster['count'], cluster['name']) for cluster in clusters] == [(1, 'Dog 3')]
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import metrics
+from metrics import COMMAND_METRICS, ContextThreadPoolExecutor, MetricsRegistry, instrumented
+
+
+def worker_registry(directory, pid):
+    registry = MetricsRegistry(str(directory), pid=pid)
+    return registry, registry.counter('requests_total', 'Requests.', ['path']), registry.histogram('seconds', 'Time.')
+
+
+# Every worker's values are summed, whichever worker answers the scrape
+def test_workers_sharing_a_directory_report_their_sum(tmp_path):
+    first, first_requests, first_seconds = worker_registry(tmp_path, 1)
+    second, second_requests, second_seconds = worker_registry(tmp_path, 2)
+    first_requests.inc(path='/')
+    second_requests.inc(2, path='/')
+    second_requests.inc(path='/metrics')
+    first_seconds.observe(0.002)
+    second_seconds.observe(3.0)
+    second.flush()
+
+    text = first.render()
+    assert 'requests_total{path="/"} 3' in text
+    assert 'requests_total{path="/metrics"} 1' in text
+    assert 'seconds_bucket{le="0.005"} 1' in text
+    assert 'seconds_count 2' in text
+    assert second.render() == text
+
+
+# Commands issued on query pool threads belong to the callback that submitted them
+def test_slow_callbacks_log_commands_run_on_the_query_pool(monkeypatch, capsys):
+    monkeypatch.setattr(metrics, 'SLOW_CALLBACK_SECONDS', 1e-9)
+    pool = ContextThreadPoolExecutor(max_workers=2)
+
+    def count():
+        COMMAND_METRICS.started(SimpleNamespace(command_name='count', command={'query': {'breed': 'Poodle'}}))
+
+    @instrumented('test_callback')
+    def callback():
+        pool.submit(count).result()
+        return []
+
+    callback()
+    pool.shutdown()
+    assert "mongo=[\"count {'breed': 'Poodle'}\"]" in capsys.readouterr().out
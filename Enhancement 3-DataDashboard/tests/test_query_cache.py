@@ -0,0 +1,100 @@
+from pymongo.errors import ServerSelectionTimeoutError
+import pytest
+
+from conftest import make_animal
+from crud_module import QueryCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = QueryCache(max_entries=8, ttl=60, clock=clock)
+    cache.put('key', 'value')
+    clock.now += 59.9
+    assert cache.get('key') == (True, 'value')
+    clock.now += 0.1
+    assert cache.get('key') == (False, None)
+    assert cache.stats()['entries'] == 0
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+
+def test_put_restarts_the_ttl(clock):
+    cache = QueryCache(max_entries=8, ttl=60, clock=clock)
+    cache.put('key', 'old')
+    clock.now += 50
+    cache.put('key', 'new')
+    clock.now += 50
+    assert cache.get('key') == (True, 'new')
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = QueryCache(max_entries=3, ttl=60, clock=clock)
+    for key in 'abc':
+        cache.put(key, key)
+    # Reading a makes b the least recently used
+    assert cache.get('a') == (True, 'a')
+    cache.put('d', 'd')
+    assert cache.get('b') == (False, None)
+    assert [cache.get(key)[0] for key in 'acd'] == [True, True, True]
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['entries'] == 3
+
+
+def test_make_key_ignores_dict_order():
+    assert QueryCache.make_key('read', {'a': 1, 'b': 2}) == QueryCache.make_key('read', {'b': 2, 'a': 1})
+    assert QueryCache.make_key('read', {'a': 1}) != QueryCache.make_key('count', {'a': 1})
+
+
+@pytest.fixture
+def cached_shelter(shelter, clock):
+    shelter.cache = QueryCache(max_entries=16, ttl=60, clock=clock)
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 4)])
+    return shelter
+
+
+def test_repeated_reads_are_served_from_the_cache(cached_shelter):
+    assert cached_shelter.count({'animal_type': 'Dog'}) == 3
+    # A write that bypasses the shelter is not seen until the entry expires
+    cached_shelter.collection.insert_one(make_animal(4))
+    assert cached_shelter.count({'animal_type': 'Dog'}) == 3
+    assert cached_shelter.cache_stats()['hits'] == 1
+
+
+def test_expired_reads_are_recomputed(cached_shelter, clock):
+    assert cached_shelter.count({'animal_type': 'Dog'}) == 3
+    cached_shelter.collection.insert_one(make_animal(4))
+    clock.now += 61
+    assert cached_shelter.count({'animal_type': 'Dog'}) == 4
+
+
+@pytest.mark.parametrize('write', [
+    lambda shelter: shelter.create(make_animal(4)),
+    lambda shelter: shelter.create_many([make_animal(4), make_animal(5)]),
+    lambda shelter: shelter.update({'rec_num': 1}, {'animal_type': 'Cat'}),
+    lambda shelter: shelter.delete({'rec_num': 1}),
+])
+def test_writes_invalidate_cached_reads(cached_shelter, write):
+    before = cached_shelter.read({'animal_type': 'Dog'}, {'_id': 0, 'rec_num': 1})
+    write(cached_shelter)
+    after = cached_shelter.read({'animal_type': 'Dog'}, {'_id': 0, 'rec_num': 1})
+    assert after != before
+    assert cached_shelter.cache_stats()['invalidations'] == 1
+
+
+def test_failed_reads_are_not_cached(cached_shelter):
+    def aggregate(*args, **kwargs):
+        raise ServerSelectionTimeoutError('no servers')
+    cached_shelter.collection.aggregate = aggregate
+    assert cached_shelter.count_by('breed') == ([], 0)
+    assert cached_shelter.cache_stats()['entries'] == 0
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from conftest import make_animal
+from rescue_profiles import RescueRegistry, compile_profile
+
+
+class ExplainingDatabase(object):
+    """ Answers explain like MongoDB, with an index scan only for indexed leading fields """
+
+    def __init__(self, collection, indexed_fields):
+        self.collection = collection
+        self.indexed_fields = indexed_fields
+
+    def command(self, name, command, verbosity=None):
+        assert name == 'explain'
+        query = command['filter']
+        if command.get('hint') or any(field in self.indexed_fields for field in query):
+            plan = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': command.get('hint')}}
+        else:
+            plan = {'stage': 'COLLSCAN'}
+        return {'queryPlanner': {'winningPlan': plan},
+                'executionStats': {'nReturned': self.collection.count_documents(query)}}
+
+
+@pytest.fixture
+def registry(shelter):
+    shelter.collection.insert_many([make_animal(1), make_animal(2, breed='German Shepherd', animal_type='Dog')])
+    shelter.ensure_indexes()
+    return RescueRegistry(shelter)
+
+
+def test_profiles_compile_to_breed_lists_with_hints(registry):
+    water = registry.get('Water')
+    assert water.query['breed'] == {'$in': ['Labrador Retriever Mix']}
+    assert water.hint == 'sex_breed_age'
+    assert registry.get('Cats').hint == 'animal_type_id'
+    assert registry.query('Unknown') == {}
+
+
+def test_every_profile_uses_an_index(registry, monkeypatch):
+    monkeypatch.setattr(registry.shelter, 'database', ExplainingDatabase(registry.shelter.collection, set()))
+    assert all(registry.uses_index(name) for name in registry.compiled)
+    assert registry.report_collection_scans() == []
+
+
+# Without the indexes the hints are gone and the explain shows a collection scan
+def test_collection_scans_are_reported(shelter, monkeypatch, capsys):
+    registry = RescueRegistry(shelter)
+    monkeypatch.setattr(shelter, 'database', ExplainingDatabase(shelter.collection, {'animal_type'}))
+    assert not registry.uses_index('Water')
+    assert registry.report_collection_scans() == ['Water', 'Mountain', 'Disaster', 'Service']
+    assert 'Rescue filter Water is not using an index, its plan is COLLSCAN' in capsys.readouterr().out
+
+
+def test_regex_form_without_a_breed_list():
+    query = compile_profile('Service', {'breeds': ['Labrador Retriever'], 'min_weeks': 52}).query
+    assert query == {'breed': {'$regex': 'Labrador\\ Retriever'}, 'age_upon_outcome_in_weeks': {'$gt': 52}}
+
+
+# A breed spelling first written after the profiles were compiled is matched at once
+def test_new_breeds_written_through_the_shelter_recompile(registry):
+    registry.start(interval=0)
+    assert registry.shelter.create(make_animal(3, breed='Labrador Retriever/Poodle'))
+    assert 'Labrador Retriever/Poodle' in registry.query('Service')['breed']['$in']
+
+    compiled = registry.compiled
+    assert registry.shelter.update({'rec_num': 3}, {'name': 'Same breed'}) == 1
+    assert registry.compiled is compiled
+
+
+def test_schedule_picks_up_breeds_written_elsewhere(registry):
+    registry.shelter.collection.insert_one(make_animal(3, breed='Newfoundland Mix'))
+    registry.start(interval=0.01)
+    try:
+        deadline = time.monotonic() + 5
+        while 'Newfoundland Mix' not in registry.query('Water')['breed']['$in']:
+            assert time.monotonic() < deadline, 'timed out'
+            time.sleep(0.01)
+    finally:
+        registry.stop()
@@ -0,0 +1,33 @@
+from conftest import make_animal
+from crud_module import AAC_FIELDS
+from rescue_profiles import RescueRegistry
+from rescue_views import RescueViews
+
+
+def make_views(shelter):
+    return RescueViews(shelter, RescueRegistry(shelter, refresh=False), AAC_FIELDS)
+
+
+def test_refresh_builds_each_view(shelter):
+    shelter.collection.insert_many([make_animal(1, age_upon_outcome_in_weeks=40.0),
+                                    make_animal(2, age_upon_outcome_in_weeks=400.0),
+                                    make_animal(3, breed='Newfoundland Mix', sex_upon_outcome='Intact Male')])
+    views = make_views(shelter)
+    assert views.get('Water') is None
+    assert views.refresh()
+    assert views.counts() == {'Water': 1, 'Mountain': 0, 'Disaster': 0, 'Service': 1}
+    assert views.get('Water').read({}, {'_id': 0, 'rec_num': 1}) == [{'rec_num': 1}]
+
+
+# A reader never builds the views, it only uses them once a refresher has
+def test_attached_reader_waits_for_the_refresher(shelter):
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 4)])
+    reader = make_views(shelter)
+    reader.attach(interval=0.01)
+    assert not reader.ready.wait(0.1)
+    assert shelter.database.list_collection_names() == ['animals']
+
+    make_views(shelter).refresh()
+    assert reader.ready.wait(5)
+    assert reader.get('Water').count({}) == 3
+    reader.stop()
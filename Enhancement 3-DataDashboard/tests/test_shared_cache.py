@@ -0,0 +1,56 @@
+import os
+import stat
+
+import pytest
+
+from conftest import make_animal
+from crud_module import QueryCache
+from shared_cache import FileQueryCache
+
+
+@pytest.fixture(params=['memory', 'file'])
+def cache(request, tmp_path):
+    if request.param == 'file':
+        return FileQueryCache(str(tmp_path / 'cache'), max_entries=64, ttl=60)
+    return QueryCache(max_entries=64, ttl=60)
+
+
+def test_file_cache_directory_is_private(tmp_path):
+    directory = tmp_path / 'cache'
+    FileQueryCache(str(directory))
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+def test_file_cache_refuses_a_shared_directory(tmp_path):
+    directory = tmp_path / 'shared'
+    directory.mkdir()
+    os.chmod(directory, 0o777)
+    with pytest.raises(RuntimeError):
+        FileQueryCache(str(directory))
+
+
+def test_get_put_clear(cache):
+    assert cache.get('key') == (False, None)
+    cache.put('key', [])
+    assert cache.get('key') == (True, [])
+    cache.clear()
+    assert cache.get('key') == (False, None)
+    assert cache.stats()['invalidations'] == 1
+
+
+# Every kind of write through the shelter must drop cached reads
+@pytest.mark.parametrize('write', [
+    lambda shelter: shelter.create(make_animal(99)),
+    lambda shelter: shelter.create_many([make_animal(99)]),
+    lambda shelter: shelter.update({'rec_num': 1}, {'name': 'Renamed'}),
+    lambda shelter: shelter.delete({'rec_num': 1}),
+])
+def test_writes_invalidate_cached_reads(shelter, cache, write):
+    shelter.cache = cache
+    shelter.collection.insert_many([make_animal(rec_num) for rec_num in range(1, 4)])
+    before = shelter.read({}, {'_id': 0, 'rec_num': 1, 'name': 1})
+    assert shelter.read({}, {'_id': 0, 'rec_num': 1, 'name': 1}) == before
+    assert cache.stats()['hits'] == 1
+
+    write(shelter)
+    assert shelter.read({}, {'_id': 0, 'rec_num': 1, 'name': 1}) != before
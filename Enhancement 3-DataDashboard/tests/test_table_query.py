@@ -0,0 +1,61 @@
+import pytest
+
+from table_query import combine_queries, split_filter_part, translate_filter, translate_sort
+
+
+@pytest.mark.parametrize('filter_part, expected', [
+    ('{rec_num} >= 5', ('rec_num', '$gte', 5, None)),
+    ('{rec_num} ge 5', ('rec_num', '$gte', 5, None)),
+    ('{rec_num} < 2.5', ('rec_num', '$lt', 2.5, None)),
+    ('{breed} scontains Beagle', ('breed', 'contains', 'Beagle', 's')),
+    ('{breed} icontains beagle', ('breed', 'contains', 'beagle', 'i')),
+    ('{name} = "Max"', ('name', '$eq', 'Max', None)),
+    ('{date_of_birth} datestartswith 2015', ('date_of_birth', 'datestartswith', 2015, None)),
+    ('not a filter', (None, None, None, None)),
+])
+def test_split_filter_part(filter_part, expected):
+    assert split_filter_part(filter_part) == expected
+
+
+# Operator words inside the value used to be taken for the operator
+@pytest.mark.parametrize('filter_query, expected', [
+    ('{breed} scontains "Beagle Mix"', {'breed': {'$regex': 'Beagle\\ Mix'}}),
+    ('{breed} contains Poodle Mix', {'breed': {'$regex': 'Poodle\\ Mix', '$options': 'i'}}),
+    ('{name} scontains Belle ', {'name': {'$regex': 'Belle'}}),
+    ('{name} contains Angel', {'name': {'$regex': 'Angel', '$options': 'i'}}),
+    ('{name} eq "the gt one"', {'name': {'$eq': 'the gt one'}}),
+    ('{outcome_type} = Return to Owner', {'outcome_type': {'$eq': 'Return to Owner'}}),
+])
+def test_translate_filter_values_containing_operator_words(filter_query, expected):
+    assert translate_filter(filter_query) == expected
+
+
+def test_translate_filter_case_prefixes():
+    assert translate_filter('{breed} icontains lab') == {'breed': {'$regex': 'lab', '$options': 'i'}}
+    assert translate_filter('{breed} scontains Lab') == {'breed': {'$regex': 'Lab'}}
+    assert translate_filter('{name} ieq max') == {'name': {'$regex': '^max$', '$options': 'i'}}
+
+
+def test_translate_filter_numbers_match_either_representation():
+    assert translate_filter('{rec_num} = 5') == {'rec_num': {'$in': [5, '5']}}
+    assert translate_filter('{rec_num} != 5') == {'rec_num': {'$not': {'$in': [5, '5']}}}
+
+
+def test_translate_filter_combines_parts():
+    assert translate_filter('{rec_num} > 5 && {breed} contains lab') == {'$and': [
+        {'rec_num': {'$gt': 5}},
+        {'breed': {'$regex': 'lab', '$options': 'i'}},
+    ]}
+    assert translate_filter('') == {}
+    assert translate_filter(None) == {}
+
+
+def test_translate_sort_breaks_ties_on_id():
+    assert translate_sort([{'column_id': 'name', 'direction': 'desc'}]) == [('name', -1), ('_id', 1)]
+    assert translate_sort(None) == [('_id', 1)]
+
+
+def test_combine_queries_skips_empty():
+    assert combine_queries({}, {'a': 1}) == {'a': 1}
+    assert combine_queries({'a': 1}, {'b': 2}) == {'$and': [{'a': 1}, {'b': 2}]}
+    assert combine_queries() == {}